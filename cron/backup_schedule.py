@@ -1,10 +1,17 @@
 # https://habr.com/ru/articles/779520/
+import hashlib
+import json
 import logging
 import os
 import re
+import shlex
+import shutil
+import subprocess
 import sys
 import tempfile
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
@@ -19,7 +26,10 @@ BACKUPS_LOGFILE = Path(str(BASE_DIR) + "/logs/backups_log.log")
 BACKUP_FILENAME_TEMPLATE = "server_prod_{now}.tar.gz"
 SQLDUMP_FILENAME_TEMPLATE = "server_prod_{now}.sql"
 PG_DUMP_COMMAND_TEMPLATE = "PGPASSWORD='{password}' pg_dump -U {user} {database} -p {port} -h {host} > {filename}"
-TAR_COMMAND_TEMPLATE = "tar -czf {archive_filename} -C {dump_dirname} {dump_filename} -C {media_dirpath} {media_dirname}"
+TAR_COMMAND_TEMPLATE = (
+    "tar -czf {archive_filename} --exclude='.upload-*' "
+    "-C {dump_dirname} {dump_filename} -C {media_dirpath} {media_dirname}"
+)
 MEDIA_DIRPATH = Path(str(BASE_DIR) + "/public")
 MEDIA_DIRNAME = "mediafiles"
 FILENAME_DATETIME_FORMAT = "%d.%m.%Y_%H:%M:%S"
@@ -36,6 +46,27 @@ BACKUPS_TIMETABLE = [
 DUMP_MINIMAL_FILESIZE_MB = 0
 DUMP_MINIMAL_FILESIZE = DUMP_MINIMAL_FILESIZE_MB * 1024 * 1024
 
+# incremental - каталог с дампом, сжатым на лету многопоточным компрессором,
+# и медиафайлами, где неизмененные с прошлого бэкапа файлы - жесткие ссылки;
+# tar - прежний полный архив
+BACKUP_MODE = os.getenv("BACKUP_MODE", "incremental")
+BACKUP_DIRNAME_TEMPLATE = "server_prod_{now}"
+BACKUP_NAME_RE = re.compile(
+    r"^server_prod_(\d{2}\.\d{2}\.\d{4}_\d{2}:\d{2}:\d{2})(\.tar\.gz)?$"
+)
+PARTIAL_SUFFIX = ".partial"
+MANIFEST_FILENAME = "manifest.json"
+MEDIA_BACKUP_DIRNAME = "media"
+COMPRESSED_SQLDUMP_FILENAME = "database.sql.zst"
+# directory - pg_dump -Fd -j: таблицы выгружаются параллельно, и восстановить
+# их можно параллельно через pg_restore -j (cron/restore_backup.py);
+# plain - SQL, сжатый на лету COMPRESS_COMMAND, восстанавливается одним psql
+DUMP_FORMAT = os.getenv("BACKUP_DUMP_FORMAT", "directory")
+DUMP_JOBS = int(os.getenv("BACKUP_DUMP_JOBS", "0")) or os.cpu_count()
+DIRECTORY_DUMP_DIRNAME = "database"
+COMPRESS_COMMAND = os.getenv("BACKUP_COMPRESS_COMMAND", "zstd -T0 -3 -q -c")
+COPY_CHUNK_SIZE = 1024 * 1024
+
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_DB = os.getenv("POSTGRES_DB")
@@ -75,8 +106,11 @@ init_logger(
 def main():
     now = datetime.now()
     now_str = now.strftime(FILENAME_DATETIME_FORMAT)
-    log.info(f"Backup script started: {now_str}")
-    create_backup_file(now_str)
+    log.info(f"Backup script started: {now_str}, mode = {BACKUP_MODE}")
+    if BACKUP_MODE == "tar":
+        create_backup_file(now_str)
+    else:
+        create_incremental_backup(now_str)
     rotate_backups(now)
     log.warning(
         f"Backup prod data script was successfully ended. timestamp: {now_str}\n\n"
@@ -125,6 +159,229 @@ def create_dump_postgres(now, dump_filename):
         sys.exit(10)
 
 
+def postgres_env():
+    # Пароль через окружение, чтобы он не попадал в лог вместе с командой
+    return {**os.environ, "PGPASSWORD": POSTGRES_PASSWORD or ""}
+
+
+def postgres_args():
+    return ["-U", POSTGRES_USER, "-p", "5432", "-h", POSTGRES_HOST]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(root, jobs):
+    """Размеры и sha256 файлов каталога, хеши считаются в jobs потоков"""
+    paths = sorted(path for path in root.rglob("*") if path.is_file())
+    with ThreadPoolExecutor(jobs) as executor:
+        hashes = list(executor.map(file_sha256, paths))
+    return {
+        path.relative_to(root).as_posix(): {
+            "size": path.stat().st_size,
+            "sha256": sha256,
+        }
+        for path, sha256 in zip(paths, hashes)
+    }
+
+
+def dump_postgres_directory(dirpath, database=POSTGRES_DB, jobs=DUMP_JOBS):
+    """pg_dump в формате каталога в jobs соединений, по файлу на таблицу"""
+    command = [
+        "pg_dump",
+        *postgres_args(),
+        "-Fd",
+        "-j",
+        str(jobs),
+        "-f",
+        str(dirpath),
+        database,
+    ]
+    result = subprocess.run(command, env=postgres_env())
+    if result.returncode != 0:
+        log.error(f"pg_dump failed with code {result.returncode}, command = {command}")
+        sys.exit(10)
+    files = hash_files(dirpath, jobs)
+    size = sum(entry["size"] for entry in files.values())
+    if size < DUMP_MINIMAL_FILESIZE:
+        log.warning(
+            f"database dump filesize is too small {size} bytes. Expected to be more than {DUMP_MINIMAL_FILESIZE} bytes"
+        )
+    return {
+        "dir": dirpath.name,
+        "format": "directory",
+        "jobs": jobs,
+        "size": size,
+        "files": files,
+    }
+
+
+def dump_postgres_compressed(filepath, database=POSTGRES_DB):
+    """
+    pg_dump сразу в многопоточный компрессор без промежуточного файла.
+    Сжатый поток пишется в файл и одновременно хешируется.
+    """
+    dump_command = ["pg_dump", *postgres_args(), database]
+    compress_command = shlex.split(COMPRESS_COMMAND)
+    digest = hashlib.sha256()
+    size = 0
+    dump = subprocess.Popen(dump_command, stdout=subprocess.PIPE, env=postgres_env())
+    compress = subprocess.Popen(
+        compress_command, stdin=dump.stdout, stdout=subprocess.PIPE
+    )
+    # Компрессор должен получить SIGPIPE, если pg_dump завершится
+    dump.stdout.close()
+    with open(filepath, "wb") as file:
+        while chunk := compress.stdout.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+            file.write(chunk)
+            size += len(chunk)
+    compress.stdout.close()
+    dump_result = dump.wait()
+    compress_result = compress.wait()
+    if dump_result != 0:
+        log.error(f"pg_dump failed with code {dump_result}, command = {dump_command}")
+        sys.exit(10)
+    if compress_result != 0:
+        log.error(
+            f"compressor failed with code {compress_result}, "
+            f"command = {compress_command}"
+        )
+        sys.exit(30)
+    if size < DUMP_MINIMAL_FILESIZE:
+        log.warning(
+            f"database dump filesize is too small {size} bytes. Expected to be more than {DUMP_MINIMAL_FILESIZE} bytes"
+        )
+    return {
+        "file": filepath.name,
+        "format": "plain",
+        "size": size,
+        "sha256": digest.hexdigest(),
+    }
+
+
+def find_previous_backup():
+    """Последний завершенный инкрементальный бэкап: каталог с манифестом"""
+    backups = []
+    for path in BACKUPS_PATH.iterdir():
+        found = BACKUP_NAME_RE.match(path.name)
+        if found and path.is_dir() and (path / MANIFEST_FILENAME).exists():
+            timestamp = datetime.strptime(found.group(1), FILENAME_DATETIME_FORMAT)
+            backups.append((timestamp, path))
+    if not backups:
+        return None, {}
+    path = max(backups)[1]
+    with open(path / MANIFEST_FILENAME, encoding="utf8") as file:
+        return path, json.load(file)
+
+
+def copy_media_file(source, stat, target, entry, previous_dir, previous_by_hash):
+    """
+    Переносит файл в бэкап: жесткая ссылка на копию из прошлого бэкапа, если
+    файл не менялся или совпадает с ней по содержимому, иначе копирование.
+    Неизмененный по размеру и времени файл не читается.
+
+    Returns:
+        (sha256, True если файл скопирован).
+    """
+    if entry and (entry["size"], entry["mtime_ns"]) == (
+        stat.st_size,
+        stat.st_mtime_ns,
+    ):
+        sha256 = entry["sha256"]
+    else:
+        sha256 = file_sha256(source)
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    previous = previous_by_hash.get(sha256)
+    if previous is not None:
+        try:
+            os.link(previous_dir / previous, target)
+            return sha256, False
+        except OSError:
+            # Файла нет или у него предельное число ссылок
+            pass
+    shutil.copy2(source, target)
+    return sha256, True
+
+
+def backup_media(target_dir, previous_dir, previous_files):
+    media_root = MEDIA_DIRPATH / MEDIA_DIRNAME
+    previous_by_hash = {
+        entry["sha256"]: f"{MEDIA_BACKUP_DIRNAME}/{name}"
+        for name, entry in previous_files.items()
+    }
+    files = {}
+    copied = 0
+    copied_bytes = 0
+    for directory, _, filenames in os.walk(media_root):
+        for filename in filenames:
+            # Недописанные загрузки хранилища изображений
+            if filename.startswith(".upload-"):
+                continue
+            source = Path(directory) / filename
+            name = source.relative_to(media_root).as_posix()
+            stat = source.stat()
+            sha256, is_copied = copy_media_file(
+                source,
+                stat,
+                target_dir / MEDIA_BACKUP_DIRNAME / name,
+                previous_files.get(name),
+                previous_dir,
+                previous_by_hash,
+            )
+            files[name] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": sha256,
+            }
+            if is_copied:
+                copied += 1
+                copied_bytes += stat.st_size
+    return files, copied, copied_bytes
+
+
+def create_incremental_backup(now):
+    started = time.monotonic()
+    backup_dir = BACKUPS_PATH / BACKUP_DIRNAME_TEMPLATE.format(now=now)
+    partial_dir = backup_dir.with_name(backup_dir.name + PARTIAL_SUFFIX)
+    # Остатки прерванных запусков
+    for path in BACKUPS_PATH.glob("*" + PARTIAL_SUFFIX):
+        shutil.rmtree(path, ignore_errors=True)
+    partial_dir.mkdir(parents=True)
+
+    previous_dir, previous_manifest = find_previous_backup()
+    if DUMP_FORMAT == "directory":
+        database = dump_postgres_directory(partial_dir / DIRECTORY_DUMP_DIRNAME)
+    else:
+        database = dump_postgres_compressed(partial_dir / COMPRESSED_SQLDUMP_FILENAME)
+    dumped = time.monotonic()
+    files, copied, copied_bytes = backup_media(
+        partial_dir, previous_dir, previous_manifest.get("media", {})
+    )
+
+    manifest = {
+        "created": now,
+        "previous": previous_dir.name if previous_dir else None,
+        "database": database,
+        "media": files,
+    }
+    with open(partial_dir / MANIFEST_FILENAME, "w", encoding="utf8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    # Каталог без суффикса - признак завершенного бэкапа
+    partial_dir.rename(backup_dir)
+    log.info(
+        f"database dump {database['size']} bytes in {dumped - started:.1f}s, "
+        f"media: {len(files)} files, {copied} copied ({copied_bytes} bytes), "
+        f"{len(files) - copied} linked, total {time.monotonic() - started:.1f}s"
+    )
+
+
 def rotate_backups(now):
     def add_backup(intervals, backup):
         for interval in intervals:
@@ -144,7 +401,11 @@ def rotate_backups(now):
             for i in range(len(backups) - 1):
                 filename = backups[i]["filename"]
                 log.info(f"DELETING EXTRA BACKUP: {filename}")
-                os.remove(filename)
+                # Файлы каталога - жесткие ссылки, другие бэкапы их не теряют
+                if filename.is_dir():
+                    shutil.rmtree(filename)
+                else:
+                    os.remove(filename)
                 backups[i]["status"] = "deleted"
 
     # log.info("rotate_backups started")
@@ -163,11 +424,11 @@ def rotate_backups(now):
         )
 
     for filename in BACKUPS_PATH.iterdir():
-        if filename.is_dir():
+        if filename.is_dir() and not (filename / MANIFEST_FILENAME).exists():
             # log.warning(f"unexpected directory: {filename}")
             pass
         else:
-            found = re.search("server_prod_(.+).tar.gz", filename.name)
+            found = BACKUP_NAME_RE.match(filename.name)
             if found is None:
                 # log.warning(f"found file without date in name: {filename}")
                 pass
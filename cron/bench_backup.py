@@ -0,0 +1,146 @@
+"""
+Сравнение времени дампа и восстановления базы в двух форматах бэкапа:
+plain (pg_dump | zstd, восстановление одним psql) и directory (pg_dump -Fd -j,
+pg_restore -j) на сгенерированных данных.
+
+Нужен PostgreSQL с правом CREATE DATABASE по настройкам POSTGRES_* из .env,
+например локальный контейнер postgres:15:
+
+    poetry run python cron/bench_backup.py --tables 8 --rows 500000 --jobs 4
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from backup_schedule import (
+    dump_postgres_compressed,
+    dump_postgres_directory,
+    postgres_args,
+    postgres_env,
+)
+from restore_backup import restore_database
+
+SOURCE_DATABASE = "barter_backup_bench"
+RESTORE_DATABASE = "barter_backup_bench_restore"
+
+
+def run_sql(sql, database="postgres"):
+    subprocess.run(
+        ["psql", *postgres_args(), "-q", "-v", "ON_ERROR_STOP=1", "-d", database],
+        input=sql,
+        text=True,
+        stdout=subprocess.DEVNULL,
+        env=postgres_env(),
+        check=True,
+    )
+
+
+def query_value(sql, database):
+    result = subprocess.run(
+        ["psql", *postgres_args(), "-At", "-d", database, "-c", sql],
+        capture_output=True,
+        text=True,
+        env=postgres_env(),
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def recreate_database(name):
+    run_sql(f"DROP DATABASE IF EXISTS {name};")
+    run_sql(f"CREATE DATABASE {name};")
+
+
+def generate_dataset(tables, rows):
+    """Таблицы, похожие на объявления: текст, время и индексы, которые строит restore"""
+    recreate_database(SOURCE_DATABASE)
+    for table in range(tables):
+        run_sql(
+            f"""
+            CREATE TABLE bench_{table} (
+                id bigint PRIMARY KEY,
+                title text NOT NULL,
+                description text NOT NULL,
+                created_at timestamptz NOT NULL
+            );
+            INSERT INTO bench_{table}
+            SELECT g, md5(g::text), repeat(md5((g * {table + 1})::text), 8),
+                   now() - g * interval '1 second'
+            FROM generate_series(1, {rows}) AS g;
+            CREATE INDEX ON bench_{table} (created_at);
+            CREATE INDEX ON bench_{table} (title);
+            """,
+            database=SOURCE_DATABASE,
+        )
+
+
+def bench_format(dump_format, workdir, jobs):
+    started = time.monotonic()
+    if dump_format == "directory":
+        database = dump_postgres_directory(
+            workdir / "database", database=SOURCE_DATABASE, jobs=jobs
+        )
+    else:
+        database = dump_postgres_compressed(
+            workdir / "database.sql.zst", database=SOURCE_DATABASE
+        )
+    dump_seconds = time.monotonic() - started
+
+    recreate_database(RESTORE_DATABASE)
+    started = time.monotonic()
+    result = restore_database(workdir, database, RESTORE_DATABASE, jobs)
+    restore_seconds = time.monotonic() - started
+    if result != 0:
+        sys.exit(f"{dump_format} restore failed with code {result}")
+
+    rows = query_value("SELECT count(*) FROM bench_0", RESTORE_DATABASE)
+    return dump_seconds, restore_seconds, database["size"], rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк форматов дампа базы")
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--keep", action="store_true", help="Не удалять тестовые базы")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    generate_dataset(args.tables, args.rows)
+    size = query_value(
+        f"SELECT pg_size_pretty(pg_database_size('{SOURCE_DATABASE}'))",
+        SOURCE_DATABASE,
+    )
+    sys.stdout.write(
+        f"dataset: {args.tables} tables x {args.rows} rows, {size}, "
+        f"generated in {time.monotonic() - started:.1f}s, jobs = {args.jobs}\n"
+    )
+
+    sys.stdout.write(
+        f"{'format':<10} {'dump, s':>9} {'restore, s':>11} {'size, MB':>9}\n"
+    )
+    try:
+        for dump_format in ("plain", "directory"):
+            with tempfile.TemporaryDirectory() as workdir:
+                dump_seconds, restore_seconds, dump_size, rows = bench_format(
+                    dump_format, Path(workdir), args.jobs
+                )
+            if int(rows) != args.rows:
+                sys.exit(f"{dump_format}: restored {rows} rows of {args.rows}")
+            sys.stdout.write(
+                f"{dump_format:<10} {dump_seconds:>9.1f} {restore_seconds:>11.1f} "
+                f"{dump_size / 1024 / 1024:>9.1f}\n"
+            )
+    finally:
+        if not args.keep:
+            run_sql(f"DROP DATABASE IF EXISTS {RESTORE_DATABASE};")
+            run_sql(f"DROP DATABASE IF EXISTS {SOURCE_DATABASE};")
+
+
+if __name__ == "__main__":
+    main()
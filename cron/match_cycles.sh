@@ -0,0 +1,4 @@
+#!/bin/bash
+export HOME=/home/app
+cd /home/app/
+/usr/local/bin/poetry run python src/manage.py match_cycles
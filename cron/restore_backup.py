@@ -0,0 +1,195 @@
+"""
+Восстановление бэкапа, созданного cron/backup_schedule.py в режиме incremental.
+
+    poetry run python cron/restore_backup.py backups/server_prod_<дата> --jobs 8
+
+Сначала проверяет sha256 всех файлов по манифесту, затем восстанавливает базу
+(pg_restore -j для формата каталога, распаковка в psql для сжатого SQL) и
+медиафайлы. Время каждого этапа пишется в лог бэкапов.
+"""
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from backup_schedule import (
+    MANIFEST_FILENAME,
+    MEDIA_BACKUP_DIRNAME,
+    MEDIA_DIRNAME,
+    MEDIA_DIRPATH,
+    POSTGRES_DB,
+    file_sha256,
+    log,
+    postgres_args,
+    postgres_env,
+)
+
+DECOMPRESS_COMMAND = os.getenv("BACKUP_DECOMPRESS_COMMAND", "zstd -dc -q")
+
+
+def load_manifest(backup_dir):
+    with open(backup_dir / MANIFEST_FILENAME, encoding="utf8") as file:
+        return json.load(file)
+
+
+def manifest_checksums(backup_dir, manifest):
+    """{путь файла: ожидаемый sha256} для базы и медиафайлов"""
+    database = manifest["database"]
+    if database["format"] == "directory":
+        checksums = {
+            backup_dir / database["dir"] / name: entry["sha256"]
+            for name, entry in database["files"].items()
+        }
+    else:
+        checksums = {backup_dir / database["file"]: database["sha256"]}
+    for name, entry in manifest["media"].items():
+        checksums[backup_dir / MEDIA_BACKUP_DIRNAME / name] = entry["sha256"]
+    return checksums
+
+
+def verify_manifest(backup_dir, manifest, jobs):
+    """
+    Returns:
+        Список путей файлов, которых нет или чья сумма не совпадает.
+    """
+
+    def is_corrupted(item):
+        path, sha256 = item
+        try:
+            return file_sha256(path) != sha256
+        except FileNotFoundError:
+            return True
+
+    checksums = manifest_checksums(backup_dir, manifest)
+    with ThreadPoolExecutor(jobs) as executor:
+        corrupted = executor.map(is_corrupted, checksums.items())
+        return [path for path, bad in zip(checksums, corrupted) if bad]
+
+
+def restore_database(backup_dir, database, target, jobs, clean=False):
+    """
+    Восстанавливает дамп из манифеста в базу target.
+
+    Returns:
+        Код завершения pg_restore или psql.
+    """
+    if database["format"] == "directory":
+        command = [
+            "pg_restore",
+            *postgres_args(),
+            "-j",
+            str(jobs),
+            "--no-owner",
+            "-d",
+            target,
+        ]
+        if clean:
+            command += ["--clean", "--if-exists"]
+        command.append(str(backup_dir / database["dir"]))
+        return subprocess.run(command, env=postgres_env()).returncode
+
+    # SQL-дамп без DROP: восстанавливается только в пустую базу
+    decompress = subprocess.Popen(
+        [*shlex.split(DECOMPRESS_COMMAND), str(backup_dir / database["file"])],
+        stdout=subprocess.PIPE,
+    )
+    psql = subprocess.Popen(
+        ["psql", *postgres_args(), "-q", "-v", "ON_ERROR_STOP=1", "-d", target],
+        stdin=decompress.stdout,
+        stdout=subprocess.DEVNULL,
+        env=postgres_env(),
+    )
+    decompress.stdout.close()
+    psql_result = psql.wait()
+    return decompress.wait() or psql_result
+
+
+def restore_media(backup_dir, media_dir):
+    shutil.copytree(backup_dir / MEDIA_BACKUP_DIRNAME, media_dir, dirs_exist_ok=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Восстановление бэкапа")
+    parser.add_argument("backup", type=Path, help="Каталог бэкапа с manifest.json")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Потоки проверки сумм и процессы pg_restore",
+    )
+    parser.add_argument(
+        "--database", default=POSTGRES_DB, help="База для восстановления"
+    )
+    parser.add_argument(
+        "--media-dir",
+        type=Path,
+        default=MEDIA_DIRPATH / MEDIA_DIRNAME,
+        help="Каталог для медиафайлов",
+    )
+    parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="Удалить объекты базы перед восстановлением (только формат каталога)",
+    )
+    parser.add_argument("--skip-database", action="store_true")
+    parser.add_argument("--skip-media", action="store_true")
+    parser.add_argument(
+        "--verify-only", action="store_true", help="Только проверить суммы"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    manifest = load_manifest(args.backup)
+    timings = {}
+
+    started = time.monotonic()
+    corrupted = verify_manifest(args.backup, manifest, args.jobs)
+    timings["verify"] = time.monotonic() - started
+    if corrupted:
+        for path in corrupted[:20]:
+            log.error(f"checksum mismatch or missing file: {path}")
+        log.error(f"backup {args.backup} is corrupted: {len(corrupted)} files")
+        sys.exit(40)
+    log.info(f"manifest verified in {timings['verify']:.1f}s")
+    if args.verify_only:
+        return timings
+
+    if not args.skip_database:
+        started = time.monotonic()
+        result = restore_database(
+            args.backup, manifest["database"], args.database, args.jobs, args.clean
+        )
+        timings["database"] = time.monotonic() - started
+        if result != 0:
+            log.error(f"database restore failed with code {result}")
+            sys.exit(50)
+
+    if not args.skip_media:
+        started = time.monotonic()
+        restore_media(args.backup, args.media_dir)
+        timings["media"] = time.monotonic() - started
+
+    log.warning(
+        f"Backup {args.backup.name} restored: "
+        + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items())
+    )
+    return timings
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        log.error("RESTORE FAILED")
+        log.error(traceback.format_exc())
+        sys.exit(1)
@@ -29,6 +29,15 @@ poetry run python ./src/manage.py makemigrations --merge --noinput
 echo "Apply migrations"
 poetry run python ./src/manage.py migrate
 
+echo "Build OpenAPI schema"
+poetry run python ./src/manage.py build_openapi_schema
+
+echo "Fill search vectors for ads"
+poetry run python ./src/manage.py rebuild_ad_search_vectors
+
+echo "Fill proposal inboxes"
+poetry run python ./src/manage.py rebuild_proposal_inbox --if-empty
+
 echo "Start cron backups schedule"
 mkdir -p $HOME/backups
 touch $HOME/logs/backups_log.log
@@ -38,9 +47,28 @@ chmod 777 -R $HOME/logs/cron_log.log
 chmod 777 -R $HOME
 crontab $HOME/cron/crontab_jobs
 
+echo "Start ad images worker"
+poetry run python ./src/manage.py process_ad_images &
+
+echo "Start error log flusher"
+poetry run python ./src/manage.py flush_error_logs &
+
+echo "Start exchange cycle matcher"
+poetry run python ./src/manage.py match_new_proposals &
+
+EVENTS_PORT=${EVENTS_PORT:-8001}
+EVENTS_NUM_WORKERS=${EVENTS_NUM_WORKERS:-2}
+
 if [ "$DEBUG" == 0 ]; then
   echo "Start as PROD"
   cd src/
+  echo "Start ASGI server for proposal events"
+  poetry run gunicorn settings.asgi:application -k uvicorn.workers.UvicornWorker \
+    -w $EVENTS_NUM_WORKERS \
+    --capture-output \
+    --bind 0.0.0.0:$EVENTS_PORT --chdir /home/app \
+    --enable-stdio-inheritance \
+    --log-config gunicorn-log.conf &
   cron && poetry run gunicorn settings.wsgi:application -w $NUM_WORKERS \
     --capture-output --reload \
     --bind 0.0.0.0:$PORT --chdir /home/app \
@@ -48,5 +76,7 @@ if [ "$DEBUG" == 0 ]; then
     --log-config gunicorn-log.conf;
 else
   echo "Start as LOCAL"
+  poetry run uvicorn settings.asgi:application --app-dir ./src --reload \
+    --host 0.0.0.0 --port $EVENTS_PORT &
   cron && poetry run python3 ./src/manage.py runserver 0.0.0.0:$PORT
 fi
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Ad, ExchangeProposal
+from .models import Ad, ExchangeCycle, ExchangeProposal
 
 
 @admin.register(Ad)
@@ -17,3 +17,9 @@ class ExchangeProposalAdmin(admin.ModelAdmin):
     list_filter = ("status", "created_at")
     search_fields = ("ad_sender__title", "ad_receiver__title", "comment")
     date_hierarchy = "created_at"
+
+
+@admin.register(ExchangeCycle)
+class ExchangeCycleAdmin(admin.ModelAdmin):
+    list_display = ("id", "ads", "proposals", "created_at")
+    date_hierarchy = "created_at"
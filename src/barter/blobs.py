@@ -0,0 +1,163 @@
+import os
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Ad, ImageBlob
+
+# Файлы изображений объявлений лежат в хранилище с адресацией по содержимому
+# и делятся между объявлениями. ImageBlob считает ссылки на каждый файл: они
+# меняются в той же транзакции, что и Ad.image/Ad.image_variants (сигналы и
+# воркер process_ad_images). Команда sweep_ad_images удаляет файлы без ссылок
+# старше AD_IMAGE_SWEEP_GRACE_HOURS и файлы, которых нет в ImageBlob, -
+# например записанные транзакцией, которая потом откатилась.
+ROOT = "ads_images"
+
+
+def change_refs(acquired=(), released=()):
+    """
+    Прибавляет ссылку файлам acquired и вычитает у released одним UPDATE.
+    Счетчик не уходит ниже нуля, даже если файл не учитывался.
+    """
+    deltas = Counter(acquired)
+    deltas.subtract(released)
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name) for name in deltas], ignore_conflicts=True
+    )
+    whens = [When(name=name, then=Value(delta)) for name, delta in deltas.items()]
+    ImageBlob.objects.filter(name__in=deltas).update(
+        refs=Greatest(F("refs") + Case(*whens, default=Value(0)), 0),
+        updated_at=timezone.now(),
+    )
+
+
+def count_refs(batch_size=10_000):
+    counts = Counter()
+    for image, variants in (
+        Ad.objects.order_by()
+        .values_list("image", "image_variants")
+        .iterator(chunk_size=batch_size)
+    ):
+        counts.update(Ad.collect_image_files(image, variants))
+    return counts
+
+
+def recount_refs(batch_size=10_000):
+    """
+    Пересчитывает ссылки по всем объявлениям. Файлы без ссылок получают
+    нулевой счетчик и удаляются следующими запусками sweep_ad_images.
+
+    Returns:
+        Количество файлов, на которые ссылаются объявления.
+    """
+    with transaction.atomic():
+        counts = count_refs(batch_size)
+        ImageBlob.objects.filter(refs__gt=0).exclude(name__in=counts).update(
+            refs=0, updated_at=timezone.now()
+        )
+        ImageBlob.objects.bulk_create(
+            [ImageBlob(name=name, refs=refs) for name, refs in counts.items()],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["name"],
+            update_fields=["refs"],
+        )
+    return len(counts)
+
+
+def referenced(names):
+    """Имена из names, на которые ссылается хотя бы одно объявление"""
+    names = list(names)
+    if not names:
+        return set()
+    lookups = [Q(image__in=names)] + [
+        Q(**{f"image_variants__{variant}__{fmt}__in": names})
+        for variant in settings.AD_IMAGE_VARIANTS
+        for fmt in Ad.IMAGE_FORMATS
+    ]
+    files = set()
+    for image, variants in Ad.objects.filter(reduce(or_, lookups)).values_list(
+        "image", "image_variants"
+    ):
+        files |= Ad.collect_image_files(image, variants)
+    return files.intersection(names)
+
+
+def _walk_files(storage):
+    """Имена и время изменения всех файлов под ROOT"""
+    root = storage.path(ROOT)
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, storage.location).replace(os.sep, "/")
+            yield name, os.stat(path).st_mtime
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def sweep(grace=None, dry_run=False, batch_size=1000):
+    """
+    Удаляет файлы изображений, на которые не ссылается ни одно объявление.
+
+    Файл удаляется, только если он не менялся дольше grace: недавно
+    записанный или переиспользованный файл может ждать коммита ссылки на него.
+    Перед удалением ссылки проверяются по самим объявлениям, поэтому
+    расхождение счетчиков не приводит к потере файла.
+
+    Returns:
+        Список имен удаленных файлов.
+    """
+    storage = Ad._meta.get_field("image").storage
+    if grace is None:
+        grace = timedelta(hours=settings.AD_IMAGE_SWEEP_GRACE_HOURS)
+    cutoff = timezone.now() - grace
+    cutoff_timestamp = cutoff.timestamp()
+
+    deleted = []
+    for batch in _batches(_walk_files(storage), batch_size):
+        mtimes = dict(batch)
+        counted = ImageBlob.objects.filter(name__in=mtimes).exclude(
+            refs=0, updated_at__lt=cutoff
+        )
+        candidates = {
+            name for name, mtime in mtimes.items() if mtime < cutoff_timestamp
+        } - set(counted.values_list("name", flat=True))
+        candidates -= referenced(candidates)
+        for name in sorted(candidates):
+            path = storage.path(name)
+            # Файл могли переиспользовать после обхода каталога
+            try:
+                if os.stat(path).st_mtime >= cutoff_timestamp:
+                    continue
+                if not dry_run:
+                    os.unlink(path)
+            except FileNotFoundError:
+                continue
+            deleted.append(name)
+
+    if not dry_run:
+        for batch in _batches(deleted, batch_size):
+            ImageBlob.objects.filter(name__in=batch, refs=0).delete()
+        # Строки без файлов, например после удаления файла вручную
+        stale = ImageBlob.objects.filter(refs=0, updated_at__lt=cutoff).values_list(
+            "name", flat=True
+        )
+        for batch in _batches(stale.iterator(chunk_size=batch_size), batch_size):
+            missing = [name for name in batch if not storage.exists(name)]
+            ImageBlob.objects.filter(name__in=missing, refs=0).delete()
+    return deleted
@@ -0,0 +1,143 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+# Ответы ленты объявлений для анонимных пользователей кешируются в Redis.
+# Ключ ответа содержит поколение области (категории или всей ленты), поэтому
+# для инвалидации достаточно увеличить счетчик поколения - старые ключи
+# перестают читаться и истекают сами по AD_LIST_CACHE_TIMEOUT.
+KEY_PREFIX = "barter:ad_list"
+SCOPE_ALL = "all"
+STAT_HIT = "hit"
+STAT_MISS = "miss"
+
+
+def _generation_key(scope):
+    return f"{KEY_PREFIX}:gen:{scope}"
+
+
+def _stat_key(name):
+    return f"{KEY_PREFIX}:stat:{name}"
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def get_generation(scope):
+    """
+    Текущее поколение области. Если счетчик вытеснен из Redis, начинается с
+    текущего времени в миллисекундах, чтобы не совпасть с поколением старых ответов.
+    """
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate_ads(categories):
+    """Сбрасывает кеш ленты для категорий и ленты без фильтра по категории"""
+    for scope in {*filter(None, categories), SCOPE_ALL}:
+        try:
+            cache.incr(_generation_key(scope))
+        except ValueError:
+            # Счетчика нет - нет и ответов, закешированных с ним
+            pass
+
+
+def get_stats():
+    """Счетчики попаданий и промахов кеша ленты"""
+    values = cache.get_many([_stat_key(STAT_HIT), _stat_key(STAT_MISS)])
+    return {
+        STAT_HIT: values.get(_stat_key(STAT_HIT), 0),
+        STAT_MISS: values.get(_stat_key(STAT_MISS), 0),
+    }
+
+
+def reset_stats():
+    cache.delete_many([_stat_key(STAT_HIT), _stat_key(STAT_MISS)])
+
+
+def get_response_key(view_name, request):
+    """Ключ ответа: представление, поколение области и все параметры запроса"""
+    scope = request.GET.get("category") or SCOPE_ALL
+    params = sorted(
+        (name, value) for name in request.GET for value in request.GET.getlist(name)
+    )
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    return f"{KEY_PREFIX}:{view_name}:{scope}:{get_generation(scope)}:{digest}"
+
+
+def is_cacheable(request):
+    """Кешируются только GET запросы анонимов без ожидающих flash-сообщений"""
+    return (
+        settings.AD_LIST_CACHE_TIMEOUT > 0
+        and request.method == "GET"
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def _count(response, stat):
+    _incr(_stat_key(stat))
+    response["X-Cache"] = stat.upper()
+    return response
+
+
+def cache_ad_list_api(view_func):
+    """Кеширует данные ответа API ленты объявлений (response.data)"""
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view_func(request, *args, **kwargs)
+
+        key = get_response_key(view_func.__name__, request)
+        data = cache.get(key)
+        if data is not None:
+            return _count(Response(data), STAT_HIT)
+
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.AD_LIST_CACHE_TIMEOUT)
+        return _count(response, STAT_MISS)
+
+    return wrapper
+
+
+class AdListCacheMixin:
+    """Кеширует отрендеренную HTML страницу ленты объявлений"""
+
+    cache_name = "ad_list_view"
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = get_response_key(self.cache_name, request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return _count(HttpResponse(content, content_type=content_type), STAT_HIT)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.render()
+            cache.set(
+                key,
+                (response.content, response["Content-Type"]),
+                settings.AD_LIST_CACHE_TIMEOUT,
+            )
+        return _count(response, STAT_MISS)
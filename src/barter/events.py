@@ -0,0 +1,121 @@
+import json
+import logging
+import re
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis import RedisError
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# События предложений пользователя. Каждое событие пишется в ограниченный
+# Redis Stream пользователя - историю для переподключения с Last-Event-ID -
+# и публикуется в его канал pub/sub, который слушают открытые SSE-соединения.
+# id события - id записи в Stream, он растет монотонно.
+KEY_PREFIX = "barter:proposal_events"
+EVENT_ID_RE = re.compile(r"^\d+-\d+$")
+
+# Запись в историю и публикация одним вызовом, без лишнего обращения к Redis
+PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', KEYS[2], id .. ' ' .. ARGV[3])
+return id
+"""
+
+
+def stream_key(user_id):
+    return f"{KEY_PREFIX}:stream:{user_id}"
+
+
+def channel_name(user_id):
+    return f"{KEY_PREFIX}:channel:{user_id}"
+
+
+def parse_event_id(event_id):
+    return tuple(int(part) for part in event_id.split("-"))
+
+
+def format_event(event_id, payload):
+    return f"id: {event_id}\nevent: proposal\ndata: {payload}\n\n"
+
+
+def publish_events(events):
+    """
+    Публикует события одним pipeline. Ошибка Redis не должна ломать запрос,
+    изменивший предложения, поэтому она только логируется.
+
+    Args:
+        events: Список пар (id пользователя, данные события).
+    """
+    try:
+        redis = get_redis_connection("default")
+        script = redis.register_script(PUBLISH_SCRIPT)
+        pipe = redis.pipeline(transaction=False)
+        for user_id, data in events:
+            script(
+                keys=[stream_key(user_id), channel_name(user_id)],
+                args=[
+                    settings.PROPOSAL_EVENTS_HISTORY,
+                    settings.PROPOSAL_EVENTS_HISTORY_TTL,
+                    json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+                ],
+                client=pipe,
+            )
+        pipe.execute()
+    except RedisError:
+        logger.exception("Не удалось опубликовать события предложений")
+
+
+def publish_on_commit(events):
+    # До коммита клиент, получивший событие, может прочитать старое состояние
+    events = list(events)
+    if events:
+        transaction.on_commit(partial(publish_events, events))
+
+
+async def stream_events(user_id, last_event_id=None):
+    """
+    Асинхронный поток SSE: пропущенные события из истории после last_event_id,
+    затем новые события из pub/sub и комментарий-heartbeat при простое.
+    """
+    redis = aioredis.Redis.from_url(settings.PROPOSAL_EVENTS_REDIS_URL)
+    pubsub = redis.pubsub()
+    try:
+        # Подписка до чтения истории: событие между ними придет и в канал,
+        # а повтор отсекается по id
+        await pubsub.subscribe(channel_name(user_id))
+        yield f"retry: {settings.PROPOSAL_EVENTS_RETRY_MS}\n\n"
+
+        last = None
+        if last_event_id and EVENT_ID_RE.match(last_event_id):
+            last = parse_event_id(last_event_id)
+            history = await redis.xrange(
+                stream_key(user_id),
+                min=f"({last_event_id}",
+                count=settings.PROPOSAL_EVENTS_HISTORY,
+            )
+            for event_id, fields in history:
+                event_id = event_id.decode()
+                last = parse_event_id(event_id)
+                yield format_event(event_id, fields[b"data"].decode())
+
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=settings.PROPOSAL_EVENTS_HEARTBEAT_SECONDS,
+            )
+            if message is None:
+                yield ": heartbeat\n\n"
+                continue
+            event_id, payload = message["data"].decode().split(" ", 1)
+            if last is not None and parse_event_id(event_id) <= last:
+                continue
+            last = parse_event_id(event_id)
+            yield format_event(event_id, payload)
+    finally:
+        await pubsub.aclose()
+        await redis.aclose()
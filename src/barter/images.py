@@ -0,0 +1,214 @@
+import io
+import logging
+import posixpath
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Coalesce
+from django_redis import get_redis_connection
+from PIL import Image, ImageOps
+
+from .blobs import change_refs
+from .cache import invalidate_ads
+from .models import Ad
+
+logger = logging.getLogger(__name__)
+
+# Загруженное изображение объявления обрабатывается фоновым воркером
+# (команда process_ad_images): после коммита id объявления попадает в очередь
+# Redis, воркер строит уменьшенные варианты в WebP и JPEG без EXIF и записывает
+# их в Ad.image_variants. Пока вариантов нет, показывается исходный файл.
+QUEUE_KEY = "barter:ad_images:queue"
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+
+def enqueue_ad_image(ad_id):
+    """Ставит объявление в очередь обработки после коммита транзакции"""
+    transaction.on_commit(
+        partial(get_redis_connection("default").rpush, QUEUE_KEY, ad_id)
+    )
+
+
+def needs_processing(ad):
+    return bool(ad.image) and ad.image_variants.get("source") != ad.image.name
+
+
+def _encode(image, image_format):
+    """Кодирует изображение без EXIF: Pillow не переносит метаданные без exif="""
+    if image_format == "JPEG" and image.mode != "RGB":
+        # У JPEG нет прозрачности, фон становится белым
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    buffer = io.BytesIO()
+    image.save(
+        buffer,
+        image_format,
+        quality=settings.AD_IMAGE_QUALITY,
+        optimize=image_format == "JPEG",
+        progressive=image_format == "JPEG",
+    )
+    return buffer.getvalue()
+
+
+def render_variants(source):
+    """
+    Строит варианты изображения по AD_IMAGE_VARIANTS.
+
+    Returns:
+        {имя варианта: (ширина, высота, {формат: байты})}.
+
+    Raises:
+        OSError, Image.DecompressionBombError: если файл не удалось прочитать
+        как изображение.
+    """
+    with Image.open(source) as original:
+        # Поворот из EXIF применяется до того, как EXIF будет отброшен
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    variants = {}
+    for name, max_side in settings.AD_IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        variants[name] = (
+            resized.width,
+            resized.height,
+            {
+                fmt: _encode(resized, image_format)
+                for fmt, (image_format, _) in FORMATS.items()
+            },
+        )
+    return variants
+
+
+def save_variants(source_name, rendered):
+    """
+    Сохраняет файлы вариантов в хранилище изображений объявлений и возвращает
+    значение для Ad.image_variants. Варианты одинаковых исходных файлов
+    совпадают по содержимому и хранятся один раз.
+    """
+    storage = Ad._meta.get_field("image").storage
+    directory = posixpath.join(posixpath.dirname(source_name), "variants")
+    variants = {"source": source_name}
+    for name, (width, height, encoded) in rendered.items():
+        variants[name] = {"width": width, "height": height}
+        for fmt, content in encoded.items():
+            path = posixpath.join(directory, f"{name}.{fmt}")
+            variants[name][fmt] = storage.save(path, ContentFile(content))
+    return variants
+
+
+def _replace_variants(ad, source_name, variants):
+    """
+    Записывает варианты, если изображение объявления не сменилось, и
+    переносит ссылки со старых вариантов на новые.
+    """
+    with transaction.atomic():
+        updated = Ad.objects.filter(pk=ad.pk, image=source_name).update(
+            image_variants=variants
+        )
+        if updated:
+            change_refs(
+                acquired=Ad.collect_image_files(None, variants),
+                released=Ad.collect_image_files(None, ad.image_variants),
+            )
+    return bool(updated)
+
+
+def process_ad_image(ad_id):
+    """
+    Строит и записывает варианты изображения объявления.
+
+    Запись условная: если изображение заменили во время обработки, варианты
+    старого файла остаются без ссылок, а новый файл уже стоит в очереди.
+
+    Returns:
+        True, если варианты записаны.
+    """
+    ad = Ad.objects.filter(pk=ad_id).only("image", "image_variants", "category").first()
+    if ad is None or not needs_processing(ad):
+        return False
+
+    source_name = ad.image.name
+    try:
+        with ad.image.open("rb") as source:
+            rendered = render_variants(source)
+    except Exception:
+        # Кроме OSError плагины Pillow на испорченных файлах бросают ValueError,
+        # SyntaxError, struct.error и другие: все это ошибки самого файла
+        logger.exception("Не удалось обработать изображение объявления %s", ad_id)
+        # Отметка об обработке без вариантов, чтобы не повторять попытки
+        _replace_variants(ad, source_name, {"source": source_name})
+        return False
+
+    if not _replace_variants(ad, source_name, save_variants(source_name, rendered)):
+        return False
+    # update() не вызывает сигналы, кеш ленты сбрасывается явно
+    invalidate_ads([ad.category])
+    return True
+
+
+def get_pending_ad_ids(limit=None):
+    """Объявления с изображением без вариантов, например после потери очереди"""
+    queryset = (
+        Ad.objects.exclude(image="")
+        .exclude(image__isnull=True)
+        .annotate(
+            variants_source=Coalesce(
+                KeyTextTransform("source", "image_variants"), Value("")
+            )
+        )
+        .exclude(variants_source=F("image"))
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    return list(queryset[:limit] if limit else queryset)
+
+
+def run_worker(timeout=None, once=False):
+    """
+    Обрабатывает очередь. При простое дольше timeout секунд подбирает
+    необработанные объявления из базы.
+
+    Ошибка базы, Redis или хранилища записывается в лог и не останавливает
+    воркер: необработанное объявление подберется из базы при следующем простое.
+
+    Args:
+        once: Обработать очередь и необработанные объявления и выйти.
+
+    Returns:
+        Количество обработанных объявлений при once=True.
+    """
+    redis = get_redis_connection("default")
+    timeout = timeout or settings.AD_IMAGE_WORKER_IDLE_SECONDS
+    processed = 0
+    while True:
+        try:
+            if once:
+                item = redis.lpop(QUEUE_KEY)
+            else:
+                item = redis.blpop([QUEUE_KEY], timeout=timeout)
+                item = item[1] if item else None
+            ad_ids = [int(item)] if item is not None else get_pending_ad_ids(100)
+        except Exception:
+            if once:
+                raise
+            logger.exception("Не удалось получить объявления для обработки")
+            time.sleep(timeout)
+            continue
+
+        for ad_id in ad_ids:
+            try:
+                processed += process_ad_image(ad_id)
+            except Exception:
+                logger.exception(
+                    "Не удалось обработать изображение объявления %s", ad_id
+                )
+        if item is None and once:
+            return processed
@@ -0,0 +1,247 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+
+from .events import publish_on_commit
+from .models import ExchangeProposal, ProposalInboxCounter, ProposalInboxEntry
+
+# Лента предложений пользователя - денормализованные строки ProposalInboxEntry
+# (по одной у отправителя и получателя) и строка счетчиков ProposalInboxCounter.
+# Обе таблицы меняются в той же транзакции, что и ExchangeProposal, а команда
+# rebuild_proposal_inbox пересобирает их из ExchangeProposal целиком.
+# Через эти же функции проходят все изменения лент, поэтому отсюда же
+# публикуются события для открытых SSE-соединений пользователей.
+SENT = ProposalInboxEntry.Box.SENT
+RECEIVED = ProposalInboxEntry.Box.RECEIVED
+PENDING = ExchangeProposal.Status.PENDING
+COUNTER_FIELDS = ("sent_pending", "received_pending", "unread")
+PENDING_FIELDS = {SENT: "sent_pending", RECEIVED: "received_pending"}
+
+
+def _change_counters(deltas):
+    """
+    Прибавляет к счетчикам пользователей значения deltas одним UPDATE.
+
+    Args:
+        deltas: {user_id: Counter({имя счетчика: приращение})}.
+    """
+    deltas = {
+        user_id: delta for user_id, delta in deltas.items() if any(delta.values())
+    }
+    if not deltas:
+        return
+    ProposalInboxCounter.objects.bulk_create(
+        [ProposalInboxCounter(user_id=user_id) for user_id in deltas],
+        ignore_conflicts=True,
+    )
+    changes = {}
+    for field in COUNTER_FIELDS:
+        whens = [
+            When(user_id=user_id, then=Value(delta[field]))
+            for user_id, delta in deltas.items()
+            if delta[field]
+        ]
+        if whens:
+            changes[field] = F(field) + Case(*whens, default=Value(0))
+    ProposalInboxCounter.objects.filter(user_id__in=deltas).update(**changes)
+
+
+def _entry_delta(delta, box, status, is_read, sign):
+    if status == PENDING:
+        delta[PENDING_FIELDS[box]] += sign
+    if box == RECEIVED and not is_read:
+        delta["unread"] += sign
+
+
+def add_proposals(proposals):
+    """
+    Добавляет в ленты отправителей и получателей предложения из queryset.
+    Предложения, уже попавшие в ленты, пропускаются.
+    """
+    rows = proposals.filter(inbox_entries__isnull=True).values_list(
+        "pk", "ad_sender__user_id", "ad_receiver__user_id", "status", "created_at"
+    )
+    entries = []
+    deltas = defaultdict(Counter)
+    for pk, sender_user_id, receiver_user_id, status, created_at in rows:
+        for user_id, box in ((sender_user_id, SENT), (receiver_user_id, RECEIVED)):
+            # Свои отправленные предложения сразу прочитаны
+            is_read = box == SENT
+            entries.append(
+                ProposalInboxEntry(
+                    user_id=user_id,
+                    proposal_id=pk,
+                    box=box,
+                    status=status,
+                    is_read=is_read,
+                    created_at=created_at,
+                )
+            )
+            _entry_delta(deltas[user_id], box, status, is_read, 1)
+    if entries:
+        ProposalInboxEntry.objects.bulk_create(entries)
+        _change_counters(deltas)
+        publish_on_commit(
+            (
+                entry.user_id,
+                {
+                    "type": "created",
+                    "proposal": entry.proposal_id,
+                    "box": entry.box,
+                    "status": entry.status,
+                },
+            )
+            for entry in entries
+        )
+
+
+def sync_statuses(proposals):
+    """Переносит в ленты статусы предложений из queryset, если они изменились"""
+    stale = list(
+        ProposalInboxEntry.objects.filter(proposal__in=proposals)
+        .exclude(status=F("proposal__status"))
+        .values_list(
+            "pk", "user_id", "proposal_id", "box", "status", "proposal__status"
+        )
+    )
+    if not stale:
+        return
+    by_status = defaultdict(list)
+    deltas = defaultdict(Counter)
+    events = []
+    for pk, user_id, proposal_id, box, old_status, new_status in stale:
+        by_status[new_status].append(pk)
+        events.append(
+            (
+                user_id,
+                {
+                    "type": "status",
+                    "proposal": proposal_id,
+                    "box": box,
+                    "status": new_status,
+                },
+            )
+        )
+        # Смена статуса не меняет отметку о прочтении, unread не пересчитывается
+        _entry_delta(deltas[user_id], box, old_status, True, -1)
+        _entry_delta(deltas[user_id], box, new_status, True, 1)
+    for status, pks in by_status.items():
+        ProposalInboxEntry.objects.filter(pk__in=pks).update(status=status)
+    _change_counters(deltas)
+    publish_on_commit(events)
+
+
+def remove_proposals(proposals):
+    """Вычитает из счетчиков предложения queryset перед их удалением"""
+    deltas = defaultdict(Counter)
+    for user_id, box, is_read, status in ProposalInboxEntry.objects.filter(
+        proposal__in=proposals
+    ).values_list("user_id", "box", "is_read", "status"):
+        _entry_delta(deltas[user_id], box, status, is_read, -1)
+    _change_counters(deltas)
+
+
+def mark_read(user_id):
+    """Отмечает полученные предложения пользователя прочитанными"""
+    with transaction.atomic():
+        ProposalInboxEntry.objects.filter(
+            user_id=user_id, box=RECEIVED, is_read=False
+        ).update(is_read=True)
+        ProposalInboxCounter.objects.filter(user_id=user_id).update(unread=0)
+
+
+def get_counters(user_id):
+    """Счетчики ленты одним запросом по первичному ключу"""
+    counters = (
+        ProposalInboxCounter.objects.filter(user_id=user_id)
+        .values(*COUNTER_FIELDS)
+        .first()
+    )
+    return counters or dict.fromkeys(COUNTER_FIELDS, 0)
+
+
+def get_inbox(user_id, box, select_related=(), only=()):
+    """
+    Queryset ленты пользователя с загруженными предложениями. Порядок и курсор
+    пагинации берутся из полей самой ленты, поэтому страница читается по индексу
+    inbox_user_box_created_idx.
+    """
+    queryset = (
+        ProposalInboxEntry.objects.filter(user_id=user_id, box=box)
+        .select_related("proposal", *select_related)
+        .order_by("-created_at", "-id")
+    )
+    if only:
+        queryset = queryset.only("created_at", "proposal", *only)
+    return queryset
+
+
+def rebuild_inbox(batch_size=10_000):
+    """
+    Пересобирает ленты и счетчики из ExchangeProposal, сохраняя отметки о
+    прочтении существующих записей.
+
+    Returns:
+        Количество записей ленты.
+    """
+    with transaction.atomic():
+        unread = set(
+            ProposalInboxEntry.objects.filter(box=RECEIVED, is_read=False).values_list(
+                "proposal_id", flat=True
+            )
+        )
+        ProposalInboxEntry.objects.all().delete()
+
+        total = 0
+        batch = []
+        rows = (
+            ExchangeProposal.objects.order_by()
+            .values_list(
+                "pk",
+                "ad_sender__user_id",
+                "ad_receiver__user_id",
+                "status",
+                "created_at",
+            )
+            .iterator(chunk_size=batch_size)
+        )
+        for pk, sender_user_id, receiver_user_id, status, created_at in rows:
+            for user_id, box, is_read in (
+                (sender_user_id, SENT, True),
+                (receiver_user_id, RECEIVED, pk not in unread),
+            ):
+                batch.append(
+                    ProposalInboxEntry(
+                        user_id=user_id,
+                        proposal_id=pk,
+                        box=box,
+                        status=status,
+                        is_read=is_read,
+                        created_at=created_at,
+                    )
+                )
+            if len(batch) >= batch_size:
+                ProposalInboxEntry.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        ProposalInboxEntry.objects.bulk_create(batch)
+        total += len(batch)
+
+        ProposalInboxCounter.objects.all().delete()
+        ProposalInboxCounter.objects.bulk_create(
+            [
+                ProposalInboxCounter(**counters)
+                for counters in ProposalInboxEntry.objects.order_by()
+                .values("user_id")
+                .annotate(
+                    sent_pending=Count("pk", filter=Q(box=SENT, status=PENDING)),
+                    received_pending=Count(
+                        "pk", filter=Q(box=RECEIVED, status=PENDING)
+                    ),
+                    unread=Count("pk", filter=Q(box=RECEIVED, is_read=False)),
+                )
+            ],
+            batch_size=batch_size,
+        )
+    return total
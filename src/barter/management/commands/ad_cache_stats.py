@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from barter.cache import STAT_HIT, STAT_MISS, get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Показывает счетчики попаданий и промахов кеша ленты объявлений"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Обнулить счетчики после вывода"
+        )
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        total = stats[STAT_HIT] + stats[STAT_MISS]
+        hit_ratio = stats[STAT_HIT] / total * 100 if total else 0
+        self.stdout.write(
+            f"Попаданий: {stats[STAT_HIT]}, промахов: {stats[STAT_MISS]}, "
+            f"доля попаданий: {hit_ratio:.1f}%"
+        )
+        if options["reset"]:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS("Счетчики обнулены"))
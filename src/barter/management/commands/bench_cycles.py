@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from barter.matching import (
+    ProposalGraph,
+    find_cycles,
+    generate_random_graph,
+    strongly_connected_components,
+)
+
+
+class Command(BaseCommand):
+    help = "Замеряет поиск циклов обмена на синтетическом графе предложений"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--nodes", type=int, default=300_000, help="Количество объявлений"
+        )
+        parser.add_argument(
+            "--edges", type=int, default=1_000_000, help="Количество предложений"
+        )
+        parser.add_argument(
+            "--max-length",
+            type=int,
+            default=settings.EXCHANGE_CYCLE_MAX_LENGTH,
+            help="Максимальная длина цикла",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed генератора")
+
+    def handle(self, *args, **options):
+        nodes, edges = options["nodes"], options["edges"]
+        if nodes < 2 or edges > nodes * (nodes - 1):
+            self.stderr.write(self.style.ERROR("Некорректный размер графа"))
+            return
+
+        edge_list = generate_random_graph(nodes, edges, options["seed"])
+
+        started = time.perf_counter()
+        graph = ProposalGraph(*edge_list)
+        self._report("Построение CSR", started)
+
+        started = time.perf_counter()
+        component = strongly_connected_components(graph)
+        self._report("Сильно связные компоненты", started)
+        in_cycles = sum(1 for value in component if value >= 0)
+        self.stdout.write(f"  вершин в циклических компонентах: {in_cycles}")
+
+        started = time.perf_counter()
+        cycles = find_cycles(*edge_list, options["max_length"])
+        self._report("Поиск циклов (полный, вместе с CSR и компонентами)", started)
+        matched = sum(len(cycle.ads) for cycle in cycles)
+        self.stdout.write(f"  циклов: {len(cycles)}, объявлений в обменах: {matched}")
+
+    def _report(self, stage, started):
+        self.stdout.write(f"{stage}: {(time.perf_counter() - started) * 1000:.1f} мс")
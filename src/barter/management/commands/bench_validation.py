@@ -0,0 +1,80 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+
+from barter.models import Ad
+from barter.serializers import AdCreateUpdateSerializer
+from settings.aboba_validation import compile_object
+
+PAYLOAD = {
+    "title": "Горный велосипед",
+    "description": "Велосипед в хорошем состоянии, обслужен этой весной",
+    "category": "other",
+    "condition": "used",
+    "is_active": True,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает проверку тела объявления AdCreateUpdateSerializer и "
+        "валидатором aboba_swagger(validate=True)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=10_000,
+            help="Количество повторов каждой проверки",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        # Те же поля, что у сериализатора: типами и полями с проверкой choices
+        typed = compile_object(
+            {
+                "title": str,
+                "description": str,
+                "category": str,
+                "condition": str,
+                "is_active": bool,
+            }
+        )
+        with_choices = compile_object(
+            {
+                "title": serializers.CharField(max_length=200),
+                "description": str,
+                "category": serializers.ChoiceField(choices=Ad.Category.choices),
+                "condition": serializers.ChoiceField(choices=Ad.Condition.choices),
+                "is_active": bool,
+            }
+        )
+
+        def validate_serializer():
+            serializer = AdCreateUpdateSerializer(data=PAYLOAD)
+            if not serializer.is_valid():
+                raise CommandError(str(serializer.errors))
+
+        results = [
+            ("AdCreateUpdateSerializer", validate_serializer),
+            ("aboba validate (типы)", lambda: typed(PAYLOAD)),
+            ("aboba validate (поля DRF)", lambda: with_choices(PAYLOAD)),
+        ]
+        baseline = None
+        for name, func in results:
+            elapsed = self.measure(func, iterations) / iterations
+            baseline = baseline or elapsed
+            self.stdout.write(
+                f"{name:<28} {elapsed * 1_000_000:>10.1f} мкс/запрос "
+                f"x{baseline / elapsed:>7.1f}"
+            )
+
+    @staticmethod
+    def measure(func, iterations):
+        func()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return time.perf_counter() - start
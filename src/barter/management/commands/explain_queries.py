@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from barter.models import Ad, ExchangeProposal
+from barter.pagination import DEFAULT_PAGE_SIZE
+from barter.search import search_ads, word_similarity_threshold
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет EXPLAIN (ANALYZE, BUFFERS) для типовых запросов представлений, "
+        "чтобы проверить, что планировщик использует индексы"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user-id",
+            type=int,
+            help="Пользователь для запросов «мои объявления» и «мои предложения», "
+            "по умолчанию первый пользователь",
+        )
+        parser.add_argument(
+            "--search", default="телефон", help="Поисковый запрос для ленты с поиском"
+        )
+        parser.add_argument(
+            "--only", help="Имя запроса, если нужен план только одного из них"
+        )
+        parser.add_argument(
+            "--no-analyze",
+            action="store_true",
+            help="Только план без выполнения запроса (EXPLAIN без ANALYZE)",
+        )
+
+    def handle(self, *args, **options):
+        user_id = options["user_id"] or (
+            User.objects.order_by("pk").values_list("pk", flat=True).first()
+        )
+        if user_id is None:
+            raise CommandError("Нет ни одного пользователя, укажите --user-id")
+
+        queries = self.get_queries(user_id, options["search"])
+        if options["only"]:
+            if options["only"] not in queries:
+                raise CommandError(
+                    f"Неизвестный запрос {options['only']}, есть: {', '.join(queries)}"
+                )
+            queries = {options["only"]: queries[options["only"]]}
+
+        explain_options = (
+            {} if options["no_analyze"] else {"analyze": True, "buffers": True}
+        )
+        # Порог похожести триграммного поиска действует только внутри блока
+        with word_similarity_threshold(options["search"]):
+            for name, queryset in queries.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(f"== {name}"))
+                self.stdout.write(queryset.explain(**explain_options))
+                self.stdout.write("")
+
+    def get_queries(self, user_id, search):
+        """Запросы в том виде, в котором их строят представления barter.views"""
+        active_ads = Ad.objects.filter(is_active=True).exclude(user_id=user_id)
+        ad_ids = list(
+            Ad.objects.filter(user_id=user_id).values_list("pk", flat=True)[:2]
+        )
+        page = DEFAULT_PAGE_SIZE + 1
+        return {
+            "ad_list": active_ads.order_by("-created_at", "-id")[:page],
+            "ad_list_category": active_ads.filter(
+                category=Ad.Category.ELECTRONICS
+            ).order_by("-created_at", "-id")[:page],
+            "ad_list_condition": active_ads.filter(condition=Ad.Condition.NEW).order_by(
+                "-created_at", "-id"
+            )[:page],
+            "ad_list_search": search_ads(active_ads, search)[:page],
+            "my_ads": Ad.objects.filter(user_id=user_id).order_by("-created_at", "-id")[
+                :page
+            ],
+            "sent_proposals": ExchangeProposal.objects.filter(
+                ad_sender__user_id=user_id
+            ),
+            "received_proposals": ExchangeProposal.objects.filter(
+                ad_receiver__user_id=user_id
+            ),
+            "pending_proposals_for_ads": ExchangeProposal.objects.filter(
+                models.Q(ad_sender_id__in=ad_ids) | models.Q(ad_receiver_id__in=ad_ids),
+                status=ExchangeProposal.Status.PENDING,
+            ),
+        }
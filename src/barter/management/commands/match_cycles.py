@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from barter.matching import rebuild_cycles
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает предложенные многосторонние циклы обмена"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-length",
+            type=int,
+            default=settings.EXCHANGE_CYCLE_MAX_LENGTH,
+            help="Максимальная длина цикла",
+        )
+
+    def handle(self, *args, **options):
+        if options["max_length"] < 2:
+            self.stderr.write(self.style.ERROR("Длина цикла не может быть меньше 2"))
+            return
+
+        started = time.perf_counter()
+        cycles = rebuild_cycles(options["max_length"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Найдено циклов: {len(cycles)} "
+                f"за {time.perf_counter() - started:.2f} с"
+            )
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from barter.matching import run_matcher
+
+
+class Command(BaseCommand):
+    help = "Ищет циклы обмена для новых предложений из очереди Redis"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать очередь и завершиться",
+        )
+
+    def handle(self, *args, **options):
+        matched = run_matcher(once=options["once"])
+        if options["once"]:
+            self.stdout.write(self.style.SUCCESS(f"Создано циклов: {matched}"))
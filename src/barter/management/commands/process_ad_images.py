@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from barter.images import run_worker
+
+
+class Command(BaseCommand):
+    help = "Строит варианты изображений объявлений из очереди Redis"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать очередь и необработанные объявления и завершиться",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=None,
+            help="Секунд простоя до поиска необработанных объявлений в базе",
+        )
+
+    def handle(self, *args, **options):
+        processed = run_worker(timeout=options["timeout"], once=options["once"])
+        if options["once"]:
+            self.stdout.write(
+                self.style.SUCCESS(f"Обработано изображений объявлений: {processed}")
+            )
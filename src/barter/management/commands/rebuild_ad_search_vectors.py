@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from barter.models import Ad
+from barter.search import build_search_vector
+
+
+class Command(BaseCommand):
+    help = "Заполняет Ad.search_vector для существующих объявлений пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество объявлений, обновляемых одним запросом",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Пересчитать вектор у всех объявлений, а не только у незаполненных",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        queryset = Ad.objects.order_by("pk")
+        if not options["all"]:
+            queryset = queryset.filter(search_vector__isnull=True)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                queryset.filter(pk__gt=last_pk).values_list("pk", flat=True)[
+                    :batch_size
+                ]
+            )
+            if not batch:
+                break
+            updated += Ad.objects.filter(pk__in=batch).update(
+                search_vector=build_search_vector()
+            )
+            last_pk = batch[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Обновлено поисковых векторов: {updated}")
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from barter.inbox import rebuild_inbox
+from barter.models import ProposalInboxEntry
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленты и счетчики предложений обмена из ExchangeProposal"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Количество записей ленты, вставляемых одним запросом",
+        )
+        parser.add_argument(
+            "--if-empty",
+            action="store_true",
+            help="Пересобрать только если ленты еще не заполнены",
+        )
+
+    def handle(self, *args, **options):
+        if options["if_empty"] and ProposalInboxEntry.objects.exists():
+            self.stdout.write("Ленты предложений уже заполнены")
+            return
+
+        total = rebuild_inbox(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Записей в лентах предложений: {total}"))
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from barter.blobs import recount_refs, sweep
+
+
+class Command(BaseCommand):
+    help = "Удаляет файлы изображений, на которые не ссылаются объявления"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=int,
+            default=None,
+            help="Не удалять файлы, менявшиеся за это число часов "
+            "(по умолчанию AD_IMAGE_SWEEP_GRACE_HOURS)",
+        )
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Перед удалением пересчитать ссылки по всем объявлениям",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать файлы, которые будут удалены",
+        )
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            total = recount_refs()
+            self.stdout.write(f"Файлов со ссылками: {total}")
+
+        grace = options["grace_hours"]
+        deleted = sweep(
+            grace=None if grace is None else timedelta(hours=grace),
+            dry_run=options["dry_run"],
+        )
+        if options["dry_run"]:
+            for name in deleted:
+                self.stdout.write(name)
+            self.stdout.write(f"Будет удалено файлов: {len(deleted)}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Удалено файлов: {len(deleted)}"))
@@ -0,0 +1,518 @@
+import logging
+import random
+import time
+from array import array
+from collections import namedtuple
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from .models import ExchangeCycle, ExchangeProposal
+
+logger = logging.getLogger(__name__)
+
+# Граф обмена: вершины - объявления, ребро sender -> receiver - ожидающее предложение,
+# то есть владелец sender хочет получить receiver. Цикл a1 -> a2 -> ... -> a1 - обмен,
+# в котором владелец каждого объявления получает следующее по циклу.
+MatchedCycle = namedtuple("MatchedCycle", ["ads", "proposals"])
+
+# Ограничение числа посещенных вершин одного поиска, чтобы плотные участки графа
+# не превращали поиск коротких циклов в перебор
+MAX_SEARCH_VISITS = 10_000
+
+# Новые предложения ищут цикл в фоновом воркере (команда match_new_proposals),
+# а не в запросе: поиск по базе - до max_length - 1 запросов с IN на тысячи id
+QUEUE_KEY = "barter:cycles:queue"
+WORKER_IDLE_SECONDS = 60
+
+
+class ProposalGraph:
+    """
+    Граф предложений в формате CSR: соседи вершины i - targets[offsets[i]:offsets[i + 1]].
+    Вершины пронумерованы 0..n-1 в порядке первого появления в списке ребер,
+    node_ids хранит id объявлений, edge_ids - id предложений.
+    """
+
+    __slots__ = (
+        "node_ids",
+        "out_offsets",
+        "out_targets",
+        "out_edges",
+        "in_offsets",
+        "in_sources",
+        "in_edges",
+    )
+
+    def __init__(self, senders, receivers, edge_ids):
+        index = {}
+        node_ids = array("q")
+        heads = array("l")
+        tails = array("l")
+        for ad_id in senders:
+            if ad_id not in index:
+                index[ad_id] = len(node_ids)
+                node_ids.append(ad_id)
+            heads.append(index[ad_id])
+        for ad_id in receivers:
+            if ad_id not in index:
+                index[ad_id] = len(node_ids)
+                node_ids.append(ad_id)
+            tails.append(index[ad_id])
+
+        self.node_ids = node_ids
+        self.out_offsets, self.out_targets, self.out_edges = self._compress(
+            heads, tails, edge_ids
+        )
+        self.in_offsets, self.in_sources, self.in_edges = self._compress(
+            tails, heads, edge_ids
+        )
+
+    def _compress(self, heads, tails, edge_ids):
+        """Сортировка ребер подсчетом по начальной вершине"""
+        size = len(self.node_ids)
+        offsets = array("l", bytes(array("l").itemsize * (size + 1)))
+        for head in heads:
+            offsets[head + 1] += 1
+        for i in range(size):
+            offsets[i + 1] += offsets[i]
+
+        position = array("l", offsets)
+        targets = array("l", bytes(array("l").itemsize * len(heads)))
+        edges = array("q", bytes(array("q").itemsize * len(heads)))
+        for head, tail, edge_id in zip(heads, tails, edge_ids):
+            slot = position[head]
+            targets[slot] = tail
+            edges[slot] = edge_id
+            position[head] = slot + 1
+        return offsets, targets, edges
+
+    @property
+    def size(self):
+        return len(self.node_ids)
+
+
+def strongly_connected_components(graph):
+    """
+    Итеративный алгоритм Тарьяна. Возвращает номер компоненты для каждой вершины,
+    -1 для вершин вне циклов (компоненты из одной вершины, петель в графе нет).
+    """
+    size = graph.size
+    offsets, targets = graph.out_offsets, graph.out_targets
+    index = array("l", [-1]) * size
+    low = array("l", [0]) * size
+    component = array("l", [-1]) * size
+    on_stack = bytearray(size)
+    stack = []
+    counter = 0
+    components = 0
+
+    for root in range(size):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, offsets[root])]
+
+        while work:
+            node, pos = work[-1]
+            end = offsets[node + 1]
+            while pos < end:
+                target = targets[pos]
+                pos += 1
+                if index[target] == -1:
+                    work[-1] = (node, pos)
+                    index[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = 1
+                    work.append((target, offsets[target]))
+                    break
+                if on_stack[target] and index[target] < low[node]:
+                    low[node] = index[target]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+                if low[node] == index[node]:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    if member != node:
+                        while True:
+                            component[member] = components
+                            if member == node:
+                                break
+                            member = stack.pop()
+                            on_stack[member] = 0
+                        components += 1
+
+    return component
+
+
+def shortest_path(source, target, max_length, expand_out, expand_in, max_visits=None):
+    """
+    Кратчайший путь source -> target длиной от 1 до max_length двунаправленным BFS:
+    уровни прямого поиска от source и обратного от target раскрываются по очереди,
+    всегда с меньшей стороны. При source == target находится кратчайший цикл.
+
+    expand_out(frontier) и expand_in(frontier) возвращают тройки
+    (вершина фронта, соседняя вершина, id ребра) по исходящим и входящим ребрам.
+
+    Returns:
+        Список (начало ребра, конец ребра, id ребра) или None.
+    """
+    forward = {source: None}
+    backward = {target: None}
+    forward_frontier, backward_frontier = [source], [target]
+    forward_depth = backward_depth = 0
+    visits = 0
+
+    while forward_frontier and backward_frontier:
+        if forward_depth + backward_depth >= max_length:
+            return None
+        expand_forward = len(forward_frontier) <= len(backward_frontier)
+        next_frontier = []
+        if expand_forward:
+            for node, neighbor, edge in expand_out(forward_frontier):
+                if neighbor in backward:
+                    return _join_path(forward, backward, (node, neighbor, edge))
+                if neighbor not in forward:
+                    forward[neighbor] = (node, edge)
+                    next_frontier.append(neighbor)
+            forward_frontier = next_frontier
+            forward_depth += 1
+        else:
+            for node, neighbor, edge in expand_in(backward_frontier):
+                if neighbor in forward:
+                    return _join_path(forward, backward, (neighbor, node, edge))
+                if neighbor not in backward:
+                    backward[neighbor] = (node, edge)
+                    next_frontier.append(neighbor)
+            backward_frontier = next_frontier
+            backward_depth += 1
+
+        visits += len(next_frontier)
+        if max_visits is not None and visits > max_visits:
+            return None
+    return None
+
+
+def _join_path(forward, backward, middle):
+    """Путь из цепочки прямого поиска, ребра встречи и цепочки обратного поиска"""
+    head, tail, _ = middle
+    path = [middle]
+    node = head
+    while forward[node] is not None:
+        previous, edge = forward[node]
+        path.append((previous, node, edge))
+        node = previous
+    path.reverse()
+    node = tail
+    while backward[node] is not None:
+        following, edge = backward[node]
+        path.append((node, following, edge))
+        node = following
+    return path
+
+
+def shortest_cycle(graph, start, max_length, blocked, max_visits=None):
+    """
+    Кратчайший цикл длиной до max_length, в котором start - вершина с
+    наименьшим номером: двунаправленный BFS как в shortest_path(start, start),
+    но только по свободным (blocked[node] == 0) вершинам с номером больше start.
+    Обход CSR встроен в цикл без генераторов и обратных вызовов, потому что
+    полный пересчет запускает поиск от каждой вершины.
+
+    Returns:
+        Список (начало ребра, конец ребра, id ребра) или None.
+    """
+    out_offsets, out_targets, out_edges = (
+        graph.out_offsets,
+        graph.out_targets,
+        graph.out_edges,
+    )
+    in_offsets, in_sources, in_edges = (
+        graph.in_offsets,
+        graph.in_sources,
+        graph.in_edges,
+    )
+    forward = {start: None}
+    backward = {start: None}
+    forward_frontier, backward_frontier = [start], [start]
+    depth = visits = 0
+
+    while forward_frontier and backward_frontier and depth < max_length:
+        next_frontier = []
+        if len(forward_frontier) <= len(backward_frontier):
+            for node in forward_frontier:
+                for pos in range(out_offsets[node], out_offsets[node + 1]):
+                    neighbor = out_targets[pos]
+                    if neighbor <= start or blocked[neighbor]:
+                        if neighbor == start:
+                            middle = (node, neighbor, out_edges[pos])
+                            return _join_path(forward, backward, middle)
+                        continue
+                    if neighbor in backward:
+                        middle = (node, neighbor, out_edges[pos])
+                        return _join_path(forward, backward, middle)
+                    if neighbor not in forward:
+                        forward[neighbor] = (node, out_edges[pos])
+                        next_frontier.append(neighbor)
+            forward_frontier = next_frontier
+        else:
+            for node in backward_frontier:
+                for pos in range(in_offsets[node], in_offsets[node + 1]):
+                    neighbor = in_sources[pos]
+                    if neighbor <= start or blocked[neighbor]:
+                        if neighbor == start:
+                            middle = (neighbor, node, in_edges[pos])
+                            return _join_path(forward, backward, middle)
+                        continue
+                    if neighbor in forward:
+                        middle = (neighbor, node, in_edges[pos])
+                        return _join_path(forward, backward, middle)
+                    if neighbor not in backward:
+                        backward[neighbor] = (node, in_edges[pos])
+                        next_frontier.append(neighbor)
+            backward_frontier = next_frontier
+        depth += 1
+
+        visits += len(next_frontier)
+        if max_visits is not None and visits > max_visits:
+            return None
+    return None
+
+
+def find_cycles(senders, receivers, edge_ids, max_length):
+    """
+    Жадный поиск непересекающихся циклов обмена длиной 2..max_length.
+
+    Вершины вне сильно связных компонент отбрасываются сразу. Вершины
+    перебираются в порядке появления (ребра упорядочены по дате предложения),
+    для каждой ищется кратчайший цикл из свободных вершин, в котором она самая
+    ранняя, найденный цикл занимает свои вершины. Цикл из свободных вершин
+    находится от своей самой ранней вершины, поэтому поиск не заходит в
+    вершины с меньшими номерами. Пока поиск от вершины укладывается в
+    MAX_SEARCH_VISITS, в итоге не остается цикла, не пересекающегося с
+    найденными. Поиск, упершийся в лимит, бросается, и цикл через такую
+    вершину может быть пропущен: результат - лучшая попытка, а не максимальный
+    набор циклов.
+    """
+    graph = ProposalGraph(senders, receivers, edge_ids)
+    # Занятые вершины и вершины вне циклов
+    blocked = bytearray(value < 0 for value in strongly_connected_components(graph))
+    cycles = []
+
+    for start in range(graph.size):
+        if blocked[start]:
+            continue
+        path = shortest_cycle(
+            graph, start, max_length, blocked, max_visits=MAX_SEARCH_VISITS
+        )
+        if path is None:
+            continue
+        for head, _, _ in path:
+            blocked[head] = 1
+        cycles.append(
+            MatchedCycle(
+                ads=[graph.node_ids[head] for head, _, _ in path],
+                proposals=[edge for _, _, edge in path],
+            )
+        )
+    return cycles
+
+
+def load_proposal_edges():
+    """Ребра графа: ожидающие предложения между активными объявлениями, старые первыми"""
+    senders, receivers, edge_ids = array("q"), array("q"), array("q")
+    rows = (
+        ExchangeProposal.objects.filter(
+            status=ExchangeProposal.Status.PENDING,
+            ad_sender__is_active=True,
+            ad_receiver__is_active=True,
+        )
+        .order_by("created_at", "pk")
+        .values_list("ad_sender_id", "ad_receiver_id", "pk")
+        .iterator(chunk_size=10_000)
+    )
+    for sender, receiver, edge_id in rows:
+        senders.append(sender)
+        receivers.append(receiver)
+        edge_ids.append(edge_id)
+    return senders, receivers, edge_ids
+
+
+def rebuild_cycles(max_length=None):
+    """Полный пересчет предложенных циклов обмена"""
+    max_length = max_length or settings.EXCHANGE_CYCLE_MAX_LENGTH
+    cycles = find_cycles(*load_proposal_edges(), max_length)
+    with transaction.atomic():
+        ExchangeCycle.objects.all().delete()
+        ExchangeCycle.objects.bulk_create(
+            [
+                ExchangeCycle(ads=cycle.ads, proposals=cycle.proposals)
+                for cycle in cycles
+            ],
+            batch_size=1000,
+        )
+    return cycles
+
+
+def _expand_out_db(frontier):
+    return ExchangeProposal.objects.filter(
+        ad_sender_id__in=frontier,
+        status=ExchangeProposal.Status.PENDING,
+        ad_receiver__is_active=True,
+    ).values_list("ad_sender_id", "ad_receiver_id", "pk")
+
+
+def _expand_in_db(frontier):
+    return ExchangeProposal.objects.filter(
+        ad_receiver_id__in=frontier,
+        status=ExchangeProposal.Status.PENDING,
+        ad_sender__is_active=True,
+    ).values_list("ad_receiver_id", "ad_sender_id", "pk")
+
+
+def _overlaps_valid_cycle(ads):
+    """
+    Есть ли действующий цикл с этими объявлениями. Устаревшие циклы (предложение
+    уже не ожидает ответа или объявление снято) не мешают и удаляются.
+    """
+    cycles = list(ExchangeCycle.objects.filter(ads__overlap=ads))
+    valid = {cycle.pk for cycle in get_valid_cycles(cycles)}
+    stale = [cycle.pk for cycle in cycles if cycle.pk not in valid]
+    if stale:
+        ExchangeCycle.objects.filter(pk__in=stale).delete()
+    return bool(valid)
+
+
+def match_new_proposal(proposal_id, max_length=None):
+    """
+    Инкрементальный поиск после создания предложения sender -> receiver: новый цикл
+    обязан содержать это ребро, поэтому ищется только путь receiver -> sender
+    длиной до max_length - 1. Каждый уровень BFS - один запрос к базе.
+
+    Returns:
+        Созданный ExchangeCycle или None.
+    """
+    max_length = max_length or settings.EXCHANGE_CYCLE_MAX_LENGTH
+    proposal = (
+        ExchangeProposal.objects.filter(
+            pk=proposal_id,
+            status=ExchangeProposal.Status.PENDING,
+            ad_sender__is_active=True,
+            ad_receiver__is_active=True,
+        )
+        .values("ad_sender_id", "ad_receiver_id")
+        .first()
+    )
+    if proposal is None:
+        return None
+    sender, receiver = proposal["ad_sender_id"], proposal["ad_receiver_id"]
+    if _overlaps_valid_cycle([sender, receiver]):
+        return None
+
+    path = shortest_path(
+        receiver,
+        sender,
+        max_length - 1,
+        _expand_out_db,
+        _expand_in_db,
+        max_visits=MAX_SEARCH_VISITS,
+    )
+    if path is None:
+        return None
+
+    ads = [sender] + [head for head, _, _ in path]
+    # Объявления уже предложены в другом цикле - дождемся полного пересчета
+    if _overlaps_valid_cycle(ads):
+        return None
+    return ExchangeCycle.objects.create(
+        ads=ads, proposals=[proposal_id] + [edge for _, _, edge in path]
+    )
+
+
+def enqueue_new_proposals(proposal_ids):
+    """Ставит предложения в очередь поиска циклов после коммита транзакции"""
+    if proposal_ids:
+        transaction.on_commit(
+            partial(get_redis_connection("default").rpush, QUEUE_KEY, *proposal_ids)
+        )
+
+
+def run_matcher(once=False):
+    """
+    Ищет циклы для предложений из очереди. Ошибка на одном предложении
+    записывается в лог и не останавливает воркер: цикл с ним найдет
+    периодический пересчет match_cycles.
+
+    Args:
+        once: Обработать очередь и выйти.
+
+    Returns:
+        Количество созданных циклов при once=True.
+    """
+    redis = get_redis_connection("default")
+    matched = 0
+    while True:
+        try:
+            if once:
+                item = redis.lpop(QUEUE_KEY)
+            else:
+                item = redis.blpop([QUEUE_KEY], timeout=WORKER_IDLE_SECONDS)
+                item = item[1] if item else None
+        except Exception:
+            if once:
+                raise
+            logger.exception("Exchange cycle queue is unavailable")
+            time.sleep(WORKER_IDLE_SECONDS)
+            continue
+
+        if item is None:
+            if once:
+                return matched
+            continue
+        try:
+            matched += match_new_proposal(int(item)) is not None
+        except Exception:
+            logger.exception("Exchange cycle matching failed for proposal %s", item)
+
+
+def generate_random_graph(nodes, edges, seed=None):
+    """
+    Синтетический граф предложений для бенчмарка: случайные ребра без петель
+    и повторов, как у уникальных пар (ad_sender, ad_receiver).
+    """
+    rng = random.Random(seed)
+    senders, receivers, edge_ids = array("q"), array("q"), array("q")
+    seen = set()
+    while len(edge_ids) < edges:
+        sender = rng.randrange(nodes)
+        receiver = rng.randrange(nodes)
+        if sender == receiver or (sender, receiver) in seen:
+            continue
+        seen.add((sender, receiver))
+        senders.append(sender)
+        receivers.append(receiver)
+        edge_ids.append(len(edge_ids))
+    return senders, receivers, edge_ids
+
+
+def get_valid_cycles(cycles):
+    """Циклы, все предложения которых еще ожидают ответа и все объявления активны"""
+    proposal_ids = {pk for cycle in cycles for pk in cycle.proposals}
+    valid_proposals = set(
+        ExchangeProposal.objects.filter(
+            pk__in=proposal_ids,
+            status=ExchangeProposal.Status.PENDING,
+            ad_sender__is_active=True,
+            ad_receiver__is_active=True,
+        ).values_list("pk", flat=True)
+    )
+    return [cycle for cycle in cycles if valid_proposals.issuperset(cycle.proposals)]
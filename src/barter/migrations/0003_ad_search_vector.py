@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-17 15:49
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Поддерживаем search_vector в актуальном состоянии на стороне базы,
+# чтобы он обновлялся и при save(), и при массовых update() заголовка или описания.
+# Конфигурация "russian" должна совпадать с barter.search.SEARCH_CONFIG.
+CREATE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION barter_ad_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER barter_ad_search_vector_update
+BEFORE INSERT OR UPDATE OF title, description ON barter_ad
+FOR EACH ROW EXECUTE FUNCTION barter_ad_search_vector_trigger();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS barter_ad_search_vector_update ON barter_ad;
+DROP FUNCTION IF EXISTS barter_ad_search_vector_trigger();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("barter", "0002_remove_ad_image_url_ad_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ad",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="ad_search_vector_idx"
+            ),
+        ),
+        # Существующие объявления заполняются командой rebuild_ad_search_vectors
+        migrations.RunSQL(CREATE_TRIGGER_SQL, reverse_sql=DROP_TRIGGER_SQL),
+    ]
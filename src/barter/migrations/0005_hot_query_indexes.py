@@ -0,0 +1,74 @@
+# Generated by Django 5.2 on 2026-10-17 15:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("barter", "0004_ad_trigram_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["-created_at", "-id"],
+                name="ad_active_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["category", "-created_at", "-id"],
+                name="ad_active_category_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["condition", "-created_at", "-id"],
+                name="ad_active_condition_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="ad_user_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="exchangeproposal",
+            index=models.Index(
+                fields=["ad_sender", "-created_at"], name="proposal_sender_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="exchangeproposal",
+            index=models.Index(
+                fields=["ad_receiver", "-created_at"],
+                name="proposal_receiver_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="exchangeproposal",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["ad_sender"],
+                name="proposal_pending_sender_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="exchangeproposal",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["ad_receiver"],
+                name="proposal_pending_receiver_idx",
+            ),
+        ),
+    ]
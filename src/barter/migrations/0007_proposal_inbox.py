@@ -0,0 +1,124 @@
+# Generated by Django 5.2 on 2026-10-17 17:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("barter", "0006_exchange_cycle"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProposalInboxCounter",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="proposal_inbox_counter",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+                (
+                    "sent_pending",
+                    models.IntegerField(
+                        default=0, verbose_name="Ожидающие отправленные"
+                    ),
+                ),
+                (
+                    "received_pending",
+                    models.IntegerField(default=0, verbose_name="Ожидающие полученные"),
+                ),
+                (
+                    "unread",
+                    models.IntegerField(default=0, verbose_name="Непрочитанные"),
+                ),
+            ],
+            options={
+                "verbose_name": "Счетчики ленты предложений",
+                "verbose_name_plural": "Счетчики лент предложений",
+            },
+        ),
+        migrations.CreateModel(
+            name="ProposalInboxEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "box",
+                    models.CharField(
+                        choices=[("sent", "Отправленные"), ("received", "Полученные")],
+                        max_length=10,
+                        verbose_name="Папка",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Ожидает"),
+                            ("accepted", "Принято"),
+                            ("rejected", "Отклонено"),
+                            ("cancelled", "Отменено"),
+                        ],
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "is_read",
+                    models.BooleanField(default=False, verbose_name="Прочитано"),
+                ),
+                ("created_at", models.DateTimeField(verbose_name="Дата создания")),
+                (
+                    "proposal",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="inbox_entries",
+                        to="barter.exchangeproposal",
+                        verbose_name="Предложение",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="proposal_inbox",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Запись ленты предложений",
+                "verbose_name_plural": "Ленты предложений",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "box", "-created_at", "-id"],
+                        name="inbox_user_box_created_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("proposal", "box"), name="unique_inbox_entry"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("barter", "0007_proposal_inbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ad",
+            name="image_variants",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                verbose_name="Варианты изображения",
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2 on 2026-10-17 19:20
+
+from collections import Counter
+
+from django.db import migrations, models
+
+import barter.storage
+
+
+def count_existing_refs(apps, schema_editor):
+    # Ссылки существующих объявлений, иначе sweep_ad_images считал бы их файлы
+    # неучтенными. Вызывать Ad.collect_image_files у исторической модели нельзя
+    Ad = apps.get_model("barter", "Ad")
+    ImageBlob = apps.get_model("barter", "ImageBlob")
+    counts = Counter()
+    for image, variants in Ad.objects.values_list("image", "image_variants").iterator():
+        if image:
+            counts[image] += 1
+        for name, variant in variants.items():
+            if name != "source":
+                counts.update(
+                    variant[fmt] for fmt in ("webp", "jpeg") if variant.get(fmt)
+                )
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name, refs=refs) for name, refs in counts.items()],
+        batch_size=10_000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("barter", "0008_ad_image_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageBlob",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        max_length=255,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Имя файла",
+                    ),
+                ),
+                (
+                    "refs",
+                    models.IntegerField(default=0, verbose_name="Количество ссылок"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата изменения"),
+                ),
+            ],
+            options={
+                "verbose_name": "Файл изображения",
+                "verbose_name_plural": "Файлы изображений",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("refs", 0)),
+                        fields=["updated_at"],
+                        name="image_blob_unused_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AlterField(
+            model_name="ad",
+            name="image",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                storage=barter.storage.ContentAddressedStorage(),
+                upload_to="ads_images",
+                verbose_name="Изображение",
+            ),
+        ),
+        migrations.RunPython(count_existing_refs, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,14 @@
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 from user.models import CustomUser
 
+from .storage import ad_image_storage
+
 
 class Ad(models.Model):
     class Condition(models.TextChoices):
@@ -25,8 +31,18 @@ class Ad(models.Model):
     )
     title = models.CharField(max_length=200, verbose_name=_("Заголовок"))
     description = models.TextField(verbose_name=_("Описание"))
+    # Одинаковые файлы хранятся один раз, ссылки на них учитывает ImageBlob
     image = models.ImageField(
-        upload_to="ads_images", blank=True, null=True, verbose_name=_("Изображение")
+        upload_to="ads_images",
+        storage=ad_image_storage,
+        blank=True,
+        null=True,
+        verbose_name=_("Изображение"),
+    )
+    # Уменьшенные копии image, заполняет воркер process_ad_images:
+    # {"source": имя исходного файла, вариант: {"width", "height", формат: путь}}
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name=_("Варианты изображения")
     )
     category = models.CharField(
         max_length=20,
@@ -44,15 +60,90 @@ class Ad(models.Model):
         auto_now_add=True, verbose_name=_("Дата создания")
     )
     is_active = models.BooleanField(default=True, verbose_name=_("Активно"))
+    # Заполняется триггером в базе при изменении заголовка или описания
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name=_("Поисковый вектор")
+    )
 
     class Meta:
         verbose_name = _("Объявление")
         verbose_name_plural = _("Объявления")
         ordering = ["-created_at"]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="ad_search_vector_idx"),
+            GinIndex(
+                fields=["title"], opclasses=["gin_trgm_ops"], name="ad_title_trgm_idx"
+            ),
+            GinIndex(
+                fields=["description"],
+                opclasses=["gin_trgm_ops"],
+                name="ad_description_trgm_idx",
+            ),
+            # Лента активных объявлений и ее фильтры по категории и состоянию
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_active=True),
+                name="ad_active_created_idx",
+            ),
+            models.Index(
+                fields=["category", "-created_at", "-id"],
+                condition=models.Q(is_active=True),
+                name="ad_active_category_idx",
+            ),
+            models.Index(
+                fields=["condition", "-created_at", "-id"],
+                condition=models.Q(is_active=True),
+                name="ad_active_condition_idx",
+            ),
+            # Мои объявления
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="ad_user_created_idx"
+            ),
+        ]
+
+    # Форматы файлов вариантов в image_variants
+    IMAGE_FORMATS = ("webp", "jpeg")
 
     def __str__(self):
         return f"{self.title} ({self.get_category_display()})"
 
+    @classmethod
+    def collect_image_files(cls, image_name, variants):
+        """Имена файлов хранилища, на которые ссылаются image и image_variants"""
+        files = {image_name} if image_name else set()
+        for name, variant in variants.items():
+            if name != "source":
+                files.update(
+                    variant[fmt] for fmt in cls.IMAGE_FORMATS if variant.get(fmt)
+                )
+        return files
+
+    def get_image_files(self):
+        return self.collect_image_files(self.image.name, self.image_variants)
+
+    def get_image_variant(self, name):
+        """Вариант текущего изображения или None, пока воркер его не построил"""
+        if not self.image or self.image_variants.get("source") != self.image.name:
+            return None
+        return self.image_variants.get(name)
+
+    def get_image_url(self, name, fmt="jpeg"):
+        """URL варианта изображения, до обработки - исходного файла"""
+        if not self.image:
+            return None
+        variant = self.get_image_variant(name)
+        if variant is None:
+            return self.image.url
+        return self.image.storage.url(variant[fmt])
+
+    def get_image_srcset(self, fmt="jpeg"):
+        """Все готовые варианты в формате атрибута srcset, от меньшего к большему"""
+        variants = filter(None, map(self.get_image_variant, settings.AD_IMAGE_VARIANTS))
+        return [
+            (self.image.storage.url(variant[fmt]), variant["width"])
+            for variant in sorted(variants, key=lambda variant: variant["width"])
+        ]
+
 
 class ExchangeProposal(models.Model):
     class Status(models.TextChoices):
@@ -93,6 +184,163 @@ class ExchangeProposal(models.Model):
                 fields=["ad_sender", "ad_receiver"], name="unique_exchange_proposal"
             )
         ]
+        indexes = [
+            # Отправленные и полученные предложения пользователя
+            models.Index(
+                fields=["ad_sender", "-created_at"], name="proposal_sender_created_idx"
+            ),
+            models.Index(
+                fields=["ad_receiver", "-created_at"],
+                name="proposal_receiver_created_idx",
+            ),
+            # Ожидающие предложения по объявлению, которые отменяются при обмене
+            models.Index(
+                fields=["ad_sender"],
+                condition=models.Q(status="pending"),
+                name="proposal_pending_sender_idx",
+            ),
+            models.Index(
+                fields=["ad_receiver"],
+                condition=models.Q(status="pending"),
+                name="proposal_pending_receiver_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Предложение обмена #{self.id} ({self.get_status_display()})"
+
+
+class ExchangeCycle(models.Model):
+    """
+    Предложенный многосторонний обмен: цикл ожидающих предложений, в котором
+    владелец каждого объявления ads[i] получает объявление ads[i + 1],
+    а proposals[i] - предложение ads[i] -> ads[i + 1].
+    """
+
+    ads = ArrayField(models.BigIntegerField(), verbose_name=_("Объявления"))
+    proposals = ArrayField(models.BigIntegerField(), verbose_name=_("Предложения"))
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name=_("Дата создания")
+    )
+
+    class Meta:
+        verbose_name = _("Цикл обмена")
+        verbose_name_plural = _("Циклы обмена")
+        ordering = ["-created_at"]
+        indexes = [
+            # Циклы с объявлениями пользователя и проверка пересечения с новым циклом
+            GinIndex(fields=["ads"], name="exchange_cycle_ads_idx"),
+        ]
+
+    @property
+    def length(self):
+        return len(self.ads)
+
+    def __str__(self):
+        return f"Цикл обмена #{self.id} ({self.length})"
+
+
+class ProposalInboxEntry(models.Model):
+    """
+    Предложение в списке отправленных или полученных предложений пользователя.
+    Денормализованная копия ExchangeProposal: список читается по индексу
+    (user, box, created_at) без соединения через объявления.
+    """
+
+    class Box(models.TextChoices):
+        SENT = "sent", _("Отправленные")
+        RECEIVED = "received", _("Полученные")
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name="proposal_inbox",
+        verbose_name=_("Пользователь"),
+    )
+    proposal = models.ForeignKey(
+        ExchangeProposal,
+        on_delete=models.CASCADE,
+        related_name="inbox_entries",
+        verbose_name=_("Предложение"),
+    )
+    box = models.CharField(max_length=10, choices=Box.choices, verbose_name=_("Папка"))
+    status = models.CharField(
+        max_length=20,
+        choices=ExchangeProposal.Status.choices,
+        verbose_name=_("Статус"),
+    )
+    is_read = models.BooleanField(default=False, verbose_name=_("Прочитано"))
+    created_at = models.DateTimeField(verbose_name=_("Дата создания"))
+
+    class Meta:
+        verbose_name = _("Запись ленты предложений")
+        verbose_name_plural = _("Ленты предложений")
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["proposal", "box"], name="unique_inbox_entry"
+            )
+        ]
+        indexes = [
+            # Страница отправленных или полученных предложений пользователя
+            models.Index(
+                fields=["user", "box", "-created_at", "-id"],
+                name="inbox_user_box_created_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_box_display()} #{self.proposal_id} ({self.user_id})"
+
+
+class ProposalInboxCounter(models.Model):
+    """Счетчики ленты предложений пользователя, меняются вместе с ProposalInboxEntry"""
+
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="proposal_inbox_counter",
+        verbose_name=_("Пользователь"),
+    )
+    sent_pending = models.IntegerField(
+        default=0, verbose_name=_("Ожидающие отправленные")
+    )
+    received_pending = models.IntegerField(
+        default=0, verbose_name=_("Ожидающие полученные")
+    )
+    unread = models.IntegerField(default=0, verbose_name=_("Непрочитанные"))
+
+    class Meta:
+        verbose_name = _("Счетчики ленты предложений")
+        verbose_name_plural = _("Счетчики лент предложений")
+
+    def __str__(self):
+        return f"Счетчики предложений пользователя {self.user_id}"
+
+
+class ImageBlob(models.Model):
+    """
+    Счетчик ссылок объявлений на файл хранилища изображений: исходное
+    изображение или его вариант. Файлы без ссылок удаляет sweep_ad_images.
+    """
+
+    name = models.CharField(
+        max_length=255, primary_key=True, verbose_name=_("Имя файла")
+    )
+    refs = models.IntegerField(default=0, verbose_name=_("Количество ссылок"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Дата изменения"))
+
+    class Meta:
+        verbose_name = _("Файл изображения")
+        verbose_name_plural = _("Файлы изображений")
+        indexes = [
+            models.Index(
+                fields=["updated_at"],
+                name="image_blob_unused_idx",
+                condition=models.Q(refs=0),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refs})"
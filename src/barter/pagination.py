@@ -0,0 +1,159 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Непрозрачный курсор: значения полей сортировки последней записи страницы"""
+    values = [
+        value.isoformat() if isinstance(value, (date, datetime)) else value
+        for value in values
+    ]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        # binascii.Error и UnicodeDecodeError - подклассы ValueError
+        raise InvalidCursor("Неверный курсор")
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor("Неверный курсор")
+    return values
+
+
+def get_keyset_ordering(queryset):
+    """
+    Сортировка queryset с уникальным id в конце, чтобы записи с одинаковыми
+    значениями сортировки не терялись и не дублировались между страницами.
+    """
+    ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+        descending = bool(ordering) and ordering[-1].startswith("-")
+        ordering.append("-id" if descending else "id")
+    return ordering
+
+
+def get_ordering_field(queryset, name):
+    """Поле модели или поле результата аннотации, по которому идет сортировка"""
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    opts = queryset.model._meta
+    return opts.pk if name == "pk" else opts.get_field(name)
+
+
+def parse_cursor_values(queryset, ordering, values):
+    """
+    Приводит значения курсора к типам полей сортировки. Курсор приходит от
+    клиента: без проверки ["x", "x"] дошел бы до filter() или базы и вместо 400
+    ответ был бы 500.
+
+    Raises:
+        InvalidCursor: если значение не подходит полю.
+    """
+    parsed = []
+    for field, value in zip(ordering, values):
+        if value is None or isinstance(value, (list, dict)):
+            raise InvalidCursor("Неверный курсор")
+        try:
+            model_field = get_ordering_field(queryset, field.lstrip("-"))
+        except FieldDoesNotExist:
+            parsed.append(value)
+            continue
+        try:
+            value = model_field.to_python(value)
+            # Валидаторы проверяют и диапазон целых чисел в базе
+            model_field.run_validators(value)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor("Неверный курсор")
+        parsed.append(value)
+    return parsed
+
+
+def build_keyset_filter(ordering, values):
+    """
+    Условие «после курсора» для сортировки ordering.
+
+    Первое поле дополнительно ограничено нестрогим неравенством, чтобы планировщик
+    мог начать сканирование индекса сразу с позиции курсора, а не с начала.
+    """
+    first_field = ordering[0].lstrip("-")
+    first_lookup = "lte" if ordering[0].startswith("-") else "gte"
+    condition = models.Q()
+    for i, field in enumerate(ordering):
+        lookup = "lt" if field.startswith("-") else "gt"
+        step = models.Q(**{f"{field.lstrip('-')}__{lookup}": values[i]})
+        for previous_field, previous_value in zip(ordering[:i], values[:i]):
+            step &= models.Q(**{previous_field.lstrip("-"): previous_value})
+        condition |= step
+    return models.Q(**{f"{first_field}__{first_lookup}": values[0]}) & condition
+
+
+def clamp_limit(limit):
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return clamp_limit(limit)
+
+
+def paginate_keyset(request, queryset, cursor_param="cursor", limit=None):
+    """
+    Keyset-пагинация по параметрам запроса limit и cursor_param.
+
+    Вместо OFFSET страница начинается с условия по значениям сортировки последней
+    записи предыдущей страницы, поэтому время ответа не зависит от глубины страницы.
+
+    Несколько списков в одном ответе листаются независимо, если у каждого
+    свой cursor_param. Уже разобранный limit (aboba_swagger(validate=True))
+    передается аргументом, иначе читается из запроса.
+
+    Returns:
+        Кортеж (список записей страницы, абсолютная ссылка на следующую страницу или None).
+
+    Raises:
+        InvalidCursor: если cursor не удалось разобрать или его значения не
+            подходят полям сортировки.
+    """
+    ordering = get_keyset_ordering(queryset)
+    if limit is None:
+        limit = parse_limit(request.GET.get("limit"))
+    else:
+        limit = clamp_limit(limit)
+
+    cursor = request.GET.get(cursor_param)
+    if cursor:
+        values = parse_cursor_values(
+            queryset, ordering, decode_cursor(cursor, len(ordering))
+        )
+        queryset = queryset.filter(build_keyset_filter(ordering, values))
+
+    # Одна лишняя запись показывает, есть ли следующая страница, без COUNT(*)
+    items = list(queryset.order_by(*ordering)[: limit + 1])
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    last = items[-1]
+    params = request.GET.copy()
+    params[cursor_param] = encode_cursor(
+        [getattr(last, field.lstrip("-")) for field in ordering]
+    )
+    return items, request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
@@ -0,0 +1,143 @@
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+    TrigramWordSimilarity,
+)
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.functions import Cast, Greatest
+
+# Конфигурация полнотекстового поиска соответствует LANGUAGE_CODE = "ru-RU".
+# Триггер из миграции 0003_ad_search_vector использует ту же конфигурацию.
+SEARCH_CONFIG = "russian"
+
+SEARCH_BACKEND_FTS = "fts"
+SEARCH_BACKEND_TRIGRAM = "trigram"
+SEARCH_BACKEND_ICONTAINS = "icontains"
+
+
+def build_search_vector():
+    """Выражение tsvector для объявления: заголовок важнее описания"""
+    return SearchVector("title", weight="A", config=SEARCH_CONFIG) + SearchVector(
+        "description", weight="B", config=SEARCH_CONFIG
+    )
+
+
+def parse_similarity_threshold(value):
+    """Порог похожести из параметра запроса, None если параметр не задан или некорректен"""
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        return None
+    return clean_similarity_threshold(threshold)
+
+
+def clean_similarity_threshold(threshold):
+    """Порог похожести, если он в (0, 1], иначе None - порог по умолчанию"""
+    if threshold is not None and 0 < threshold <= 1:
+        return threshold
+    return None
+
+
+def search_ads(queryset, search_query, backend=None):
+    """
+    Фильтрует объявления по поисковому запросу.
+
+    Бэкенд выбирается настройкой AD_SEARCH_BACKEND:
+        - "fts": поиск по Ad.search_vector (GIN индекс), результаты упорядочены по релевантности
+        - "trigram": нечеткий поиск по частям слов и с опечатками (GIN индексы gin_trgm_ops),
+            запрос выполняется внутри word_similarity_threshold
+        - "icontains": старый поиск по подстроке в заголовке и описании
+    """
+    backend = backend or settings.AD_SEARCH_BACKEND
+
+    if backend == SEARCH_BACKEND_ICONTAINS:
+        return queryset.filter(
+            models.Q(title__icontains=search_query)
+            | models.Q(description__icontains=search_query)
+        )
+
+    if backend == SEARCH_BACKEND_FTS:
+        query = SearchQuery(search_query, config=SEARCH_CONFIG, search_type="websearch")
+        return (
+            queryset.filter(search_vector=query)
+            # ts_rank возвращает real; double precision без потерь переживает курсор пагинации
+            .annotate(
+                rank=Cast(
+                    SearchRank(models.F("search_vector"), query), models.FloatField()
+                )
+            ).order_by("-rank", "-created_at")
+        )
+
+    if backend == SEARCH_BACKEND_TRIGRAM:
+        # Подстрока ищется через ~* а не icontains: icontains компилируется в UPPER(...) LIKE,
+        # который не попадает в индекс, а ~* и %> обслуживаются триграммными GIN индексами
+        substring = re.escape(search_query)
+        return (
+            queryset.filter(
+                models.Q(title__iregex=substring)
+                | models.Q(description__iregex=substring)
+                | models.Q(title__trigram_word_similar=search_query)
+                | models.Q(description__trigram_word_similar=search_query)
+            )
+            .annotate(
+                similarity=Cast(
+                    Greatest(
+                        TrigramWordSimilarity(search_query, "title"),
+                        TrigramWordSimilarity(search_query, "description"),
+                    ),
+                    models.FloatField(),
+                )
+            )
+            .order_by("-similarity", "-created_at")
+        )
+
+    raise ValueError(f"Неизвестный бэкенд поиска объявлений: {backend}")
+
+
+@contextmanager
+def word_similarity_threshold(search_query, threshold=None, using=DEFAULT_DB_ALIAS):
+    """
+    Порог похожести для запросов search_ads внутри блока.
+
+    Оператор %> использует порог из настройки pg_trgm.word_similarity_threshold,
+    а не из самого запроса - иначе индекс не используется. set_config(..., true)
+    действует до конца транзакции, поэтому порог одного запроса не достается
+    следующим на том же постоянном соединении (CONN_MAX_AGE). Для других
+    бэкендов и пустого запроса блок ничего не делает.
+
+    Args:
+        threshold: порог word_similarity, по умолчанию AD_SEARCH_TRIGRAM_THRESHOLD.
+    """
+    if not search_query or settings.AD_SEARCH_BACKEND != SEARCH_BACKEND_TRIGRAM:
+        yield
+        return
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                [str(threshold or settings.AD_SEARCH_TRIGRAM_THRESHOLD)],
+            )
+        yield
+
+
+def suggest_search_query(queryset, search_query):
+    """
+    Подсказка «Возможно, вы имели в виду»: самый похожий по триграммам заголовок.
+    Возвращает None, если похожих заголовков нет или он совпадает с запросом.
+    """
+    title = (
+        queryset.filter(title__trigram_similar=search_query)
+        .annotate(similarity=TrigramSimilarity("title", search_query))
+        .order_by("-similarity")
+        .values_list("title", flat=True)
+        .first()
+    )
+    if title and title.casefold() != search_query.casefold():
+        return title
+    return None
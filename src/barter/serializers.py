@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
@@ -6,7 +7,52 @@ from .models import Ad, ExchangeProposal
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class EagerLoadingMixin:
+    """
+    Загрузка связей, которые читает сериализатор, одним запросом.
+
+    Сериализатор объявляет в Meta:
+        select_related - связи, которые читают SerializerMethodField
+        only_fields - поля вне Meta.fields, которые читают SerializerMethodField
+    Поля модели из Meta.fields и вложенные сериализаторы с этим миксином
+    учитываются автоматически.
+    """
+
+    @classmethod
+    def get_eager_loading(cls, prefix=""):
+        """Пути для select_related и only() с префиксом prefix"""
+        meta = cls.Meta
+        concrete_fields = {field.name for field in meta.model._meta.concrete_fields}
+        select_related = [prefix + name for name in getattr(meta, "select_related", [])]
+        # Связь, загружаемая через select_related, не может быть отложена only()
+        only = select_related + [
+            prefix + name for name in getattr(meta, "only_fields", [])
+        ]
+
+        for name in meta.fields:
+            field = cls._declared_fields.get(name)
+            source = getattr(field, "source", None) or name
+            if isinstance(field, EagerLoadingMixin):
+                nested_select_related, nested_only = field.get_eager_loading(
+                    f"{prefix}{source}__"
+                )
+                select_related += [prefix + source, *nested_select_related]
+                only += [prefix + source, *nested_only]
+            elif source in concrete_fields:
+                only.append(prefix + source)
+
+        return select_related, only
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """Добавляет к queryset select_related и only() по объявлениям сериализатора"""
+        select_related, only = cls.get_eager_loading()
+        if select_related:
+            queryset = queryset.select_related(*dict.fromkeys(select_related))
+        return queryset.only(*dict.fromkeys(only))
+
+
+class UserSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Сериализатор для пользователя в API"""
 
     class Meta:
@@ -14,13 +60,16 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "email"]
 
 
-class AdSerializer(serializers.ModelSerializer):
+class AdSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Базовый сериализатор для объявлений"""
 
     category_display = serializers.SerializerMethodField()
     condition_display = serializers.SerializerMethodField()
     user_username = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+    # Вариант изображения для image_url, см. AD_IMAGE_VARIANTS
+    image_variant = "card"
 
     class Meta:
         model = Ad
@@ -37,8 +86,11 @@ class AdSerializer(serializers.ModelSerializer):
             "is_active",
             "created_at",
             "image_url",
+            "image_srcset",
         ]
         read_only_fields = ["user", "created_at"]
+        select_related = ["user"]
+        only_fields = ["image", "image_variants", "user__username"]
 
     def get_category_display(self, obj):
         return obj.get_category_display()
@@ -52,14 +104,28 @@ class AdSerializer(serializers.ModelSerializer):
     def get_image_url(self, obj):
         request = self.context.get("request")
         if obj.image and request:
-            return request.build_absolute_uri(obj.image.url)
+            return request.build_absolute_uri(obj.get_image_url(self.image_variant))
         return None
 
+    def get_image_srcset(self, obj):
+        """srcset готовых вариантов по форматам, пустой до обработки изображения"""
+        request = self.context.get("request")
+        if not obj.image or not request:
+            return None
+        return {
+            fmt: ", ".join(
+                f"{request.build_absolute_uri(url)} {width}w"
+                for url, width in obj.get_image_srcset(fmt)
+            )
+            for fmt in ("webp", "jpeg")
+        }
+
 
 class AdDetailSerializer(AdSerializer):
     """Расширенный сериализатор для детального просмотра объявления"""
 
     user = UserSerializer(read_only=True)
+    image_variant = "detail"
 
     class Meta(AdSerializer.Meta):
         fields = AdSerializer.Meta.fields
@@ -87,7 +153,7 @@ class AdCreateUpdateSerializer(serializers.ModelSerializer):
         return value
 
 
-class SimpleAdSerializer(serializers.ModelSerializer):
+class SimpleAdSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Упрощенный сериализатор для отображения объявления в предложениях обмена"""
 
     category_display = serializers.SerializerMethodField()
@@ -104,6 +170,8 @@ class SimpleAdSerializer(serializers.ModelSerializer):
             "condition_display",
             "user_username",
         ]
+        select_related = ["user"]
+        only_fields = ["category", "condition", "user__username"]
 
     def get_category_display(self, obj):
         return obj.get_category_display()
@@ -115,7 +183,7 @@ class SimpleAdSerializer(serializers.ModelSerializer):
         return obj.user.username
 
 
-class ExchangeProposalSerializer(serializers.ModelSerializer):
+class ExchangeProposalSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Базовый сериализатор для предложений обмена"""
 
     ad_sender = SimpleAdSerializer(read_only=True)
@@ -139,7 +207,7 @@ class ExchangeProposalSerializer(serializers.ModelSerializer):
         return obj.get_status_display()
 
 
-class ExchangeProposalListSerializer(serializers.ModelSerializer):
+class ExchangeProposalListSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Сериализатор для списка предложений обмена"""
 
     ad_sender_title = serializers.SerializerMethodField()
@@ -157,6 +225,8 @@ class ExchangeProposalListSerializer(serializers.ModelSerializer):
             "status_display",
             "created_at",
         ]
+        select_related = ["ad_sender", "ad_receiver"]
+        only_fields = ["ad_sender__title", "ad_receiver__title"]
 
     def get_ad_sender_title(self, obj):
         return obj.ad_sender.title
@@ -209,6 +279,24 @@ class ExchangeProposalCreateSerializer(serializers.ModelSerializer):
         return data
 
 
+class ExchangeProposalBulkItemSerializer(serializers.Serializer):
+    """Элемент массового создания, объявления проверяются в create_proposals"""
+
+    ad_sender = serializers.IntegerField(min_value=1)
+    ad_receiver = serializers.IntegerField(min_value=1)
+    comment = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class ExchangeProposalBulkCreateSerializer(serializers.Serializer):
+    """Сериализатор для массового создания предложений обмена"""
+
+    proposals = serializers.ListField(
+        child=ExchangeProposalBulkItemSerializer(),
+        allow_empty=False,
+        max_length=settings.PROPOSAL_BULK_MAX_ITEMS,
+    )
+
+
 class ExchangeProposalUpdateSerializer(serializers.ModelSerializer):
     """Сериализатор для обновления статуса предложения обмена"""
 
@@ -222,3 +310,19 @@ class ExchangeProposalUpdateSerializer(serializers.ModelSerializer):
                 "Статус может быть только 'accepted' или 'rejected'"
             )
         return value
+
+
+class ExchangeCycleSerializer(serializers.Serializer):
+    """Сериализатор цикла обмена, объявления передаются в контексте ads_by_id"""
+
+    id = serializers.IntegerField()
+    length = serializers.IntegerField()
+    ads = serializers.SerializerMethodField()
+    proposals = serializers.ListField(child=serializers.IntegerField())
+    created_at = serializers.DateTimeField()
+
+    def get_ads(self, obj):
+        ads_by_id = self.context["ads_by_id"]
+        return SimpleAdSerializer(
+            [ads_by_id[pk] for pk in obj.ads], many=True, context=self.context
+        ).data
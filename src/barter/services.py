@@ -0,0 +1,218 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+
+from .cache import invalidate_ads
+from .inbox import add_proposals, sync_statuses
+from .matching import enqueue_new_proposals
+from .models import Ad, ExchangeProposal
+
+EXISTING_PROPOSAL_MESSAGE = "Предложение обмена между этими объявлениями уже существует"
+
+
+def accept_proposal(proposal):
+    """
+    Принимает предложение обмена: оба объявления деактивируются, остальные
+    ожидающие предложения с их участием отменяются.
+
+    Выполняется в одной транзакции фиксированным числом запросов. Объявления
+    блокируются select_for_update в порядке id, поэтому из двух параллельных
+    принятий с общим объявлением успешно только первое - второе увидит его
+    неактивным.
+
+    Returns:
+        Количество измененных строк, 0 если предложение уже не ожидает
+        ответа или одно из объявлений неактивно.
+    """
+    with transaction.atomic():
+        ads = dict(
+            Ad.objects.select_for_update()
+            .filter(
+                pk__in=[proposal.ad_sender_id, proposal.ad_receiver_id], is_active=True
+            )
+            .order_by("pk")
+            .values_list("pk", "category")
+        )
+        if len(ads) != 2:
+            return 0
+
+        accepted = ExchangeProposal.objects.filter(
+            pk=proposal.pk, status=ExchangeProposal.Status.PENDING
+        ).update(status=ExchangeProposal.Status.ACCEPTED)
+        if not accepted:
+            return 0
+
+        deactivated = Ad.objects.filter(pk__in=ads).update(is_active=False)
+        affected = ExchangeProposal.objects.filter(
+            models.Q(ad_sender_id__in=ads) | models.Q(ad_receiver_id__in=ads)
+        )
+        cancelled = (
+            affected.filter(status=ExchangeProposal.Status.PENDING)
+            .exclude(pk=proposal.pk)
+            .update(status=ExchangeProposal.Status.CANCELLED)
+        )
+        # update() не вызывает сигналы, ленты предложений и кеш ленты объявлений
+        # обновляются явно
+        sync_statuses(affected)
+        transaction.on_commit(partial(invalidate_ads, set(ads.values())))
+
+    proposal.status = ExchangeProposal.Status.ACCEPTED
+    return accepted + deactivated + cancelled
+
+
+def reject_proposal(proposal):
+    """
+    Отклоняет ожидающее предложение обмена.
+
+    Returns:
+        Количество измененных строк, 0 если предложение уже не ожидает ответа.
+    """
+    with transaction.atomic():
+        rejected = ExchangeProposal.objects.filter(
+            pk=proposal.pk, status=ExchangeProposal.Status.PENDING
+        ).update(status=ExchangeProposal.Status.REJECTED)
+        if rejected:
+            sync_statuses(ExchangeProposal.objects.filter(pk=proposal.pk))
+    if rejected:
+        proposal.status = ExchangeProposal.Status.REJECTED
+    return rejected
+
+
+def create_proposals(user, items):
+    """
+    Массовое создание предложений обмена от имени user.
+
+    Владение, активность объявлений и уникальность пар проверяются для всех
+    элементов сразу: один запрос за объявлениями, один за существующими
+    предложениями и вставка bulk_create, id строк возвращает RETURNING.
+    Если пару вставил параллельный запрос между проверкой и вставкой, пакет
+    откатывается до точки сохранения и строки вставляются по одной: занятые
+    пары возвращаются ошибкой, а не чужим id.
+
+    Args:
+        items: Список словарей с ключами ad_sender, ad_receiver и comment.
+
+    Returns:
+        Результаты в порядке items: {"index", "status": "created", "id"}
+        или {"index", "status": "error", "errors"}.
+    """
+    ad_ids = {item["ad_sender"] for item in items} | {
+        item["ad_receiver"] for item in items
+    }
+    ads = {
+        pk: (user_id, is_active)
+        for pk, user_id, is_active in Ad.objects.filter(pk__in=ad_ids).values_list(
+            "pk", "user_id", "is_active"
+        )
+    }
+    existing = _get_existing_pairs(
+        {(item["ad_sender"], item["ad_receiver"]) for item in items}
+    )
+
+    results = []
+    proposals = {}
+    for index, item in enumerate(items):
+        pair = (item["ad_sender"], item["ad_receiver"])
+        errors = _validate_proposal_pair(user, pair, ads, existing)
+        if errors:
+            results.append({"index": index, "status": "error", "errors": errors})
+            continue
+        # Повтор пары внутри пакета отклоняется так же, как существующая пара
+        existing.add(pair)
+        results.append({"index": index, "status": "created"})
+        proposals[pair] = ExchangeProposal(
+            ad_sender_id=pair[0],
+            ad_receiver_id=pair[1],
+            comment=item.get("comment", ""),
+            status=ExchangeProposal.Status.PENDING,
+        )
+    if not proposals:
+        return results
+
+    with transaction.atomic():
+        created = _insert_proposals(proposals)
+        if created:
+            # bulk_create не вызывает post_save, ленты и поиск циклов обновляются явно
+            add_proposals(
+                ExchangeProposal.objects.filter(
+                    pk__in=[proposal.pk for proposal in created.values()]
+                )
+            )
+            if settings.EXCHANGE_CYCLE_INCREMENTAL:
+                enqueue_new_proposals([proposal.pk for proposal in created.values()])
+
+    for result in results:
+        if result["status"] != "created":
+            continue
+        item = items[result["index"]]
+        pair = (item["ad_sender"], item["ad_receiver"])
+        if pair in created:
+            result["id"] = created[pair].pk
+        else:
+            result.update(status="error", errors=_get_conflict_errors(pair))
+    return results
+
+
+def _get_existing_pairs(pairs):
+    """Пары (ad_sender_id, ad_receiver_id) из pairs, для которых уже есть предложение"""
+    condition = models.Q()
+    for sender, receiver in pairs:
+        condition |= models.Q(ad_sender_id=sender, ad_receiver_id=receiver)
+    return set(
+        ExchangeProposal.objects.filter(condition).values_list(
+            "ad_sender_id", "ad_receiver_id"
+        )
+    )
+
+
+def _insert_proposals(proposals):
+    """
+    Вставляет предложения {пара: ExchangeProposal} в текущей транзакции.
+
+    Returns:
+        Вставленные этим вызовом предложения {пара: ExchangeProposal} с id.
+    """
+    try:
+        with transaction.atomic():
+            ExchangeProposal.objects.bulk_create(proposals.values())
+        return proposals
+    except IntegrityError:
+        pass
+
+    created = {}
+    for pair, proposal in proposals.items():
+        try:
+            with transaction.atomic():
+                ExchangeProposal.objects.bulk_create([proposal])
+        except IntegrityError:
+            continue
+        created[pair] = proposal
+    return created
+
+
+def _get_conflict_errors(pair):
+    """Ошибка пары, которую не удалось вставить"""
+    if _get_existing_pairs([pair]):
+        return {"ad_sender": [EXISTING_PROPOSAL_MESSAGE]}
+    # Объявление удалили между проверкой и вставкой
+    return {"ad_receiver": ["Объявление не найдено."]}
+
+
+def _validate_proposal_pair(user, pair, ads, existing):
+    """Ошибки элемента пакета в формате ошибок ExchangeProposalCreateSerializer"""
+    sender, receiver = pair
+    if sender not in ads:
+        return {"ad_sender": ["Объявление не найдено."]}
+    sender_user_id, sender_active = ads[sender]
+    if sender_user_id != user.pk:
+        return {"ad_sender": ["Вы можете предлагать только свои объявления"]}
+    if not sender_active:
+        return {"ad_sender": ["Нельзя предлагать неактивные объявления"]}
+    if receiver not in ads or not ads[receiver][1]:
+        return {"ad_receiver": ["Объявление не найдено."]}
+    if ads[receiver][0] == user.pk:
+        return {"ad_receiver": ["Нельзя предлагать обмен на свое объявление"]}
+    if pair in existing:
+        return {"ad_sender": [EXISTING_PROPOSAL_MESSAGE]}
+    return None
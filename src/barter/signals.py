@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from .blobs import change_refs
+from .cache import invalidate_ads
+from .images import enqueue_ad_image, needs_processing
+from .inbox import add_proposals, remove_proposals, sync_statuses
+from .matching import enqueue_new_proposals
+from .models import Ad, ExchangeProposal
+
+
+def invalidate_on_commit(categories):
+    # До коммита параллельный запрос может закешировать старые данные под новым поколением
+    categories = set(categories)
+    transaction.on_commit(lambda: invalidate_ads(categories))
+
+
+@receiver(post_init, sender=Ad)
+def remember_ad_category(sender, instance, **kwargs):
+    # __dict__ вместо атрибута: у загруженных через only() объявлений поле может быть отложено
+    instance._cached_category = instance.__dict__.get("category")
+
+
+@receiver(post_save, sender=Ad)
+def invalidate_saved_ad(sender, instance, **kwargs):
+    # При смене категории объявление пропадает из ленты старой категории
+    invalidate_on_commit([instance.category, instance._cached_category])
+    instance._cached_category = instance.category
+
+
+def saves_image(instance, update_fields):
+    fields = {"image", "image_variants"}
+    if update_fields is not None:
+        return bool(fields.intersection(update_fields))
+    return fields.issubset(instance.__dict__)
+
+
+@receiver(pre_save, sender=Ad)
+def remember_stored_image_files(sender, instance, update_fields, **kwargs):
+    # Из базы, а не из post_init: image_variants меняет воркер через update(),
+    # и загруженное раньше объявление может хранить устаревшие варианты
+    instance._stored_image_files = None
+    if not saves_image(instance, update_fields):
+        return
+    stored = (
+        Ad.objects.filter(pk=instance.pk).values_list("image", "image_variants").first()
+        if instance.pk
+        else None
+    )
+    instance._stored_image_files = Ad.collect_image_files(*stored) if stored else set()
+
+
+@receiver(post_save, sender=Ad)
+def update_ad_image_refs(sender, instance, **kwargs):
+    if instance._stored_image_files is None:
+        return
+    stored = instance._stored_image_files
+    files = instance.get_image_files()
+    change_refs(acquired=files - stored, released=stored - files)
+
+
+@receiver(post_save, sender=Ad)
+def enqueue_ad_image_processing(sender, instance, **kwargs):
+    # Варианты строит воркер process_ad_images, не поток запроса
+    loaded = "image" in instance.__dict__ and "image_variants" in instance.__dict__
+    if loaded and needs_processing(instance):
+        enqueue_ad_image(instance.pk)
+
+
+@receiver(post_delete, sender=Ad)
+def invalidate_deleted_ad(sender, instance, **kwargs):
+    # Категорию удаленного объявления с отложенным полем уже не загрузить
+    invalidate_on_commit(
+        [instance._cached_category] if instance._cached_category else Ad.Category.values
+    )
+
+
+@receiver(post_delete, sender=Ad)
+def release_deleted_ad_image(sender, instance, **kwargs):
+    # Файлы остаются до sweep_ad_images: их могут использовать другие объявления
+    if {"image", "image_variants"}.issubset(instance.__dict__):
+        change_refs(released=instance.get_image_files())
+
+
+@receiver(post_save, sender=ExchangeProposal)
+@receiver(post_delete, sender=ExchangeProposal)
+def invalidate_proposal_ads(sender, instance, **kwargs):
+    """
+    Принятое предложение снимает оба объявления с ленты. Объявления могут
+    деактивироваться массовым update() без сигналов Ad, поэтому категории
+    сбрасываются и по сигналу предложения.
+    """
+    if instance.status != ExchangeProposal.Status.ACCEPTED:
+        return
+    invalidate_on_commit(
+        Ad.objects.filter(
+            pk__in=[instance.ad_sender_id, instance.ad_receiver_id]
+        ).values_list("category", flat=True)
+    )
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def match_created_proposal(sender, instance, created, **kwargs):
+    # В очередь после коммита: до него воркер не увидит новое ребро
+    if created and settings.EXCHANGE_CYCLE_INCREMENTAL:
+        enqueue_new_proposals([instance.pk])
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def update_proposal_inbox(sender, instance, created, **kwargs):
+    # Массовые update() и bulk_create в services обновляют ленты сами
+    proposals = ExchangeProposal.objects.filter(pk=instance.pk)
+    if created:
+        add_proposals(proposals)
+    else:
+        sync_statuses(proposals)
+
+
+@receiver(pre_delete, sender=ExchangeProposal)
+def remove_from_proposal_inbox(sender, instance, **kwargs):
+    # Записи ленты удаляются каскадом, пока они есть - вычитаем их из счетчиков
+    remove_proposals(ExchangeProposal.objects.filter(pk=instance.pk))
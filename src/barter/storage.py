@@ -0,0 +1,70 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Имя файла: каталог/первые 2 символа хеша/хеш.расширение
+EXTENSION_RE = re.compile(r"^\.[a-z0-9]{1,5}$")
+
+
+@deconstructible(path="barter.storage.ContentAddressedStorage")
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, где имя файла - SHA-256 его содержимого. Одинаковые
+    файлы хранятся один раз, а файл по имени никогда не меняется, поэтому его
+    URL можно кешировать навсегда.
+
+    Файл не удаляется вместе со ссылкой на него: учет ссылок ведет ImageBlob,
+    неиспользуемые файлы удаляет команда sweep_ad_images.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        directory, filename = posixpath.split(name.replace("\\", "/"))
+        extension = posixpath.splitext(filename)[1].lower()
+        if not EXTENSION_RE.match(extension):
+            extension = ""
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+
+        # Хеш считается при записи во временный файл, содержимое читается один раз
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(prefix=".upload-", dir=full_directory)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            hexdigest = digest.hexdigest()
+            name = posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            try:
+                # Обновленное время изменения не дает sweep_ad_images удалить
+                # файл, на который сейчас появится ссылка
+                os.utime(full_path)
+            except FileNotFoundError:
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                # Переименование атомарно: читатель не увидит файл недописанным,
+                # а одновременная запись того же содержимого безопасна
+                os.replace(temp_path, full_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым и не требует суффиксов
+        return name
+
+
+ad_image_storage = ContentAddressedStorage()
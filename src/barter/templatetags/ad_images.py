@@ -0,0 +1,26 @@
+from django import template
+
+register = template.Library()
+
+
+@register.inclusion_tag("barter/includes/ad_image.html")
+def ad_image(ad, variant="card", css_class="", style="", sizes="100vw"):
+    """
+    Изображение объявления с WebP и JPEG вариантами в srcset. До обработки
+    воркером выводится исходный файл.
+
+    Пример: {% ad_image ad "card" css_class="card-img-top" %}
+    """
+    return {
+        "ad": ad,
+        "src": ad.get_image_url(variant),
+        "webp_srcset": ", ".join(
+            f"{url} {width}w" for url, width in ad.get_image_srcset("webp")
+        ),
+        "jpeg_srcset": ", ".join(
+            f"{url} {width}w" for url, width in ad.get_image_srcset("jpeg")
+        ),
+        "css_class": css_class,
+        "style": style,
+        "sizes": sizes,
+    }
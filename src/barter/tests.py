@@ -1,25 +1,64 @@
+import hashlib
 import io
+import json
 import os
+import tempfile
+import threading
+from datetime import timedelta
 from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.http import HttpRequest
+from django.test import (
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from django_redis import get_redis_connection
 from PIL import Image
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from user.auth_utils import create_token
 
-from .models import Ad, ExchangeProposal
+from . import images, services
+from .blobs import recount_refs, sweep
+from .cache import get_stats, invalidate_ads
+from .events import publish_events, stream_events, stream_key
+from .images import QUEUE_KEY, needs_processing, process_ad_image, run_worker
+from .inbox import get_counters, rebuild_inbox
+from .matching import QUEUE_KEY as CYCLE_QUEUE_KEY
+from .matching import (
+    find_cycles,
+    generate_random_graph,
+    match_new_proposal,
+    rebuild_cycles,
+    run_matcher,
+)
+from .models import Ad, ExchangeCycle, ExchangeProposal, ImageBlob, ProposalInboxEntry
+from .pagination import encode_cursor
+from .search import word_similarity_threshold
+from .services import accept_proposal, create_proposals, reject_proposal
+from .uploads import AdImageUploadHandler
 
 # Override settings for tests
 os.environ["BEARER_AUTH"] = "1"
 os.environ["COOKIE_AUTH"] = "1"
 settings.BEARER_AUTH = True
 settings.COOKIE_AUTH = True
+# Response cache is enabled explicitly in the tests that cover it
+settings.AD_LIST_CACHE_TIMEOUT = 0
 
 User = get_user_model()
 
@@ -292,6 +331,66 @@ class AdViewTest(TestCase):
         self.assertContains(response, "Another Ad")
         self.assertNotContains(response, "Test Ad")
 
+    def test_search_uses_russian_stemming(self):
+        """Test full-text search matches word forms of the query"""
+        Ad.objects.create(
+            user=self.user,
+            title="Мобильный телефон",
+            description="Продаю телефон в отличном состоянии, без царапин",
+            category="electronics",
+            condition="used",
+        )
+
+        response = self.client.get(f"{reverse('barter:ad_list')}?search=телефоны")
+        self.assertContains(response, "Мобильный телефон")
+        self.assertNotContains(response, "Test Ad")
+
+    def test_search_orders_by_rank(self):
+        """Test title matches rank above description matches"""
+        Ad.objects.create(
+            user=self.user,
+            title="Книга в мягкой обложке",
+            description="Отдам в хорошие руки, почти не читали",
+            category="books",
+            condition="used",
+        )
+        Ad.objects.create(
+            user=self.user,
+            title="Полка для дома",
+            description="Подходит под любую книгу и журналы",
+            category="furniture",
+            condition="used",
+        )
+
+        response = self.client.get(f"{reverse('barter:ad_list')}?search=книга")
+        titles = [ad.title for ad in response.context["ads"]]
+        self.assertEqual(titles, ["Книга в мягкой обложке", "Полка для дома"])
+
+    @override_settings(AD_SEARCH_BACKEND="icontains")
+    def test_search_icontains_backend(self):
+        """Test substring search is still available behind the setting"""
+        response = self.client.get(f"{reverse('barter:ad_list')}?search=tail")
+        self.assertContains(response, "Test Ad")
+
+    def test_rebuild_search_vectors_command(self):
+        """Test the backfill command fills empty search vectors"""
+        Ad.objects.update(search_vector=None)
+
+        call_command("rebuild_ad_search_vectors", stdout=io.StringIO())
+
+        self.assertFalse(Ad.objects.filter(search_vector__isnull=True).exists())
+        response = self.client.get(f"{reverse('barter:ad_list')}?search=detailed")
+        self.assertContains(response, "Test Ad")
+
+    def test_explain_queries_command(self):
+        """Test the EXPLAIN command prints a plan for every canonical query"""
+        out = io.StringIO()
+        call_command("explain_queries", stdout=out)
+        output = out.getvalue()
+        for name in ["ad_list", "my_ads", "received_proposals"]:
+            self.assertIn(f"== {name}", output)
+        self.assertIn("Execution Time", output)
+
     def test_category_filter(self):
         """Test ad category filter"""
         Ad.objects.create(
@@ -587,6 +686,18 @@ class APITestBase(APITestCase):
         )
 
 
+class TempMediaRootMixin:
+    """Stores uploaded files in a temporary MEDIA_ROOT removed after each test"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        super().setUp()
+
+
 class APIAdTests(APITestBase):
     """Tests for Ad API endpoints"""
 
@@ -603,8 +714,65 @@ class APIAdTests(APITestBase):
 
         response = self.client.get(reverse("barter:api_ad_list"))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["title"], "Visible API Test Ad")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["title"], "Visible API Test Ad")
+        self.assertIsNone(response.data["suggestion"])
+
+    def test_list_ads_api_suggestion(self):
+        """Test ad list API suggests a similar title when nothing is found"""
+        Ad.objects.create(
+            user=self.user2,
+            title="Велосипед горный",
+            description="Горный велосипед, 21 скорость, рама алюминиевая",
+            category="other",
+            condition="used",
+        )
+
+        response = self.client.get(
+            reverse("barter:api_ad_list"), {"search": "велосепед горный"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(response.data["suggestion"], "Велосипед горный")
+
+    @override_settings(AD_SEARCH_BACKEND="trigram")
+    def test_list_ads_api_trigram_search(self):
+        """Test trigram search tolerates typos and partial words"""
+        Ad.objects.create(
+            user=self.user2,
+            title="Велосипед горный",
+            description="Горный велосипед, 21 скорость, рама алюминиевая",
+            category="other",
+            condition="used",
+        )
+
+        for search in ["велосепед", "велос"]:
+            response = self.client.get(
+                reverse("barter:api_ad_list"), {"search": search}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data["results"]), 1)
+            self.assertEqual(response.data["results"][0]["title"], "Велосипед горный")
+
+        # Слишком строгий порог отсекает опечатку
+        response = self.client.get(
+            reverse("barter:api_ad_list"),
+            {"search": "велосепед", "similarity": "0.95"},
+        )
+        self.assertEqual(response.data["results"], [])
+
+    def test_list_ads_api_rejects_malformed_query(self):
+        """Test ad list API validates declared query params before the view runs"""
+        url = reverse("barter:api_ad_list")
+        response = self.client.get(url, {"limit": "ten", "similarity": "high"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            set(response.data["errors"]), {"limit", "similarity"}, response.data
+        )
+
+        # Пустые поля формы считаются непереданными
+        response = self.client.get(url, {"category": "", "limit": ""})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_ad_detail_api(self):
         """Test ad detail API endpoint"""
@@ -617,8 +785,80 @@ class APIAdTests(APITestBase):
         """Test my ads API endpoint"""
         response = self.client.get(reverse("barter:api_my_ads"))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["title"], "API Test Ad")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["title"], "API Test Ad")
+        self.assertIsNone(response.data["next"])
+
+    def test_list_ads_api_cursor_pagination(self):
+        """Test ad list API walks all pages through the next link"""
+        created_at = timezone.now()
+        for i in range(7):
+            Ad.objects.create(
+                user=self.user2,
+                title=f"Paginated Ad {i}",
+                description="Description for pagination testing with enough characters",
+                category="books",
+                condition="used",
+            )
+        # Одинаковое время создания проверяет, что id разрешает ничьи
+        Ad.objects.filter(user=self.user2).update(created_at=created_at)
+
+        titles = []
+        url = f"{reverse('barter:api_ad_list')}?limit=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 3)
+            titles.extend(ad["title"] for ad in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(titles, [f"Paginated Ad {i}" for i in reversed(range(7))])
+
+    def test_list_ads_api_search_pagination(self):
+        """Test cursor pagination keeps rank ordering for search results"""
+        for i in range(4):
+            Ad.objects.create(
+                user=self.user2,
+                title="Книга " * (i + 1),
+                description="Описание книги для проверки постраничного поиска",
+                category="books",
+                condition="used",
+            )
+
+        ids = []
+        url = f"{reverse('barter:api_ad_list')}?search=книга&limit=1"
+        while url:
+            response = self.client.get(url)
+            ids.extend(ad["id"] for ad in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(len(set(ids)), 4)
+
+    def test_list_ads_api_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get(reverse("barter:api_ad_list"), {"cursor": "%%%"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_ads_api_cursor_wrong_types(self):
+        """Test a well-formed cursor with values of the wrong types is rejected"""
+        for values in (
+            ["x", "x"],
+            [[], {}],
+            [None, 1],
+            ["2024-03-20T12:00:00Z", 10**30],
+        ):
+            with self.subTest(values=values):
+                response = self.client.get(
+                    reverse("barter:api_ad_list"), {"cursor": encode_cursor(values)}
+                )
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            reverse("barter:api_ad_list"),
+            {"search": "книга", "cursor": encode_cursor(["x", "x", 1])},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_ad_create_api(self):
         """Test creating ad via API"""
@@ -924,3 +1164,1197 @@ class ExchangeTests(TestCase):
         # Refresh proposal from DB
         proposal2.refresh_from_db()
         self.assertEqual(proposal2.status, "rejected")
+
+
+class QueryCountTests(APITestBase):
+    """Guards against N+1 queries: the query count must not grow with result size"""
+
+    def setUp(self):
+        super().setUp()
+        self.ads_created = 0
+
+    def add_rows(self, count):
+        """Adds ads of both users and proposals between them"""
+        for _ in range(count):
+            self.ads_created += 1
+            own_ad = Ad.objects.create(
+                user=self.user,
+                title=f"Own ad {self.ads_created}",
+                description="Description long enough for validation",
+                category="electronics",
+                condition="new",
+            )
+            other_ad = Ad.objects.create(
+                user=self.user2,
+                title=f"Other ad {self.ads_created}",
+                description="Description long enough for validation",
+                category="books",
+                condition="used",
+            )
+            ExchangeProposal.objects.create(
+                ad_sender=own_ad, ad_receiver=other_ad, comment="Exchange"
+            )
+            ExchangeProposal.objects.create(
+                ad_sender=other_ad, ad_receiver=own_ad, comment="Exchange back"
+            )
+
+    def assertConstantQueries(self, url):
+        """Compares the query count of url for a small and a larger data set"""
+        self.add_rows(1)
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.add_rows(5)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            len(small),
+            len(large),
+            "Query count grows with result size:\n"
+            + "\n".join(query["sql"] for query in large.captured_queries),
+        )
+
+    def test_ad_list_api(self):
+        self.assertConstantQueries(reverse("barter:api_ad_list"))
+
+    def test_my_ads_api(self):
+        self.assertConstantQueries(reverse("barter:api_my_ads"))
+
+    def test_proposal_list_api(self):
+        self.assertConstantQueries(reverse("barter:api_proposal_list"))
+
+    def test_ad_list_view(self):
+        self.assertConstantQueries(reverse("barter:ad_list"))
+
+    def test_my_proposals_view(self):
+        self.assertConstantQueries(reverse("barter:my_proposals"))
+
+    def test_proposal_detail_api_single_query(self):
+        """Nested ads and their owners are loaded with the proposal itself"""
+        self.add_rows(1)
+        proposal = ExchangeProposal.objects.filter(ad_sender__user=self.user).first()
+        url = reverse("barter:api_proposal_detail", args=[proposal.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["ad_sender"]["user_username"], "apiuser")
+        proposal_queries = [
+            query
+            for query in queries.captured_queries
+            if "barter_exchangeproposal" in query["sql"]
+        ]
+        self.assertEqual(len(proposal_queries), 1)
+
+
+@override_settings(AD_LIST_CACHE_TIMEOUT=60)
+class AdListCacheTests(TestCase):
+    """Tests for the anonymous ad list response cache"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="cacheuser", password="cachepass123", email="cache@example.com"
+        )
+        self.ad = Ad.objects.create(
+            user=self.user,
+            title="Cached electronics ad",
+            description="Description long enough for validation",
+            category="electronics",
+            condition="new",
+        )
+        # Start from fresh generations: redis outlives the test database
+        invalidate_ads(Ad.Category.values)
+
+    def create_ad(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Ad.objects.create(
+                user=self.user,
+                description="Description long enough for validation",
+                condition="new",
+                **kwargs,
+            )
+
+    def test_api_hit_after_miss(self):
+        """The second anonymous request is served from the cache"""
+        stats = get_stats()
+        url = reverse("barter:api_ad_list")
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.json(), second.json())
+        new_stats = get_stats()
+        self.assertEqual(new_stats["hit"] - stats["hit"], 1)
+        self.assertEqual(new_stats["miss"] - stats["miss"], 1)
+
+    def test_html_hit_after_miss(self):
+        url = reverse("barter:ad_list")
+        self.assertEqual(self.client.get(url)["X-Cache"], "MISS")
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertContains(response, "Cached electronics ad")
+
+    def test_authenticated_requests_not_cached(self):
+        token = create_token("127.0.0.1", f"timestamp{timezone.now()}")
+        self.user.token_hash = token
+        self.user.token_created_at = timezone.now()
+        self.user.save()
+        self.client.cookies[settings.TOKEN_SETTINGS.get("NAME")] = token
+        response = self.client.get(reverse("barter:api_ad_list"))
+        self.assertNotIn("X-Cache", response)
+
+    def test_invalidation_scoped_by_category(self):
+        """A new ad invalidates its category and the unfiltered list only"""
+        url = reverse("barter:api_ad_list")
+        for params in ({}, {"category": "electronics"}, {"category": "books"}):
+            self.client.get(url, params)
+
+        self.create_ad(title="New electronics ad", category="electronics")
+
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["results"]), 2)
+        response = self.client.get(url, {"category": "electronics"})
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["results"]), 2)
+        response = self.client.get(url, {"category": "books"})
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_category_change_invalidates_old_category(self):
+        url = reverse("barter:api_ad_list")
+        self.client.get(url, {"category": "electronics"})
+        ad = Ad.objects.get(pk=self.ad.pk)
+        ad.category = "books"
+        with self.captureOnCommitCallbacks(execute=True):
+            ad.save()
+        response = self.client.get(url, {"category": "electronics"})
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["results"], [])
+
+    def test_accepted_proposal_invalidates_both_categories(self):
+        url = reverse("barter:api_ad_list")
+        other_ad = self.create_ad(title="Books ad", category="books")
+        self.client.get(url, {"category": "electronics"})
+        self.client.get(url, {"category": "books"})
+
+        proposal = ExchangeProposal.objects.create(
+            ad_sender=self.ad, ad_receiver=other_ad, comment="Exchange"
+        )
+        # Ads deactivated without Ad signals, as bulk updates do
+        Ad.objects.filter(pk__in=[self.ad.pk, other_ad.pk]).update(is_active=False)
+        proposal.status = ExchangeProposal.Status.ACCEPTED
+        with self.captureOnCommitCallbacks(execute=True):
+            proposal.save()
+
+        for category in ("electronics", "books"):
+            response = self.client.get(url, {"category": category})
+            self.assertEqual(response["X-Cache"], "MISS")
+            self.assertEqual(response.json()["results"], [])
+
+    def test_cache_stats_command(self):
+        out = io.StringIO()
+        call_command("ad_cache_stats", stdout=out)
+        self.assertIn("Попаданий", out.getvalue())
+
+
+class ProposalServiceTests(TestCase):
+    """Tests for barter.services accept_proposal and reject_proposal"""
+
+    def setUp(self):
+        self.sender = User.objects.create_user(
+            username="sender", password="senderpass123", email="sender@example.com"
+        )
+        self.receiver = User.objects.create_user(
+            username="receiver",
+            password="receiverpass123",
+            email="receiver@example.com",
+        )
+        self.ad_sender = self.create_ad(self.sender)
+        self.ad_receiver = self.create_ad(self.receiver)
+        self.proposal = ExchangeProposal.objects.create(
+            ad_sender=self.ad_sender, ad_receiver=self.ad_receiver, comment="Exchange"
+        )
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            user=user,
+            title="Service ad",
+            description="Description long enough for validation",
+            category="electronics",
+            condition="new",
+        )
+
+    def add_competing_proposals(self, count):
+        for _ in range(count):
+            ExchangeProposal.objects.create(
+                ad_sender=self.create_ad(self.sender), ad_receiver=self.ad_receiver
+            )
+            ExchangeProposal.objects.create(
+                ad_sender=self.ad_sender, ad_receiver=self.create_ad(self.receiver)
+            )
+
+    def test_accept_returns_affected_rows(self):
+        self.add_competing_proposals(2)
+        # 1 accepted proposal + 2 ads + 4 cancelled proposals
+        self.assertEqual(accept_proposal(self.proposal), 7)
+        self.assertEqual(self.proposal.status, "accepted")
+        self.ad_sender.refresh_from_db()
+        self.assertFalse(self.ad_sender.is_active)
+        self.assertEqual(ExchangeProposal.objects.filter(status="cancelled").count(), 4)
+
+    def test_accept_query_count_is_fixed(self):
+        counts = []
+        for competing in (1, 10):
+            proposal = ExchangeProposal.objects.create(
+                ad_sender=self.create_ad(self.sender),
+                ad_receiver=self.create_ad(self.receiver),
+            )
+            for _ in range(competing):
+                ExchangeProposal.objects.create(
+                    ad_sender=self.create_ad(self.sender),
+                    ad_receiver=proposal.ad_receiver,
+                )
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(accept_proposal(proposal))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_accept_twice(self):
+        self.assertTrue(accept_proposal(self.proposal))
+        self.assertEqual(accept_proposal(self.proposal), 0)
+
+    def test_accept_with_inactive_ad(self):
+        Ad.objects.filter(pk=self.ad_receiver.pk).update(is_active=False)
+        self.assertEqual(accept_proposal(self.proposal), 0)
+        self.proposal.refresh_from_db()
+        self.assertEqual(self.proposal.status, "pending")
+
+    def test_reject(self):
+        self.assertEqual(reject_proposal(self.proposal), 1)
+        self.assertEqual(reject_proposal(self.proposal), 0)
+        self.ad_sender.refresh_from_db()
+        self.assertTrue(self.ad_sender.is_active)
+
+
+class ProposalServiceConcurrencyTests(TransactionTestCase):
+    """Concurrent accepts of proposals sharing an ad"""
+
+    def test_concurrent_accepts_on_same_ad(self):
+        users = [
+            User.objects.create_user(
+                username=f"race{i}",
+                password="racepass123",
+                email=f"race{i}@example.com",
+            )
+            for i in range(3)
+        ]
+        ads = [
+            Ad.objects.create(
+                user=user,
+                title="Race ad",
+                description="Description long enough for validation",
+                category="electronics",
+                condition="new",
+            )
+            for user in users
+        ]
+        # Both proposals target the same receiver ad
+        proposals = [
+            ExchangeProposal.objects.create(ad_sender=ads[1], ad_receiver=ads[0]),
+            ExchangeProposal.objects.create(ad_sender=ads[2], ad_receiver=ads[0]),
+        ]
+        barrier = threading.Barrier(len(proposals))
+        results = {}
+
+        def accept(proposal):
+            try:
+                barrier.wait()
+                results[proposal.pk] = accept_proposal(proposal)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=accept, args=(proposal,)) for proposal in proposals
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(bool(rows) for rows in results.values()), [False, True])
+        self.assertEqual(ExchangeProposal.objects.filter(status="accepted").count(), 1)
+        self.assertEqual(ExchangeProposal.objects.filter(status="cancelled").count(), 1)
+
+
+@override_settings(AD_SEARCH_BACKEND="trigram")
+class SearchThresholdTests(TransactionTestCase):
+    """Trigram similarity threshold is scoped to the search transaction"""
+
+    def get_threshold(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT current_setting('pg_trgm.word_similarity_threshold', true)"
+            )
+            return cursor.fetchone()[0]
+
+    def test_threshold_does_not_leak_to_connection(self):
+        with word_similarity_threshold("велосипед", 0.95):
+            self.assertEqual(float(self.get_threshold()), 0.95)
+
+        # Следующие запросы на том же соединении получают прежний порог
+        self.assertNotEqual(self.get_threshold(), "0.95")
+
+    def test_no_search_does_not_touch_threshold(self):
+        with CaptureQueriesContext(connection) as queries:
+            with word_similarity_threshold("", 0.95):
+                pass
+        self.assertEqual(len(queries), 0)
+
+
+class CycleMatchingTests(TestCase):
+    """Tests for the pure graph part of barter.matching"""
+
+    def test_finds_two_and_three_cycles(self):
+        # 1 <-> 2, 3 -> 4 -> 5 -> 3, 6 -> 1 is not in any cycle
+        senders = [1, 2, 3, 4, 5, 6]
+        receivers = [2, 1, 4, 5, 3, 1]
+        cycles = find_cycles(senders, receivers, [10, 11, 12, 13, 14, 15], 5)
+        self.assertEqual(
+            [(cycle.ads, cycle.proposals) for cycle in cycles],
+            [([1, 2], [10, 11]), ([3, 4, 5], [12, 13, 14])],
+        )
+
+    def test_respects_max_length(self):
+        senders, receivers = [1, 2, 3, 4], [2, 3, 4, 1]
+        self.assertEqual(find_cycles(senders, receivers, [1, 2, 3, 4], 3), [])
+        self.assertEqual(len(find_cycles(senders, receivers, [1, 2, 3, 4], 4)), 1)
+
+    def test_cycles_are_disjoint_and_shortest(self):
+        # 1 -> 2 -> 1 and 1 -> 3 -> 4 -> 1 share ad 1, the shorter one wins
+        senders, receivers = [1, 2, 1, 3, 4], [2, 1, 3, 4, 1]
+        cycles = find_cycles(senders, receivers, [1, 2, 3, 4, 5], 5)
+        self.assertEqual([cycle.ads for cycle in cycles], [[1, 2]])
+
+    def test_random_graph_cycles_are_valid(self):
+        senders, receivers, edge_ids = generate_random_graph(200, 600, seed=1)
+        edges = dict(zip(zip(senders, receivers), edge_ids))
+        cycles = find_cycles(senders, receivers, edge_ids, 4)
+        self.assertTrue(cycles)
+        matched = [ad for cycle in cycles for ad in cycle.ads]
+        self.assertEqual(len(matched), len(set(matched)))
+        for cycle in cycles:
+            self.assertLessEqual(len(cycle.ads), 4)
+            pairs = zip(cycle.ads, cycle.ads[1:] + cycle.ads[:1])
+            self.assertEqual([edges[pair] for pair in pairs], cycle.proposals)
+
+
+@override_settings(EXCHANGE_CYCLE_INCREMENTAL=False)
+class ExchangeCycleTests(APITestBase):
+    """Tests for stored exchange cycles, incremental matching and the cycles API"""
+
+    def setUp(self):
+        super().setUp()
+        self.user3 = User.objects.create_user(
+            username="apiuser3", password="apipass123", email="api3@example.com"
+        )
+        self.ad2 = self.create_ad(self.user2)
+        self.ad3 = self.create_ad(self.user3)
+        get_redis_connection("default").delete(CYCLE_QUEUE_KEY)
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            user=user,
+            title="Cycle ad",
+            description="Description long enough for validation",
+            category="books",
+            condition="used",
+        )
+
+    def propose(self, sender, receiver):
+        return ExchangeProposal.objects.create(ad_sender=sender, ad_receiver=receiver)
+
+    def create_triangle(self):
+        return [
+            self.propose(self.ad, self.ad2),
+            self.propose(self.ad2, self.ad3),
+            self.propose(self.ad3, self.ad),
+        ]
+
+    def test_rebuild_replaces_cycles(self):
+        proposals = self.create_triangle()
+        rebuild_cycles()
+        cycle = ExchangeCycle.objects.get()
+        self.assertEqual(cycle.ads, [self.ad.pk, self.ad2.pk, self.ad3.pk])
+        self.assertEqual(cycle.proposals, [proposal.pk for proposal in proposals])
+
+        self.ad3.is_active = False
+        self.ad3.save()
+        rebuild_cycles()
+        self.assertFalse(ExchangeCycle.objects.exists())
+
+    def test_match_new_proposal(self):
+        self.propose(self.ad, self.ad2)
+        self.propose(self.ad2, self.ad3)
+        self.assertIsNone(match_new_proposal(self.propose(self.ad, self.ad3).pk))
+
+        closing = self.propose(self.ad3, self.ad)
+        cycle = match_new_proposal(closing.pk)
+        self.assertEqual(cycle.ads, [self.ad3.pk, self.ad.pk, self.ad2.pk])
+        self.assertEqual(cycle.proposals[0], closing.pk)
+        # Ads already offered in a cycle are not matched again
+        self.assertIsNone(match_new_proposal(closing.pk))
+
+    def test_stale_cycle_does_not_block_matching(self):
+        proposals = self.create_triangle()
+        rebuild_cycles()
+        stale = ExchangeCycle.objects.get()
+        ExchangeProposal.objects.filter(pk=proposals[1].pk).update(
+            status=ExchangeProposal.Status.REJECTED
+        )
+
+        closing = self.propose(self.ad2, self.ad)
+        cycle = match_new_proposal(closing.pk)
+        self.assertEqual(cycle.ads, [self.ad2.pk, self.ad.pk])
+        self.assertFalse(ExchangeCycle.objects.filter(pk=stale.pk).exists())
+
+    def test_match_new_proposal_respects_max_length(self):
+        self.create_triangle()
+        closing = ExchangeProposal.objects.get(ad_sender=self.ad3)
+        self.assertIsNone(match_new_proposal(closing.pk, max_length=2))
+
+    @override_settings(EXCHANGE_CYCLE_INCREMENTAL=True)
+    def test_cycle_created_by_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_triangle()
+        # Запрос только ставит предложения в очередь
+        self.assertFalse(ExchangeCycle.objects.exists())
+        self.assertEqual(run_matcher(once=True), 1)
+        self.assertEqual(ExchangeCycle.objects.count(), 1)
+
+    def test_matcher_survives_failing_proposal(self):
+        proposals = self.create_triangle()
+        get_redis_connection("default").rpush(
+            CYCLE_QUEUE_KEY, proposals[0].pk, proposals[2].pk
+        )
+        with patch(
+            "barter.matching.match_new_proposal",
+            side_effect=[RuntimeError("boom"), ExchangeCycle()],
+        ) as matcher:
+            with self.assertLogs("barter.matching", "ERROR"):
+                self.assertEqual(run_matcher(once=True), 1)
+        self.assertEqual(matcher.call_count, 2)
+        self.assertEqual(get_redis_connection("default").llen(CYCLE_QUEUE_KEY), 0)
+
+    def test_cycle_list_api(self):
+        self.create_triangle()
+        rebuild_cycles()
+        response = self.client.get(reverse("barter:api_cycle_list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["length"], 3)
+        self.assertEqual(
+            [ad["id"] for ad in response.data[0]["ads"]],
+            [self.ad.pk, self.ad2.pk, self.ad3.pk],
+        )
+
+    def test_cycle_list_api_skips_stale_cycles(self):
+        proposals = self.create_triangle()
+        rebuild_cycles()
+        reject_proposal(proposals[1])
+        response = self.client.get(reverse("barter:api_cycle_list"))
+        self.assertEqual(response.data, [])
+
+    def test_cycle_list_api_requires_auth(self):
+        self.client.credentials()
+        self.client.cookies.clear()
+        response = self.client.get(reverse("barter:api_cycle_list"))
+        self.assertIn(
+            response.status_code,
+            [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN],
+        )
+
+    def test_commands(self):
+        self.create_triangle()
+        out = io.StringIO()
+        call_command("match_cycles", stdout=out)
+        self.assertIn("1", out.getvalue())
+        out = io.StringIO()
+        call_command("match_new_proposals", once=True, stdout=out)
+        self.assertIn("0", out.getvalue())
+        out = io.StringIO()
+        call_command("bench_cycles", nodes=50, edges=200, seed=1, stdout=out)
+        self.assertIn("CSR", out.getvalue())
+
+
+@override_settings(EXCHANGE_CYCLE_INCREMENTAL=False)
+class ProposalBulkCreateTests(APITestBase):
+    """Tests for the bulk proposal creation endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("barter:api_proposal_bulk_create")
+        self.other_ads = [self.create_ad(self.user2) for _ in range(3)]
+
+    def create_ad(self, user, **kwargs):
+        return Ad.objects.create(
+            user=user,
+            title="Bulk ad",
+            description="Description long enough for validation",
+            category="books",
+            condition="used",
+            **kwargs,
+        )
+
+    def post(self, items):
+        return self.client.post(self.url, {"proposals": items}, format="json")
+
+    def test_creates_proposals(self):
+        items = [
+            {"ad_sender": self.ad.pk, "ad_receiver": ad.pk, "comment": "Swap"}
+            for ad in self.other_ads
+        ]
+        response = self.post(items)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 3)
+        for item, result in zip(items, response.data["results"]):
+            proposal = ExchangeProposal.objects.get(pk=result["id"])
+            self.assertEqual(proposal.ad_receiver_id, item["ad_receiver"])
+            self.assertEqual(proposal.status, "pending")
+            self.assertEqual(proposal.comment, "Swap")
+
+    def test_reports_per_item_errors(self):
+        foreign_ad = self.other_ads[0]
+        inactive_ad = self.create_ad(self.user, is_active=False)
+        ExchangeProposal.objects.create(ad_sender=self.ad, ad_receiver=foreign_ad)
+        response = self.post(
+            [
+                {"ad_sender": self.ad.pk, "ad_receiver": foreign_ad.pk},
+                {"ad_sender": foreign_ad.pk, "ad_receiver": self.other_ads[1].pk},
+                {"ad_sender": inactive_ad.pk, "ad_receiver": foreign_ad.pk},
+                {"ad_sender": self.ad.pk, "ad_receiver": inactive_ad.pk},
+                {"ad_sender": self.ad.pk, "ad_receiver": 999999},
+                {"ad_sender": self.ad.pk, "ad_receiver": self.other_ads[1].pk},
+                {"ad_sender": self.ad.pk, "ad_receiver": self.other_ads[1].pk},
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["error"] * 5 + ["created", "error"],
+        )
+        self.assertEqual(
+            [list(result.get("errors", {})) for result in response.data["results"]],
+            [
+                ["ad_sender"],
+                ["ad_sender"],
+                ["ad_sender"],
+                ["ad_receiver"],
+                ["ad_receiver"],
+                [],
+                ["ad_sender"],
+            ],
+        )
+
+    def test_pair_inserted_concurrently_is_reported_as_error(self):
+        taken, free = self.other_ads[:2]
+        concurrent = ExchangeProposal.objects.create(
+            ad_sender=self.ad, ad_receiver=taken
+        )
+        # The validation read ran before the other request committed its row
+        with patch("barter.services._get_existing_pairs", return_value=set()):
+            response = self.post(
+                [
+                    {"ad_sender": self.ad.pk, "ad_receiver": taken.pk},
+                    {"ad_sender": self.ad.pk, "ad_receiver": free.pk},
+                ]
+            )
+        self.assertEqual(response.data["created"], 1)
+        conflict, created = response.data["results"]
+        self.assertEqual(conflict["status"], "error")
+        self.assertNotIn("id", conflict)
+        self.assertEqual(list(conflict["errors"]), ["ad_sender"])
+        self.assertNotEqual(created["id"], concurrent.pk)
+        self.assertEqual(
+            ExchangeProposal.objects.get(pk=created["id"]).ad_receiver_id, free.pk
+        )
+
+    def test_existing_pairs_lookup_is_exact(self):
+        ExchangeProposal.objects.create(
+            ad_sender=self.other_ads[0], ad_receiver=self.other_ads[1]
+        )
+        # other_ads[0] is a submitted sender and other_ads[1] a submitted
+        # receiver, but the pair itself was not submitted
+        pairs = {
+            (self.other_ads[0].pk, self.ad.pk),
+            (self.ad.pk, self.other_ads[1].pk),
+        }
+        self.assertEqual(services._get_existing_pairs(pairs), set())
+
+    def test_rejects_invalid_body(self):
+        self.assertEqual(self.post([]).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post([{"ad_sender": "x"}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(EXCHANGE_CYCLE_INCREMENTAL=True)
+    def test_schedules_cycle_matching(self):
+        ExchangeProposal.objects.create(
+            ad_sender=self.other_ads[0], ad_receiver=self.ad
+        )
+        get_redis_connection("default").delete(CYCLE_QUEUE_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post([{"ad_sender": self.ad.pk, "ad_receiver": self.other_ads[0].pk}])
+        run_matcher(once=True)
+        self.assertEqual(ExchangeCycle.objects.count(), 1)
+
+    def test_constant_queries(self):
+        def count_queries(ads):
+            items = [{"ad_sender": self.ad.pk, "ad_receiver": ad.pk} for ad in ads]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post(items)
+            self.assertEqual(response.data["created"], len(ads))
+            return len(queries)
+
+        # Первый запрос прогревает кеш токенов аутентификации
+        self.post([])
+        more_ads = [self.create_ad(self.user2) for _ in range(10)]
+        self.assertEqual(count_queries(self.other_ads[:1]), count_queries(more_ads))
+
+
+@override_settings(EXCHANGE_CYCLE_INCREMENTAL=False)
+class ProposalInboxTests(APITestBase):
+    """Tests for the denormalized proposal inbox and its counters"""
+
+    def setUp(self):
+        super().setUp()
+        self.other_ads = [self.create_ad(self.user2) for _ in range(3)]
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            user=user,
+            title="Inbox ad",
+            description="Description long enough for validation",
+            category="books",
+            condition="used",
+        )
+
+    def assertCounters(self, user, sent_pending, received_pending, unread):
+        self.assertEqual(
+            get_counters(user.pk),
+            {
+                "sent_pending": sent_pending,
+                "received_pending": received_pending,
+                "unread": unread,
+            },
+        )
+
+    def test_counters_follow_proposals(self):
+        first = ExchangeProposal.objects.create(
+            ad_sender=self.ad, ad_receiver=self.other_ads[0]
+        )
+        ExchangeProposal.objects.create(
+            ad_sender=self.ad, ad_receiver=self.other_ads[1]
+        )
+        ExchangeProposal.objects.create(
+            ad_sender=self.other_ads[2], ad_receiver=self.ad
+        )
+        self.assertCounters(self.user, 2, 1, 1)
+        self.assertCounters(self.user2, 1, 2, 2)
+
+        reject_proposal(first)
+        self.assertCounters(self.user, 1, 1, 1)
+        self.assertCounters(self.user2, 1, 1, 2)
+        self.assertEqual(
+            ProposalInboxEntry.objects.get(proposal=first, box="received").status,
+            "rejected",
+        )
+
+        # Принятие отменяет остальные предложения с объявлением self.ad
+        accept_proposal(ExchangeProposal.objects.get(ad_sender=self.other_ads[2]))
+        self.assertCounters(self.user, 0, 0, 1)
+        self.assertCounters(self.user2, 0, 0, 2)
+
+    def test_counters_after_save_and_delete(self):
+        proposal = ExchangeProposal.objects.create(
+            ad_sender=self.ad, ad_receiver=self.other_ads[0]
+        )
+        proposal.status = "rejected"
+        proposal.save()
+        self.assertCounters(self.user2, 0, 0, 1)
+
+        ExchangeProposal.objects.create(
+            ad_sender=self.ad, ad_receiver=self.other_ads[1]
+        )
+        self.other_ads[1].delete()
+        self.assertCounters(self.user, 0, 0, 0)
+        self.assertCounters(self.user2, 0, 0, 1)
+
+    def test_bulk_created_proposals(self):
+        results = create_proposals(
+            self.user,
+            [{"ad_sender": self.ad.pk, "ad_receiver": ad.pk} for ad in self.other_ads],
+        )
+        self.assertEqual({result["status"] for result in results}, {"created"})
+        self.assertCounters(self.user, 3, 0, 0)
+        self.assertCounters(self.user2, 0, 3, 3)
+
+    def test_list_api_pagination(self):
+        for ad in self.other_ads:
+            ExchangeProposal.objects.create(ad_sender=self.ad, ad_receiver=ad)
+        url = reverse("barter:api_proposal_list")
+        response = self.client.get(url, {"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["sent_proposals"]), 2)
+        self.assertEqual(response.data["received_proposals"], [])
+        self.assertIsNone(response.data["received_next"])
+        self.assertEqual(response.data["counters"]["sent_pending"], 3)
+
+        response = self.client.get(response.data["sent_next"])
+        self.assertEqual(len(response.data["sent_proposals"]), 1)
+        self.assertEqual(
+            response.data["sent_proposals"][0]["ad_receiver_title"], "Inbox ad"
+        )
+        self.assertIsNone(response.data["sent_next"])
+
+        response = self.client.get(url, {"sent_cursor": "broken"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_read_api(self):
+        ExchangeProposal.objects.create(
+            ad_sender=self.other_ads[0], ad_receiver=self.ad
+        )
+        response = self.client.post(reverse("barter:api_proposal_read"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["unread"], 0)
+        self.assertEqual(response.data["received_pending"], 1)
+
+    def test_rebuild(self):
+        read = ExchangeProposal.objects.create(
+            ad_sender=self.other_ads[0], ad_receiver=self.ad
+        )
+        self.client.post(reverse("barter:api_proposal_read"))
+        ExchangeProposal.objects.create(
+            ad_sender=self.other_ads[1], ad_receiver=self.ad
+        )
+        # Изменения в обход сигналов и services приводят к расхождению
+        ExchangeProposal.objects.filter(pk=read.pk).update(status="rejected")
+        ProposalInboxEntry.objects.filter(box="sent").delete()
+
+        self.assertEqual(rebuild_inbox(), 4)
+        self.assertCounters(self.user, 0, 1, 1)
+        self.assertCounters(self.user2, 1, 0, 0)
+
+        out = io.StringIO()
+        call_command("rebuild_proposal_inbox", "--if-empty", stdout=out)
+        self.assertEqual(ProposalInboxEntry.objects.count(), 4)
+
+
+def read_stream(user_id, last_event_id=None, count=1, publish=None):
+    """Reads count chunks after the retry line, optionally publishing first"""
+
+    async def read():
+        stream = stream_events(user_id, last_event_id)
+        try:
+            await stream.__anext__()
+            chunks = []
+            if publish:
+                publish()
+            for _ in range(count):
+                chunks.append(await stream.__anext__())
+            return chunks
+        finally:
+            await stream.aclose()
+
+    return async_to_sync(read)()
+
+
+@override_settings(EXCHANGE_CYCLE_INCREMENTAL=False)
+class ProposalEventsTests(APITestBase):
+    """Tests for proposal events published to Redis and streamed over SSE"""
+
+    def setUp(self):
+        super().setUp()
+        self.ad2 = Ad.objects.create(
+            user=self.user2,
+            title="Events ad",
+            description="Description long enough for validation",
+            category="books",
+            condition="used",
+        )
+        # Redis outlives the test database and user ids are reused
+        get_redis_connection("default").delete(
+            stream_key(self.user.pk), stream_key(self.user2.pk)
+        )
+
+    def history(self, user):
+        return [
+            json.loads(fields[b"data"])
+            for _, fields in get_redis_connection("default").xrange(stream_key(user.pk))
+        ]
+
+    def test_status_changes_are_published_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            proposal = ExchangeProposal.objects.create(
+                ad_sender=self.ad, ad_receiver=self.ad2
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            reject_proposal(proposal)
+        self.assertEqual(
+            self.history(self.user2),
+            [
+                {
+                    "type": "created",
+                    "proposal": proposal.pk,
+                    "box": "received",
+                    "status": "pending",
+                },
+                {
+                    "type": "status",
+                    "proposal": proposal.pk,
+                    "box": "received",
+                    "status": "rejected",
+                },
+            ],
+        )
+        self.assertEqual(self.history(self.user)[-1]["box"], "sent")
+
+    def test_stream_resumes_after_last_event_id(self):
+        publish_events([(self.user.pk, {"n": 1}), (self.user.pk, {"n": 2})])
+        first_id = (
+            get_redis_connection("default")
+            .xrange(stream_key(self.user.pk))[0][0]
+            .decode()
+        )
+        (chunk,) = read_stream(self.user.pk, first_id)
+        self.assertIn('data: {"n":2}', chunk)
+        self.assertTrue(chunk.startswith("id: "))
+
+    def test_stream_delivers_published_events(self):
+        chunks = read_stream(
+            self.user.pk, publish=lambda: publish_events([(self.user.pk, {"n": 3})])
+        )
+        self.assertIn('data: {"n":3}', chunks[0])
+
+    @override_settings(PROPOSAL_EVENTS_HEARTBEAT_SECONDS=0.01)
+    def test_stream_heartbeat(self):
+        self.assertEqual(read_stream(self.user.pk), [": heartbeat\n\n"])
+
+    def test_events_api(self):
+        response = self.client.get(reverse("barter:api_proposal_events"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(response.streaming)
+        response.close()
+
+        self.client.credentials()
+        self.client.cookies.clear()
+        response = self.client.get(reverse("barter:api_proposal_events"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(AD_IMAGE_VARIANTS={"card": 40, "detail": 80, "original": 160})
+class AdImageVariantsTests(TempMediaRootMixin, APITestBase):
+    """Tests for ad image variants built by the background worker"""
+
+    def setUp(self):
+        super().setUp()
+        get_redis_connection("default").delete(QUEUE_KEY)
+
+    def upload(self, size=(120, 60)):
+        image = Image.new("RGB", size, color="blue")
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        image_io = io.BytesIO()
+        image.save(image_io, format="JPEG", exif=exif)
+        return SimpleUploadedFile(
+            "photo.jpg", image_io.getvalue(), content_type="image/jpeg"
+        )
+
+    def test_upload_is_queued_not_processed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad.image = self.upload()
+            self.ad.save()
+        self.assertEqual(
+            get_redis_connection("default").lrange(QUEUE_KEY, 0, -1),
+            [str(self.ad.pk).encode()],
+        )
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.image_variants, {})
+        self.assertEqual(self.ad.get_image_url("card"), self.ad.image.url)
+
+    def test_process_builds_variants_without_exif(self):
+        self.ad.image = self.upload()
+        self.ad.save()
+
+        self.assertTrue(process_ad_image(self.ad.pk))
+        self.ad.refresh_from_db()
+        self.assertFalse(needs_processing(self.ad))
+        # Images smaller than the "original" variant are not upscaled
+        self.assertEqual(
+            {
+                name: (variant["width"], variant["height"])
+                for name, variant in self.ad.image_variants.items()
+                if name != "source"
+            },
+            {"card": (40, 20), "detail": (80, 40), "original": (120, 60)},
+        )
+        with self.ad.image.storage.open(
+            self.ad.image_variants["card"]["jpeg"]
+        ) as variant:
+            image = Image.open(variant)
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(len(image.getexif()), 0)
+        self.assertTrue(self.ad.get_image_url("card", "webp").endswith(".webp"))
+        self.assertEqual(
+            [width for _, width in self.ad.get_image_srcset()], [40, 80, 120]
+        )
+
+    def test_replaced_image_is_processed_again(self):
+        self.ad.image = self.upload()
+        self.ad.save()
+        process_ad_image(self.ad.pk)
+        self.ad.refresh_from_db()
+        old_variant = self.ad.image_variants["card"]["jpeg"]
+
+        self.ad.image = self.upload(size=(60, 120))
+        self.ad.save()
+        self.assertTrue(needs_processing(self.ad))
+        self.assertEqual(self.ad.get_image_url("card"), self.ad.image.url)
+
+        self.assertEqual(run_worker(once=True), 1)
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.image_variants["card"]["width"], 20)
+        self.assertEqual(ImageBlob.objects.get(name=old_variant).refs, 0)
+
+    def test_broken_image_is_not_retried(self):
+        self.ad.image = SimpleUploadedFile("broken.jpg", b"not an image")
+        self.ad.save()
+        self.assertFalse(process_ad_image(self.ad.pk))
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.image_variants, {"source": self.ad.image.name})
+        self.assertEqual(run_worker(once=True), 0)
+
+    def test_worker_survives_failing_item(self):
+        self.ad.image = self.upload()
+        self.ad.save()
+        other = Ad.objects.create(
+            user=self.user2,
+            title="Second ad",
+            description="Second ad with an image for the worker test",
+            category="books",
+            condition="used",
+            image=self.upload(),
+        )
+        get_redis_connection("default").rpush(QUEUE_KEY, self.ad.pk, other.pk)
+
+        replace_variants = images._replace_variants
+        calls = []
+
+        def fail_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError("connection lost")
+            return replace_variants(*args)
+
+        with patch("barter.images._replace_variants", side_effect=fail_once):
+            with self.assertLogs("barter.images", "ERROR"):
+                # The failed ad is picked up again from the database
+                self.assertEqual(run_worker(once=True), 2)
+        for ad in (self.ad, other):
+            ad.refresh_from_db()
+            self.assertFalse(needs_processing(ad))
+
+    def test_api_serves_variant(self):
+        # Own ads are hidden from the list
+        self.ad.user = self.user2
+        self.ad.image = self.upload()
+        self.ad.save()
+        process_ad_image(self.ad.pk)
+
+        response = self.client.get(reverse("barter:api_ad_list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.data["results"][0]
+        self.ad.refresh_from_db()
+        self.assertTrue(
+            result["image_url"].endswith(self.ad.image_variants["card"]["jpeg"])
+        )
+        self.assertIn(
+            f"{self.ad.image_variants['detail']['webp']} 80w",
+            result["image_srcset"]["webp"],
+        )
+
+
+class ContentAddressedStorageTests(TempMediaRootMixin, APITestBase):
+    """Tests for deduplicated ad image storage and the orphan sweep"""
+
+    def setUp(self):
+        super().setUp()
+        self.storage = Ad._meta.get_field("image").storage
+        self.content = create_test_image().getvalue()
+
+    def upload(self, content=None):
+        return SimpleUploadedFile(
+            "photo.JPG", content or self.content, content_type="image/jpeg"
+        )
+
+    def create_ad(self, **kwargs):
+        return Ad.objects.create(
+            user=self.user,
+            title="Shared photo",
+            description="Description long enough for validation",
+            category="books",
+            condition="used",
+            **kwargs,
+        )
+
+    def refs(self, name):
+        return ImageBlob.objects.get(name=name).refs
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_ad(image=self.upload())
+        second = self.create_ad(image=self.upload())
+
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(first.image.name, f"ads_images/{digest[:2]}/{digest}.jpg")
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(self.refs(first.image.name), 2)
+        self.assertEqual(
+            [
+                name
+                for _, _, names in os.walk(self.storage.path("ads_images"))
+                for name in names
+            ],
+            [f"{digest}.jpg"],
+        )
+
+    def test_replace_and_delete_release_refs(self):
+        ad = self.create_ad(image=self.upload())
+        old_name = ad.image.name
+
+        ad.image = self.upload(b"other content")
+        ad.save()
+        self.assertEqual(self.refs(old_name), 0)
+        self.assertEqual(self.refs(ad.image.name), 1)
+
+        ad.delete()
+        self.assertEqual(self.refs(ad.image.name), 0)
+
+    def test_sweep_removes_only_unreferenced_files(self):
+        kept = self.create_ad(image=self.upload())
+        replaced = self.create_ad(image=self.upload(b"old content"))
+        old_name = replaced.image.name
+        replaced.image = None
+        replaced.save()
+        # Orphan left by a rolled back upload has no ImageBlob row
+        orphan = self.storage.save("ads_images/lost.png", io.BytesIO(b"lost"))
+
+        self.assertEqual(sweep(), [])
+        self.assertEqual(sorted(sweep(grace=timedelta(0))), sorted([old_name, orphan]))
+        self.assertTrue(self.storage.exists(kept.image.name))
+        self.assertFalse(self.storage.exists(old_name))
+        self.assertFalse(ImageBlob.objects.filter(name=old_name).exists())
+
+    def test_sweep_keeps_referenced_files_with_lost_refs(self):
+        ad = self.create_ad(image=self.upload())
+        ImageBlob.objects.all().delete()
+
+        self.assertEqual(sweep(grace=timedelta(0)), [])
+        self.assertEqual(recount_refs(), 1)
+        self.assertEqual(self.refs(ad.image.name), 1)
+
+    def test_sweep_command(self):
+        ad = self.create_ad(image=self.upload())
+        ad.delete()
+        out = io.StringIO()
+        call_command("sweep_ad_images", "--grace-hours=0", "--dry-run", stdout=out)
+        self.assertIn(ad.image.name, out.getvalue())
+        self.assertTrue(self.storage.exists(ad.image.name))
+
+        call_command("sweep_ad_images", "--grace-hours=0", stdout=io.StringIO())
+        self.assertFalse(self.storage.exists(ad.image.name))
+
+
+def create_noise_png(size=(100, 100)):
+    # Noise does not compress, so the file size follows the pixel count
+    image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    image_io = io.BytesIO()
+    image.save(image_io, format="PNG")
+    return image_io.getvalue()
+
+
+class AdImageUploadTests(TempMediaRootMixin, APITestBase):
+    """Tests for streaming validation of ad image uploads"""
+
+    def create(self, content, name="photo.png"):
+        return self.client.post(
+            reverse("barter:api_ad_create"),
+            {
+                "title": "Uploaded ad",
+                "description": "Description long enough for validation",
+                "category": "books",
+                "condition": "used",
+                "image": SimpleUploadedFile(name, content),
+            },
+            format="multipart",
+        )
+
+    def test_valid_image(self):
+        response = self.create(create_noise_png())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Ad.objects.get(pk=response.data["id"]).image)
+
+    def test_not_an_image(self):
+        response = self.create(b"GIF89a" + b"x" * 100, name="photo.gif")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("image", response.data["errors"])
+
+        response = self.create(b"%PDF-1.7" + b"x" * 100)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ad.objects.filter(title="Uploaded ad").exists())
+
+    @override_settings(AD_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels(self):
+        response = self.create(create_noise_png())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Мп", response.data["errors"]["image"][0])
+
+    @override_settings(AD_IMAGE_MAX_UPLOAD_SIZE=1000)
+    def test_too_large(self):
+        response = self.create(create_noise_png())
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # Rejected by Content-Length before the body is parsed
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000):
+            response = self.create(create_noise_png())
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(Ad.objects.filter(title="Uploaded ad").exists())
+
+    @override_settings(AD_IMAGE_MAX_PIXELS=100)
+    def test_rejected_on_first_chunk(self):
+        content = create_noise_png((500, 500))
+        request = HttpRequest()
+        handler = AdImageUploadHandler(request)
+        handler.new_file("image", "photo.png", "image/png", len(content))
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(content[:1024], 0)
+        self.assertEqual(request.ad_image_upload_error[0], 400)
+
+    def test_other_file_fields_are_kept(self):
+        request = RequestFactory().post(
+            reverse("barter:api_ad_create"),
+            {
+                "image": SimpleUploadedFile("photo.png", create_noise_png()),
+                "attachment": SimpleUploadedFile("notes.txt", b"not an image"),
+            },
+        )
+        request.upload_handlers = [
+            AdImageUploadHandler(request),
+            *request.upload_handlers,
+        ]
+        self.assertEqual(set(request.FILES), {"image", "attachment"})
+        self.assertEqual(request.FILES["attachment"].read(), b"not an image")
+        self.assertIsNone(getattr(request, "ad_image_upload_error", None))
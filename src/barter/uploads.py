@@ -0,0 +1,152 @@
+import io
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from PIL import Image
+from rest_framework import status
+from rest_framework.response import Response
+
+# Загрузка изображения объявления проверяется по мере чтения тела запроса:
+# размер, сигнатура формата и размеры из заголовка изображения. Неподходящий
+# файл прерывает разбор без чтения остатка тела, а сам файл, как и раньше,
+# принимают MemoryFileUploadHandler или TemporaryFileUploadHandler - на диск он
+# пишется, если запрос больше FILE_UPLOAD_MAX_MEMORY_SIZE.
+IMAGE_FIELD = "image"
+SIGNATURE_LENGTH = 12
+# Заголовок с размерами обычно в первых килобайтах, но EXIF и превью в JPEG
+# могут его сдвинуть
+HEADER_LIMIT = 1024 * 1024
+
+
+def is_image_signature(head):
+    """JPEG, PNG, GIF или WebP по первым SIGNATURE_LENGTH байтам"""
+    return head.startswith((b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF8")) or (
+        head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+    )
+
+
+class AdImageUploadHandler(FileUploadHandler):
+    """
+    Обработчик загрузки, проверяющий поле image по мере поступления чанков.
+    Стоит первым в списке обработчиков и передает чанки следующим. Ошибка
+    записывается в request.ad_image_upload_error как (код ответа, сообщение).
+    """
+
+    def fail(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        self.request.ad_image_upload_error = (status_code, message)
+
+    def reject(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        self.fail(message, status_code)
+        # Остаток тела не читается
+        raise StopUpload(connection_reset=True)
+
+    def fail_size(self):
+        limit_mb = settings.AD_IMAGE_MAX_UPLOAD_SIZE / (1024 * 1024)
+        self.fail(
+            f"Размер изображения не должен превышать {limit_mb:g} МБ.",
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # Content-Length известен до чтения тела: слишком большой запрос
+        # отклоняется сразу, остальные поля формы тоже не разбираются
+        fields_limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if fields_limit is None:
+            return None
+        if content_length > settings.AD_IMAGE_MAX_UPLOAD_SIZE + fields_limit:
+            self.fail_size()
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        # SkipFile отбросил бы файл для всех обработчиков, поэтому другие
+        # файловые поля просто передаются дальше без проверки
+        self.active = field_name == IMAGE_FIELD
+        self.size = 0
+        self.header = b""
+        self.checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.size += len(raw_data)
+        if self.size > settings.AD_IMAGE_MAX_UPLOAD_SIZE:
+            self.fail_size()
+            raise StopUpload(connection_reset=True)
+        if not self.checked:
+            self.header += raw_data
+            error = self.check_header(complete=False)
+            if error:
+                self.reject(error)
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Исключение здесь не прерывает разбор, поэтому ошибка только
+        # записывается, а файл сохраняют следующие обработчики
+        if self.active and not self.checked:
+            error = self.check_header(complete=True)
+            if error:
+                self.fail(error)
+        return None
+
+    def check_header(self, complete):
+        """
+        Проверяет накопленное начало файла.
+
+        Returns:
+            Сообщение об ошибке или None. Если заголовок изображения еще не
+            дочитан, проверка повторится со следующим чанком.
+        """
+        if len(self.header) >= SIGNATURE_LENGTH or complete:
+            if not is_image_signature(self.header[:SIGNATURE_LENGTH]):
+                return "Загрузите изображение в формате JPEG, PNG, GIF или WebP."
+
+        try:
+            # Image.open читает только заголовок и не декодирует пиксели
+            with Image.open(io.BytesIO(self.header)) as image:
+                pixels = image.width * image.height
+        except Image.DecompressionBombError:
+            pixels = None
+        except (OSError, SyntaxError, ValueError):
+            if complete or len(self.header) > HEADER_LIMIT:
+                return "Не удалось прочитать изображение."
+            return None
+
+        self.checked = True
+        self.header = b""
+        if pixels is None or pixels > settings.AD_IMAGE_MAX_PIXELS:
+            return (
+                "Разрешение изображения не должно превышать "
+                f"{settings.AD_IMAGE_MAX_PIXELS / 1_000_000:g} Мп."
+            )
+        return None
+
+
+def validate_ad_image_upload(view_func):
+    """
+    Подключает AdImageUploadHandler к api_view до разбора тела запроса и
+    возвращает ошибку загрузки изображения, не вызывая view.
+    """
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        django_request = request._request
+        django_request.upload_handlers = [
+            AdImageUploadHandler(django_request),
+            *django_request.upload_handlers,
+        ]
+        # Разбор тела с новыми обработчиками
+        request.data
+        error = getattr(django_request, "ad_image_upload_error", None)
+        if error is not None:
+            status_code, message = error
+            return Response({"errors": {IMAGE_FIELD: [message]}}, status=status_code)
+        return view_func(request, *args, **kwargs)
+
+    return wrapper
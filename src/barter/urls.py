@@ -38,9 +38,22 @@ urlpatterns = [
         views.proposal_create_api,
         name="api_proposal_create",
     ),
+    path("api/proposals/read/", views.proposal_read_api, name="api_proposal_read"),
+    path(
+        "api/proposals/events/",
+        views.proposal_events_api,
+        name="api_proposal_events",
+    ),
+    path(
+        "api/proposals/bulk-create/",
+        views.proposal_bulk_create_api,
+        name="api_proposal_bulk_create",
+    ),
     path(
         "api/proposals/<int:pk>/update/",
         views.proposal_update_api,
         name="api_proposal_update",
     ),
+    # API endpoints - Exchange Cycles
+    path("api/cycles/", views.cycle_list_api, name="api_cycle_list"),
 ]
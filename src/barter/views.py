@@ -1,13 +1,17 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db import models
+from django.core.exceptions import BadRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
+from django.views.decorators.http import require_GET
 from django.views.generic import (
     CreateView,
     DeleteView,
     DetailView,
     ListView,
+    TemplateView,
     UpdateView,
 )
 from rest_framework import status
@@ -15,21 +19,38 @@ from rest_framework.response import Response
 
 from settings.aboba_swagger import aboba_swagger
 
+from .cache import AdListCacheMixin, cache_ad_list_api
+from .events import stream_events
 from .forms import AdCreateForm, AdUpdateForm, ExchangeProposalForm
-from .models import Ad, ExchangeProposal
+from .inbox import get_counters, get_inbox, mark_read
+from .matching import get_valid_cycles
+from .models import Ad, ExchangeCycle, ExchangeProposal, ProposalInboxEntry
+from .pagination import InvalidCursor, paginate_keyset
+from .search import (
+    clean_similarity_threshold,
+    parse_similarity_threshold,
+    search_ads,
+    suggest_search_query,
+    word_similarity_threshold,
+)
 from .serializers import (
     AdCreateUpdateSerializer,
     AdDetailSerializer,
     AdSerializer,
+    ExchangeCycleSerializer,
+    ExchangeProposalBulkCreateSerializer,
     ExchangeProposalCreateSerializer,
     ExchangeProposalListSerializer,
     ExchangeProposalSerializer,
     ExchangeProposalUpdateSerializer,
+    SimpleAdSerializer,
 )
+from .services import accept_proposal, create_proposals, reject_proposal
+from .uploads import validate_ad_image_upload
 
 
 # Классы представлений для основных страниц
-class AdListView(ListView):
+class AdListView(AdListCacheMixin, ListView):
     model = Ad
     template_name = "barter/ad_list.html"
     context_object_name = "ads"
@@ -39,14 +60,7 @@ class AdListView(ListView):
         queryset = super().get_queryset().filter(is_active=True)
 
         if self.request.user.is_authenticated:
-            queryset = queryset.exclude(user=self.request.user)
-
-        search_query = self.request.GET.get("search")
-        if search_query:
-            queryset = queryset.filter(
-                models.Q(title__icontains=search_query)
-                | models.Q(description__icontains=search_query)
-            )
+            queryset = queryset.exclude(user_id=self.request.user.pk)
 
         category = self.request.GET.get("category")
         if category:
@@ -56,12 +70,34 @@ class AdListView(ListView):
         if condition:
             queryset = queryset.filter(condition=condition)
 
+        self.unsearched_queryset = queryset
+        search_query = self.request.GET.get("search")
+        if search_query:
+            queryset = search_ads(queryset, search_query)
+
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(
+            queryset, page_size
+        )
+        # Страница выбирается сразу, пока действует порог похожести поиска
+        page.object_list = list(object_list)
+        return paginator, page, page.object_list, is_paginated
+
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+        search_query = self.request.GET.get("search")
+        with word_similarity_threshold(
+            search_query,
+            parse_similarity_threshold(self.request.GET.get("similarity")),
+        ):
+            context = super().get_context_data(**kwargs)
         context["categories"] = Ad.Category.choices
         context["conditions"] = Ad.Condition.choices
+        if search_query and not context["ads"]:
+            context["suggestion"] = suggest_search_query(
+                self.unsearched_queryset, search_query
+            )
         return context
 
 
@@ -70,6 +106,9 @@ class AdDetailView(DetailView):
     template_name = "barter/ad_detail.html"
     context_object_name = "ad"
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("user")
+
 
 class AdCreateView(LoginRequiredMixin, CreateView):
     model = Ad
@@ -127,22 +166,31 @@ class MyAdsListView(LoginRequiredMixin, ListView):
     context_object_name = "ads"
 
     def get_queryset(self):
-        return super().get_queryset().filter(user=self.request.user)
+        return super().get_queryset().filter(user_id=self.request.user.pk)
 
 
-class MyProposalsListView(LoginRequiredMixin, ListView):
-    model = ExchangeProposal
+class MyProposalsListView(LoginRequiredMixin, TemplateView):
     template_name = "barter/my_proposals.html"
-    context_object_name = "proposals"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["sent_proposals"] = ExchangeProposal.objects.filter(
-            ad_sender__user=self.request.user
-        )
-        context["received_proposals"] = ExchangeProposal.objects.filter(
-            ad_receiver__user=self.request.user
-        )
+        user_id = self.request.user.pk
+        # Счетчик непрочитанных показывается до отметки о прочтении
+        context["counters"] = get_counters(user_id)
+        for box in ProposalInboxEntry.Box.values:
+            entries = get_inbox(
+                user_id, box, ["proposal__ad_sender__user", "proposal__ad_receiver"]
+            )
+            try:
+                page, next_url = paginate_keyset(
+                    self.request, entries, cursor_param=f"{box}_cursor"
+                )
+            except InvalidCursor as error:
+                raise BadRequest(str(error))
+            context[f"{box}_proposals"] = [entry.proposal for entry in page]
+            context[f"{box}_next"] = next_url
+        if context["counters"]["unread"]:
+            mark_read(user_id)
         return context
 
 
@@ -207,9 +255,11 @@ def create_proposal(request, ad_id):
     is_drf=False,
 )
 def update_proposal_status(request, proposal_id, status):
-    proposal = get_object_or_404(ExchangeProposal, id=proposal_id)
+    proposal = get_object_or_404(
+        ExchangeProposal.objects.select_related("ad_receiver"), id=proposal_id
+    )
 
-    if proposal.ad_receiver.user != request.user:
+    if proposal.ad_receiver.user_id != request.user.pk:
         messages.error(request, "У вас нет прав для изменения этого предложения")
         return redirect("barter:my_proposals")
 
@@ -218,37 +268,18 @@ def update_proposal_status(request, proposal_id, status):
         return redirect("barter:my_proposals")
 
     if status == "accepted":
-        proposal.status = "accepted"
-        proposal.save()
-
-        proposal.ad_sender.is_active = False
-        proposal.ad_receiver.is_active = False
-        proposal.ad_sender.save()
-        proposal.ad_receiver.save()
-
-        ExchangeProposal.objects.filter(
-            ad_sender=proposal.ad_sender, status="pending"
-        ).exclude(id=proposal.id).update(status="cancelled")
-
-        ExchangeProposal.objects.filter(
-            ad_receiver=proposal.ad_sender, status="pending"
-        ).exclude(id=proposal.id).update(status="cancelled")
-
-        ExchangeProposal.objects.filter(
-            ad_sender=proposal.ad_receiver, status="pending"
-        ).exclude(id=proposal.id).update(status="cancelled")
-
-        ExchangeProposal.objects.filter(
-            ad_receiver=proposal.ad_receiver, status="pending"
-        ).exclude(id=proposal.id).update(status="cancelled")
-
-        messages.success(request, "Предложение принято! Оба объявления деактивированы.")
+        if accept_proposal(proposal):
+            messages.success(
+                request, "Предложение принято! Оба объявления деактивированы."
+            )
+        else:
+            messages.error(request, "Статус этого предложения уже изменен")
 
     elif status == "rejected":
-        proposal.status = "rejected"
-        proposal.save()
-
-        messages.success(request, "Предложение отклонено.")
+        if reject_proposal(proposal):
+            messages.success(request, "Предложение отклонено.")
+        else:
+            messages.error(request, "Статус этого предложения уже изменен")
 
     else:
         messages.error(request, "Неверный статус. Разрешены только: accepted, rejected")
@@ -264,50 +295,72 @@ def update_proposal_status(request, proposal_id, status):
         "category": str,
         "condition": str,
         "search": str,
+        "similarity": float,
+        "limit": int,
+        "cursor": str,
     },
     responses={
-        "200": [
-            {
-                "id": 1,
-                "title": "Мобильный телефон",
-                "description": "Хороший телефон в отличном состоянии",
-                "category": "electronics",
-                "category_display": "Электроника",
-                "condition": "used",
-                "condition_display": "Б/у",
-                "is_active": True,
-                "created_at": "2024-03-20T12:00:00Z",
-                "user": 1,
-                "user_username": "username",
-                "image_url": "/media/ads_images/phone.jpg",
-            }
-        ]
+        "200": {
+            "results": [
+                {
+                    "id": 1,
+                    "title": "Мобильный телефон",
+                    "description": "Хороший телефон в отличном состоянии",
+                    "category": "electronics",
+                    "category_display": "Электроника",
+                    "condition": "used",
+                    "condition_display": "Б/у",
+                    "is_active": True,
+                    "created_at": "2024-03-20T12:00:00Z",
+                    "user": 1,
+                    "user_username": "username",
+                    "image_url": "/media/ads_images/phone.jpg",
+                }
+            ],
+            "next": "http://localhost:8000/api/ads/?limit=20&cursor=WyIyMDI0LTAzLTIwVDEyOjAwOjAwWiIsMV0",
+            "suggestion": "Мобильный телефон",
+        },
+        "400": {"detail": "Неверный курсор"},
     },
     tags=["api"],
     is_drf=False,
+    validate=True,
 )
-def ad_list_api(request):
+@cache_ad_list_api
+def ad_list_api(request, category, condition, search, similarity, limit, cursor):
     ads = Ad.objects.filter(is_active=True)
     if request.user.is_authenticated:
-        ads = ads.exclude(user=request.user)
+        ads = ads.exclude(user_id=request.user.pk)
 
-    search_query = request.GET.get("search")
-    if search_query:
-        ads = ads.filter(
-            models.Q(title__icontains=search_query)
-            | models.Q(description__icontains=search_query)
-        )
-
-    category = request.GET.get("category")
     if category:
         ads = ads.filter(category=category)
 
-    condition = request.GET.get("condition")
     if condition:
         ads = ads.filter(condition=condition)
 
-    serializer = AdSerializer(ads, many=True, context={"request": request})
-    return Response(serializer.data)
+    unsearched_ads = ads
+    if search:
+        ads = search_ads(ads, search)
+
+    # cursor - строка, его разбирает и проверяет paginate_keyset
+    try:
+        with word_similarity_threshold(search, clean_similarity_threshold(similarity)):
+            page, next_url = paginate_keyset(
+                request, AdSerializer.setup_eager_loading(ads), limit=limit
+            )
+    except InvalidCursor as error:
+        return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = AdSerializer(page, many=True, context={"request": request})
+
+    # Подсказка «Возможно, вы имели в виду» нужна только когда ничего не найдено
+    suggestion = None
+    if search and not page and not cursor:
+        suggestion = suggest_search_query(unsearched_ads, search)
+
+    return Response(
+        {"results": serializer.data, "next": next_url, "suggestion": suggestion}
+    )
 
 
 @aboba_swagger(
@@ -341,7 +394,7 @@ def ad_list_api(request):
 )
 def ad_detail_api(request, pk):
     try:
-        ad = Ad.objects.get(pk=pk)
+        ad = AdDetailSerializer.setup_eager_loading(Ad.objects.all()).get(pk=pk)
         serializer = AdDetailSerializer(ad, context={"request": request})
         return Response(serializer.data)
     except Ad.DoesNotExist:
@@ -383,10 +436,12 @@ def ad_detail_api(request, pk):
             }
         },
         "401": {"detail": "Учетные данные не были предоставлены."},
+        "413": {"errors": {"image": ["Размер изображения не должен превышать 10 МБ."]}},
     },
     need_auth=True,
     tags=["api"],
 )
+@validate_ad_image_upload
 def ad_create_api(request):
     serializer = AdCreateUpdateSerializer(data=request.data)
     if serializer.is_valid():
@@ -396,6 +451,81 @@ def ad_create_api(request):
     return Response({"errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _get_user_id(request):
+    # Ленивый request.user загружается запросом к базе, в async-коде - через поток
+    return request.user.pk if request.user.is_authenticated else None
+
+
+@require_GET
+async def proposal_events_api(request):
+    """
+    Поток Server-Sent Events с изменениями предложений текущего пользователя.
+
+    Работает только под ASGI: WSGI-сервер буферизует асинхронный поток целиком.
+    Пропущенные события возвращаются по заголовку Last-Event-ID или параметру
+    last_event_id, при простое отправляется комментарий-heartbeat.
+    """
+    user_id = await sync_to_async(_get_user_id)(request)
+    if user_id is None:
+        return HttpResponse("Unauthorized", status=401)
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get(
+        "last_event_id"
+    )
+    response = StreamingHttpResponse(
+        stream_events(user_id, last_event_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@aboba_swagger(
+    http_methods=["POST"],
+    summary="Массовое создание предложений обмена API",
+    description=(
+        "API для создания нескольких предложений обмена одним запросом. "
+        "Каждый элемент проверяется отдельно, результаты возвращаются "
+        "в порядке элементов запроса."
+    ),
+    body_params={"proposals": [{"ad_sender": int, "ad_receiver": int, "comment": str}]},
+    responses={
+        "200": {
+            "created": 1,
+            "results": [
+                {"index": 0, "status": "created", "id": 1},
+                {
+                    "index": 1,
+                    "status": "error",
+                    "errors": {
+                        "ad_sender": ["Вы можете предлагать только свои объявления"]
+                    },
+                },
+            ],
+        },
+        "400": {"errors": {"proposals": ["Этот список не может быть пустым."]}},
+        "401": {"detail": "Учетные данные не были предоставлены."},
+    },
+    need_auth=True,
+    tags=["api"],
+)
+def proposal_bulk_create_api(request):
+    serializer = ExchangeProposalBulkCreateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(
+            {"errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = create_proposals(request.user, serializer.validated_data["proposals"])
+    return Response(
+        {
+            "created": sum(result["status"] == "created" for result in results),
+            "results": results,
+        }
+    )
+
+
 @aboba_swagger(
     http_methods=["PUT", "PATCH"],
     summary="Обновление объявления API",
@@ -433,10 +563,12 @@ def ad_create_api(request):
         "401": {"detail": "Учетные данные не были предоставлены."},
         "403": {"detail": "У вас нет прав редактировать это объявление."},
         "404": {"detail": "Объявление не найдено."},
+        "413": {"errors": {"image": ["Размер изображения не должен превышать 10 МБ."]}},
     },
     need_auth=True,
     tags=["api"],
 )
+@validate_ad_image_upload
 def ad_update_api(request, pk):
     try:
         ad = Ad.objects.get(pk=pk)
@@ -506,38 +638,53 @@ def ad_delete_api(request, pk):
     http_methods=["GET"],
     summary="Мои объявления API",
     description="API для получения списка объявлений текущего пользователя",
+    query_params={"limit": int, "cursor": str},
     responses={
-        "200": [
-            {
-                "id": 1,
-                "title": "Мобильный телефон",
-                "description": "Хороший телефон в отличном состоянии",
-                "category": "electronics",
-                "category_display": "Электроника",
-                "condition": "used",
-                "condition_display": "Б/у",
-                "is_active": True,
-                "created_at": "2024-03-20T12:00:00Z",
-                "user": 1,
-                "user_username": "username",
-                "image_url": "/media/ads_images/phone.jpg",
-            }
-        ],
+        "200": {
+            "results": [
+                {
+                    "id": 1,
+                    "title": "Мобильный телефон",
+                    "description": "Хороший телефон в отличном состоянии",
+                    "category": "electronics",
+                    "category_display": "Электроника",
+                    "condition": "used",
+                    "condition_display": "Б/у",
+                    "is_active": True,
+                    "created_at": "2024-03-20T12:00:00Z",
+                    "user": 1,
+                    "user_username": "username",
+                    "image_url": "/media/ads_images/phone.jpg",
+                }
+            ],
+            "next": "http://localhost:8000/api/ads/my/?limit=20&cursor=WyIyMDI0LTAzLTIwVDEyOjAwOjAwWiIsMV0",
+        },
+        "400": {"detail": "Неверный курсор"},
         "401": {"detail": "Учетные данные не были предоставлены."},
     },
     need_auth=True,
     tags=["api"],
 )
 def my_ads_api(request):
-    ads = Ad.objects.filter(user=request.user)
-    serializer = AdSerializer(ads, many=True, context={"request": request})
-    return Response(serializer.data)
+    ads = AdSerializer.setup_eager_loading(Ad.objects.filter(user_id=request.user.pk))
+    try:
+        page, next_url = paginate_keyset(request, ads)
+    except InvalidCursor as error:
+        return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = AdSerializer(page, many=True, context={"request": request})
+    return Response({"results": serializer.data, "next": next_url})
 
 
 @aboba_swagger(
     http_methods=["GET"],
     summary="Список предложений обмена API",
-    description="API для получения списка всех предложений обмена текущего пользователя",
+    description=(
+        "API для получения отправленных и полученных предложений обмена текущего "
+        "пользователя. Списки листаются независимо параметрами sent_cursor и "
+        "received_cursor, counters - количество ожидающих ответа и непрочитанных."
+    ),
+    query_params={"limit": int, "sent_cursor": str, "received_cursor": str},
     responses={
         "200": {
             "sent_proposals": [
@@ -562,25 +709,52 @@ def my_ads_api(request):
                     "created_at": "2024-03-20T12:00:00Z",
                 }
             ],
+            "sent_next": "http://localhost:8000/api/proposals/?sent_cursor=WyIyMDI0LTAzLTIwVDEyOjAwOjAwWiIsMV0",
+            "received_next": None,
+            "counters": {"sent_pending": 1, "received_pending": 1, "unread": 1},
         },
+        "400": {"detail": "Неверный курсор"},
         "401": {"detail": "Учетные данные не были предоставлены."},
     },
     need_auth=True,
     tags=["api"],
 )
 def proposal_list_api(request):
-    sent_proposals = ExchangeProposal.objects.filter(ad_sender__user=request.user)
-    received_proposals = ExchangeProposal.objects.filter(ad_receiver__user=request.user)
+    select_related, only = ExchangeProposalListSerializer.get_eager_loading(
+        "proposal__"
+    )
+    data = {}
+    for box in ProposalInboxEntry.Box.values:
+        entries = get_inbox(request.user.pk, box, select_related, only)
+        try:
+            page, next_url = paginate_keyset(
+                request, entries, cursor_param=f"{box}_cursor"
+            )
+        except InvalidCursor as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ExchangeProposalListSerializer(
+            [entry.proposal for entry in page], many=True
+        )
+        data[f"{box}_proposals"] = serializer.data
+        data[f"{box}_next"] = next_url
+    data["counters"] = get_counters(request.user.pk)
+    return Response(data)
 
-    sent_serializer = ExchangeProposalListSerializer(sent_proposals, many=True)
-    received_serializer = ExchangeProposalListSerializer(received_proposals, many=True)
 
-    return Response(
-        {
-            "sent_proposals": sent_serializer.data,
-            "received_proposals": received_serializer.data,
-        }
-    )
+@aboba_swagger(
+    http_methods=["POST"],
+    summary="Прочтение предложений обмена API",
+    description="API для отметки всех полученных предложений обмена прочитанными",
+    responses={
+        "200": {"sent_pending": 1, "received_pending": 1, "unread": 0},
+        "401": {"detail": "Учетные данные не были предоставлены."},
+    },
+    need_auth=True,
+    tags=["api"],
+)
+def proposal_read_api(request):
+    mark_read(request.user.pk)
+    return Response(get_counters(request.user.pk))
 
 
 @aboba_swagger(
@@ -621,7 +795,9 @@ def proposal_list_api(request):
 )
 def proposal_detail_api(request, pk):
     try:
-        proposal = ExchangeProposal.objects.get(pk=pk)
+        proposal = ExchangeProposalSerializer.setup_eager_loading(
+            ExchangeProposal.objects.all()
+        ).get(pk=pk)
 
         # Проверка прав доступа
         if (
@@ -760,10 +936,12 @@ def proposal_create_api(request, ad_id):
 )
 def proposal_update_api(request, pk):
     try:
-        proposal = ExchangeProposal.objects.get(pk=pk)
+        proposal = ExchangeProposalSerializer.setup_eager_loading(
+            ExchangeProposal.objects.all()
+        ).get(pk=pk)
 
         # Проверка прав доступа
-        if proposal.ad_receiver.user != request.user:
+        if proposal.ad_receiver.user_id != request.user.pk:
             return Response(
                 {"detail": "У вас нет прав для изменения этого предложения."},
                 status=status.HTTP_403_FORBIDDEN,
@@ -781,26 +959,18 @@ def proposal_update_api(request, pk):
         )
 
         if serializer.is_valid():
-            updated_proposal = serializer.save()
-
-            # Если статус изменен на "accepted" (принято)
-            if updated_proposal.status == "accepted":
-                # Деактивируем объявления
-                updated_proposal.ad_sender.is_active = False
-                updated_proposal.ad_receiver.is_active = False
-                updated_proposal.ad_sender.save()
-                updated_proposal.ad_receiver.save()
-
-                # Отменяем другие предложения для этих объявлений
-                ExchangeProposal.objects.filter(
-                    models.Q(ad_sender=updated_proposal.ad_sender)
-                    | models.Q(ad_receiver=updated_proposal.ad_sender)
-                    | models.Q(ad_sender=updated_proposal.ad_receiver)
-                    | models.Q(ad_receiver=updated_proposal.ad_receiver),
-                    status="pending",
-                ).exclude(id=updated_proposal.id).update(status="cancelled")
-
-            response_serializer = ExchangeProposalSerializer(updated_proposal)
+            # Принятие деактивирует объявления и отменяет другие предложения с ними
+            if serializer.validated_data.get("status") == "accepted":
+                updated = accept_proposal(proposal)
+            else:
+                updated = reject_proposal(proposal)
+            if not updated:
+                return Response(
+                    {"detail": "Статус этого предложения уже изменен"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            response_serializer = ExchangeProposalSerializer(proposal)
             return Response(response_serializer.data)
 
         return Response(
@@ -812,3 +982,52 @@ def proposal_update_api(request, pk):
             {"detail": "Предложение обмена не найдено."},
             status=status.HTTP_404_NOT_FOUND,
         )
+
+
+@aboba_swagger(
+    http_methods=["GET"],
+    summary="Циклы обмена API",
+    description=(
+        "API для получения предложенных многосторонних обменов с объявлениями "
+        "текущего пользователя. Владелец каждого объявления в цикле получает "
+        "следующее по циклу, последнее объявление переходит владельцу первого."
+    ),
+    responses={
+        "200": [
+            {
+                "id": 1,
+                "length": 3,
+                "ads": [
+                    {
+                        "id": 1,
+                        "title": "Мой товар",
+                        "description": "Описание",
+                        "category_display": "Электроника",
+                        "condition_display": "Б/у",
+                        "user_username": "username",
+                    }
+                ],
+                "proposals": [1, 2, 3],
+                "created_at": "2024-03-20T12:00:00Z",
+            }
+        ],
+        "401": {"detail": "Учетные данные не были предоставлены."},
+    },
+    need_auth=True,
+    tags=["api"],
+)
+def cycle_list_api(request):
+    user_ads = list(
+        Ad.objects.filter(user_id=request.user.pk, is_active=True).values_list(
+            "pk", flat=True
+        )
+    )
+    # Циклы пересчитываются периодически, устаревшие отбрасываются при чтении
+    cycles = get_valid_cycles(ExchangeCycle.objects.filter(ads__overlap=user_ads))
+    ads_by_id = SimpleAdSerializer.setup_eager_loading(Ad.objects.all()).in_bulk(
+        {pk for cycle in cycles for pk in cycle.ads}
+    )
+    serializer = ExchangeCycleSerializer(
+        cycles, many=True, context={"request": request, "ads_by_id": ads_by_id}
+    )
+    return Response(serializer.data)
@@ -1,5 +1,6 @@
 # https://drf-spectacular.readthedocs.io/en/latest/drf_spectacular.html#drf_spectacular.utils.extend_schema
 import hashlib
+import threading
 from functools import wraps
 from typing import Any, Dict, List
 
@@ -14,10 +15,12 @@ from drf_spectacular.utils import (
     extend_schema,
     inline_serializer,
 )
-from rest_framework import serializers
+from rest_framework import serializers, status
 from rest_framework.decorators import api_view
+from rest_framework.response import Response
 
-from user.models import AccessGroup
+from settings.aboba_validation import compile_request_validator
+from user.group_cache import get_request_group_names
 
 spectacular_settings.apply_patches({"DISABLE_ERRORS_AND_WARNINGS": True})
 
@@ -46,6 +49,50 @@ TYPES_SERIALIZERS_DICT = {
 }
 
 
+# Объекты схемы (inline_serializer, OpenApiParameter, примеры) строятся не при
+# импорте ручек, а при первой генерации схемы хуком build_pending_schemas.
+# Импорт views не обращается к базе и не тратит время воркеров на сваггер.
+# [(ручка, функция, возвращающая аргументы extend_schema)]
+pending_schemas = []
+pending_schemas_lock = threading.Lock()
+# [(имя ручки, группы из groups=)] для системной проверки user.W001
+declared_groups = []
+
+
+def build_pending_schemas(endpoints, **kwargs):
+    """
+    PREPROCESSING_HOOKS drf-spectacular: вешает extend_schema на ручки, для
+    которых схема еще не построена. Вызывается до создания view генератором.
+    """
+    with pending_schemas_lock:
+        while pending_schemas:
+            view, build_schema_args = pending_schemas[-1]
+            extend_schema(**build_schema_args())(view)
+            pending_schemas.pop()
+    return endpoints
+
+
+def check_groups(request, auth_group_names, response_403):
+    """
+    Проверка доступа по группам. Имена групп пользователя загружаются один раз
+    за запрос и кешируются в Redis, сама проверка - пересечение множеств.
+
+    Returns:
+        Ответ 403 или None, если доступ разрешен.
+    """
+    user_groups = get_request_group_names(request)
+    if user_groups & auth_group_names:
+        return None
+    if request.user.is_authenticated:
+        groups_msg = ", ".join(sorted(user_groups)) or "нет групп"
+    else:
+        groups_msg = "Анонимный юзер"
+    return HttpResponse(
+        f"У вас нет доступа {response_403} Вы находитесь в группах: {groups_msg}",
+        status=403,
+    )
+
+
 def aboba_swagger(
     http_methods: List[str] = [],
     summary: str = "",
@@ -60,6 +107,7 @@ def aboba_swagger(
     groups: List[str] = [],
     is_drf: bool = False,
     override_drf_autogen: bool = False,
+    validate: bool = False,
 ):
     """
     Декоратор для автоматической генерации OpenAPI-документации и обработки запросов.
@@ -86,10 +134,16 @@ def aboba_swagger(
         - override_drf_autogen (bool): drf-spectacular генерит самостоятельно сваггер для ViewSet.
             False: Переопределятся только те поля которые ты указал
             True: Переопределятся все поля
+        - validate (bool): Проверять query_params и body_params до вызова ручки. Некорректный
+            запрос получает 400 {"errors": {поле: [сообщения]}}, а ручка - уже разобранные
+            значения именованными аргументами: параметры запроса необязательны (None, если
+            не переданы), поля тела обязательны, поля сериализаторов проверяются ими самими.
 
     Примечания:
         - Ответы 401 и 403 добавляются автоматически, если указаны `need_auth` или `groups`.
         - Если указаны группы, доступ к ручке будет ограничен только для пользователей из этих групп.
+        - Схема ручки строится при первой генерации OpenAPI, а не при импорте. Наличие групп
+            в базе проверяет `manage.py check --database default` (и migrate).
 
     Пример использования декоратора со всеми аргументами:
 
@@ -150,6 +204,7 @@ def aboba_swagger(
         groups=["Worker", "Manager"],
         is_drf=False,
         override_drf_autogen=False,
+        validate=False,
     )
     def my_view(request):
         # Ваша логика обработки запроса
@@ -157,12 +212,8 @@ def aboba_swagger(
     """
 
     def decorator(function):
-        nonlocal description, need_auth  # https://stackoverflow.com/questions/1261875/what-does-nonlocal-do-in-python-3
-        query_parameters = []
-        body_parameters = {}
-        formated_responses = {}
-        formated_examples = []
-        auth_group_names = set()
+        nonlocal need_auth  # https://stackoverflow.com/questions/1261875/what-does-nonlocal-do-in-python-3
+        auth_group_names = frozenset(groups)
         response_403 = (
             f"К этой ручке имеют доступ только группы пользователей: {groups}."
         )
@@ -170,112 +221,104 @@ def aboba_swagger(
         if is_drf is False and len(http_methods) == 0:
             raise ValueError("http_methods is empty")
 
-        # Тут обрабатываем query params
-        for param_key in query_params.keys():
-            query_parameters.append(
-                OpenApiParameter(name=param_key, type=query_params[param_key])
-            )
-
-        # Тут обрабатываем ключи в body
-        for param_key in body_params.keys():
-            param_value = body_params[param_key]
-
-            # Check if it's a basic type in our dictionary
-            if isinstance(param_value, type) and param_value in TYPES_SERIALIZERS_DICT:
-                body_parameters[param_key] = TYPES_SERIALIZERS_DICT[param_value]()
-            # Handle nested dictionaries
-            elif isinstance(param_value, dict):
-                body_parameters[param_key] = parse_value_to_field(param_value)
-            # Handle already instantiated serializer fields
-            elif isinstance(param_value, serializers.Field):
-                body_parameters[param_key] = param_value
-            # Handle lists
-            elif isinstance(param_value, list):
-                body_parameters[param_key] = parse_value_to_field(param_value)
-            # Handle strings that might be type references
-            elif isinstance(param_value, str) and param_value in TYPES_SERIALIZERS_DICT:
-                body_parameters[param_key] = TYPES_SERIALIZERS_DICT[param_value]()
-            # Default case
-            else:
-                body_parameters[param_key] = param_value
+        validator = (
+            compile_request_validator(query_params, body_params) if validate else None
+        )
 
-        # Если группы есть, то делаем автоматически требование аутентификации
+        # Если группы есть, то делаем автоматически требование аутентификации.
+        # Наличие групп в базе проверяет системная проверка user.W001
         if groups:
             need_auth = True
-            description += "\n## Группы пользователей: "
-            for group in groups:
-                # Проверка наличия группы
-                if AccessGroup.objects.filter(name=group).exists():
-                    auth_group_names.add(group)
-                else:
-                    raise ValueError(f"Нет группы {group}")
-            description += ", ".join([f"{group}" for group in auth_group_names])
-            # Автоматическое добавление кода ответа 403
-            response_403.format(", ".join(auth_group_names))
-            if "403" in responses.keys():
-                if type(responses["403"]) != dict:
-                    saved_403_response = responses["403"]
-                    responses["403"] = {"403": saved_403_response}
-                responses["403"]["Разрешенные группы пользователей"] = response_403
-            else:
-                responses["403"] = response_403
+            declared_groups.append(
+                (f"{function.__module__}.{function.__qualname__}", auth_group_names)
+            )
 
-        # Автоматическое добавление кода ответа 401
-        if need_auth:
-            description = f"Эта ручка требует авторизации \n\n {description}"
-            responses["401"] = {"Unauthorized": "Unauthorized"}
+        def build_schema_args():
+            """Аргументы extend_schema, строятся при первой генерации схемы"""
+            query_parameters = []
+            body_parameters = {}
+            formated_examples = []
+            schema_description = description
+            schema_responses = dict(responses)
+
+            # Тут обрабатываем query params
+            for param_key in query_params.keys():
+                query_parameters.append(
+                    OpenApiParameter(name=param_key, type=query_params[param_key])
+                )
 
-        formated_responses = build_openapi_responses(
-            responses_dict=responses, handler_name=function.__name__
-        )
+            # Тут обрабатываем ключи в body
+            for param_key in body_params.keys():
+                param_value = body_params[param_key]
+
+                # Check if it's a basic type in our dictionary
+                if (
+                    isinstance(param_value, type)
+                    and param_value in TYPES_SERIALIZERS_DICT
+                ):
+                    body_parameters[param_key] = TYPES_SERIALIZERS_DICT[param_value]()
+                # Handle nested dictionaries
+                elif isinstance(param_value, dict):
+                    body_parameters[param_key] = parse_value_to_field(param_value)
+                # Handle already instantiated serializer fields
+                elif isinstance(param_value, serializers.Field):
+                    body_parameters[param_key] = param_value
+                # Handle lists
+                elif isinstance(param_value, list):
+                    body_parameters[param_key] = parse_value_to_field(param_value)
+                # Handle strings that might be type references
+                elif (
+                    isinstance(param_value, str)
+                    and param_value in TYPES_SERIALIZERS_DICT
+                ):
+                    body_parameters[param_key] = TYPES_SERIALIZERS_DICT[param_value]()
+                # Default case
+                else:
+                    body_parameters[param_key] = param_value
+
+            if groups:
+                schema_description += "\n## Группы пользователей: "
+                schema_description += ", ".join(groups)
+                # Автоматическое добавление кода ответа 403
+                if "403" in schema_responses.keys():
+                    if type(schema_responses["403"]) is not dict:
+                        schema_responses["403"] = {"403": schema_responses["403"]}
+                    schema_responses["403"] = {
+                        **schema_responses["403"],
+                        "Разрешенные группы пользователей": response_403,
+                    }
+                else:
+                    schema_responses["403"] = response_403
+
+            # Автоматическое добавление кода ответа 400
+            if validate:
+                validation_example = {"errors": {"field": ["Обязательное поле."]}}
+                if "400" in schema_responses.keys():
+                    if type(schema_responses["400"]) is not dict:
+                        schema_responses["400"] = {"400": schema_responses["400"]}
+                    schema_responses["400"] = {
+                        **schema_responses["400"],
+                        "Ошибка проверки запроса": validation_example,
+                    }
+                else:
+                    schema_responses["400"] = {
+                        "Ошибка проверки запроса": validation_example
+                    }
 
-        if not is_drf:
+            # Автоматическое добавление кода ответа 401
+            if need_auth:
+                schema_description = (
+                    f"Эта ручка требует авторизации \n\n {schema_description}"
+                )
+                schema_responses["401"] = {"Unauthorized": "Unauthorized"}
 
-            @wraps(function)
-            @extend_schema(
-                summary=summary,
-                description=description,
-                parameters=query_parameters,
-                request={
-                    "application/json": inline_serializer(
-                        name=f"{function.__name__}_{hashlib.md5(str(body_parameters).encode()).hexdigest()[:8]}",
-                        fields=body_parameters,
-                    )
-                },
-                responses=formated_responses,
-                examples=formated_examples,
-                auth=[{"jwtAuth": []}] if need_auth else False,
-                external_docs=external_docs,
-                deprecated=deprecated,
-                tags=tags,
+            formated_responses = build_openapi_responses(
+                responses_dict=schema_responses, handler_name=function.__name__
             )
-            @api_view(http_methods)
-            def wrap(request, *args, **kwargs):
-                if need_auth and not request.user.is_authenticated:
-                    return HttpResponse("Unauthorized", status=401)
-                if groups:
-                    if (
-                        not request.user.is_authenticated
-                        or not request.user.groups.filter(
-                            name__in=auth_group_names
-                        ).exists()
-                    ):
-                        user_groups = request.user.groups.all()
-                        groups_msg = f"""Вы находитесь в группах:
-                            {''.join([group.name for group in user_groups]) if user_groups.exists() else 'Анонимный юзер'}
-                        """
-                        return HttpResponse(
-                            f"У вас нет доступа {response_403} {groups_msg}", status=403
-                        )
-                return function(request, *args, **kwargs)
 
-        else:
-            # Сделано именно так, а не декоратором, потому что магическим образом именно так работает с drf.
-            # Если делать то же самое декоратором то ручка в сваггере не дополняется.
-            # Конечно можешь поэксперементировать, если сделаешь круче, с меня пиво.
-            decorator_args = {
+            schema_args = {
                 "summary": summary,
-                "description": description,
+                "description": schema_description,
                 "parameters": query_parameters,
                 "request": {
                     "application/json": inline_serializer(
@@ -290,41 +333,62 @@ def aboba_swagger(
                 "deprecated": deprecated,
                 "tags": tags,
             }
-            if not override_drf_autogen:
+            if is_drf and not override_drf_autogen:
                 # Если не надо переопределять все поля то убираем не указанные, чтоб оставить сгенеренные
                 if len(summary) == 0:
-                    decorator_args.pop("summary", None)
-                if len(description) == 0:
-                    decorator_args.pop("description", None)
+                    schema_args.pop("summary", None)
+                if len(description) == 0 and not need_auth:
+                    schema_args.pop("description", None)
                 if len(query_parameters) == 0:
-                    decorator_args.pop("parameters", None)
+                    schema_args.pop("parameters", None)
                 if len(body_params.keys()) == 0:
-                    decorator_args.pop("request", None)
+                    schema_args.pop("request", None)
                 if len(formated_responses.keys()) == 0:
-                    decorator_args.pop("responses", None)
+                    schema_args.pop("responses", None)
+            return schema_args
+
+        if not is_drf:
+
+            @wraps(function)
+            @api_view(http_methods)
+            def wrap(request, *args, **kwargs):
+                if need_auth and not request.user.is_authenticated:
+                    return HttpResponse("Unauthorized", status=401)
+                if groups:
+                    denied = check_groups(request, auth_group_names, response_403)
+                    if denied is not None:
+                        return denied
+                if validator is not None:
+                    params, errors = validator(request)
+                    if errors:
+                        return Response(
+                            {"errors": errors}, status=status.HTTP_400_BAD_REQUEST
+                        )
+                    kwargs = {**kwargs, **params}
+                return function(request, *args, **kwargs)
 
-            function = extend_schema(**decorator_args)(function)
+        else:
 
             @wraps(function)
             def wrap(self, request, *args, **kwargs):
                 if need_auth and not request.user.is_authenticated:
                     return HttpResponse("Unauthorized", status=401)
                 if groups:
-                    if (
-                        not request.user.is_authenticated
-                        or not request.user.groups.filter(
-                            name__in=auth_group_names
-                        ).exists()
-                    ):
-                        user_groups = request.user.groups.all()
-                        groups_msg = f"""Вы находитесь в группах:
-                            {''.join([group.name for group in user_groups]) if user_groups.exists() else 'Анонимный юзер'}
-                        """
-                        return HttpResponse(
-                            f"У вас нет доступа {response_403} {groups_msg}", status=403
+                    denied = check_groups(request, auth_group_names, response_403)
+                    if denied is not None:
+                        return denied
+                if validator is not None:
+                    params, errors = validator(request)
+                    if errors:
+                        return Response(
+                            {"errors": errors}, status=status.HTTP_400_BAD_REQUEST
                         )
+                    kwargs = {**kwargs, **params}
                 return function(self, request, *args, **kwargs)
 
+        # Для ViewSet extend_schema вешается на итоговый метод, после wraps:
+        # wraps копирует kwargs функции и затер бы схему, навешенную раньше
+        pending_schemas.append((wrap, build_schema_args))
         return wrap
 
     return decorator
@@ -492,7 +556,7 @@ def build_openapi_responses(responses_dict: dict, handler_name) -> dict:
                         # Если поле уже есть и типы разные, используем более гибкий тип
                         if key in merged_fields:
                             # Если типы разные, используем JSONField
-                            if type(val) != type(merged_fields[key]):
+                            if type(val) is not type(merged_fields[key]):
                                 merged_fields[key] = parse_value_to_field(
                                     None
                                 )  # Используем общий тип
@@ -0,0 +1,280 @@
+import math
+from collections.abc import Mapping
+
+from django.core.files.uploadedfile import UploadedFile
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty
+
+# Быстрая проверка запроса по query_params и body_params aboba_swagger
+# (validate=True). Объявления один раз компилируются в функции-конвертеры,
+# проверка запроса - проход по полям без создания сериализаторов DRF.
+# Уже созданные поля сериализаторов (serializers.ChoiceField(...) и т.п.)
+# проверяются своим run_validation.
+
+TRUE_VALUES = {"true", "1", "yes", "on"}
+FALSE_VALUES = {"false", "0", "no", "off"}
+REQUIRED_MESSAGE = "Обязательное поле."
+
+
+class Invalid(Exception):
+    """Ошибки проверки: {путь поля: [сообщения]}, "" - само поле"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def fail(message):
+    raise Invalid({"": [message]})
+
+
+def join_path(name, path):
+    return f"{name}.{path}" if path else str(name)
+
+
+def convert_str(value):
+    if not isinstance(value, str):
+        fail("Ожидается строка.")
+    return value
+
+
+def convert_int(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    fail("Ожидается целое число.")
+
+
+def convert_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = float(value)
+    elif isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            fail("Ожидается число.")
+    else:
+        fail("Ожидается число.")
+    if not math.isfinite(number):
+        fail("Ожидается число.")
+    return number
+
+
+def convert_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        lowered = value.lower()
+        if lowered in TRUE_VALUES:
+            return True
+        if lowered in FALSE_VALUES:
+            return False
+    fail("Ожидается true или false.")
+
+
+def convert_list(value):
+    if not isinstance(value, list):
+        fail("Ожидается список.")
+    return value
+
+
+def convert_dict(value):
+    if not isinstance(value, Mapping):
+        fail("Ожидается объект.")
+    return value
+
+
+def convert_file(value):
+    if not isinstance(value, UploadedFile):
+        fail("Ожидается файл.")
+    return value
+
+
+def convert_any(value):
+    return value
+
+
+def make_parsed_converter(parse, message):
+    def convert(value):
+        parsed = parse(value) if isinstance(value, str) else None
+        if parsed is None:
+            fail(message)
+        return parsed
+
+    return convert
+
+
+CONVERTERS = {
+    str: convert_str,
+    int: convert_int,
+    float: convert_float,
+    bool: convert_bool,
+    list: convert_list,
+    dict: convert_dict,
+    bytes: convert_file,
+    "str": convert_str,
+    "int": convert_int,
+    "float": convert_float,
+    "bool": convert_bool,
+    "list": convert_list,
+    "dict": convert_dict,
+    "bytes": convert_file,
+    "json": convert_any,
+    "date": make_parsed_converter(parse_date, "Ожидается дата."),
+    "time": make_parsed_converter(parse_time, "Ожидается время."),
+    "datetime": make_parsed_converter(parse_datetime, "Ожидаются дата и время."),
+}
+
+
+def compile_serializer_field(field):
+    def convert(value):
+        try:
+            return field.run_validation(value)
+        except serializers.ValidationError as error:
+            detail = error.detail
+            messages = detail if isinstance(detail, list) else [detail]
+            raise Invalid({"": [str(message) for message in messages]})
+
+    return convert
+
+
+def compile_list(declaration):
+    if not declaration or not all(
+        isinstance(item, type(declaration[0])) for item in declaration
+    ):
+        return convert_list
+    convert_item = compile_field(declaration[0])
+
+    def convert(value):
+        convert_list(value)
+        result = []
+        errors = {}
+        for index, item in enumerate(value):
+            try:
+                result.append(convert_item(item))
+            except Invalid as error:
+                for path, messages in error.errors.items():
+                    errors[join_path(index, path)] = messages
+        if errors:
+            raise Invalid(errors)
+        return result
+
+    return convert
+
+
+def compile_field(declaration):
+    """Конвертер значения по объявлению из body_params или query_params"""
+    if isinstance(declaration, serializers.Field):
+        return compile_serializer_field(declaration)
+    if isinstance(declaration, dict):
+        return compile_object(declaration)
+    if isinstance(declaration, list):
+        return compile_list(declaration)
+    if isinstance(declaration, (type, str)) and declaration in CONVERTERS:
+        return CONVERTERS[declaration]
+    return convert_any
+
+
+def get_missing_value(declaration, required):
+    """
+    Значение отсутствующего поля.
+
+    Raises:
+        Invalid: если поле обязательное.
+    """
+    if isinstance(declaration, serializers.Field):
+        if declaration.required:
+            fail(REQUIRED_MESSAGE)
+        try:
+            return declaration.get_default()
+        except SkipField:
+            return None
+    if required:
+        fail(REQUIRED_MESSAGE)
+    return None
+
+
+def compile_object(declarations, required=True, blank_is_missing=False):
+    """
+    Конвертер объекта: проверяет все поля и собирает все ошибки сразу.
+
+    Args:
+        required: обязательны ли поля, объявленные типом (поля сериализаторов
+            решают сами).
+        blank_is_missing: пустая строка считается отсутствием значения, так
+            ведут себя пустые поля HTML форм в query string.
+    """
+    fields = tuple(
+        (
+            name,
+            compile_field(declaration),
+            declaration,
+            # null поля сериализатора проверяет сам сериализатор (allow_null)
+            not isinstance(declaration, serializers.Field),
+        )
+        for name, declaration in declarations.items()
+    )
+
+    def convert(value):
+        convert_dict(value)
+        result = {}
+        errors = {}
+        for name, convert_value, declaration, null_is_missing in fields:
+            raw = value.get(name, empty)
+            try:
+                if (
+                    raw is empty
+                    or (raw is None and null_is_missing)
+                    or (blank_is_missing and raw == "")
+                ):
+                    result[name] = get_missing_value(declaration, required)
+                else:
+                    result[name] = convert_value(raw)
+            except Invalid as error:
+                for path, messages in error.errors.items():
+                    errors[join_path(name, path)] = messages
+        if errors:
+            raise Invalid(errors)
+        return result
+
+    return convert
+
+
+def compile_request_validator(query_params, body_params):
+    """
+    Returns:
+        Функция request -> (аргументы для ручки, ошибки или None). Параметры
+        запроса необязательны (отсутствующий - None), поля тела обязательны.
+    """
+    overlap = set(query_params) & set(body_params)
+    if overlap:
+        raise ValueError(f"Параметры и в query, и в body: {', '.join(overlap)}")
+    convert_query = (
+        compile_object(query_params, required=False, blank_is_missing=True)
+        if query_params
+        else None
+    )
+    convert_body = compile_object(body_params) if body_params else None
+
+    def validate(request):
+        params = {}
+        errors = {}
+        for convert, data in (
+            (convert_query, request.query_params),
+            (convert_body, convert_body and request.data),
+        ):
+            if convert is None:
+                continue
+            try:
+                params.update(convert(data))
+            except Invalid as error:
+                for path, messages in error.errors.items():
+                    errors[path or "non_field_errors"] = messages
+        return params, errors or None
+
+    return validate
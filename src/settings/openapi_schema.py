@@ -0,0 +1,187 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import django
+import drf_spectacular
+import rest_framework
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView
+
+# Готовая схема OpenAPI: manage.py build_openapi_schema рендерит ее один раз в
+# сжатые файлы openapi-<хеш кода>.<формат>.gz, а /openapi/ отдает их из памяти.
+# Хеш считается по исходникам проекта и версиям библиотек, поэтому после
+# изменения кода старый файл просто не найдется и схема соберется на лету.
+FORMATS = {
+    "yaml": OpenApiYamlRenderer,
+    "json": OpenApiJsonRenderer,
+}
+
+live_schema_view = SpectacularAPIView.as_view()
+
+_code_hash = None
+# {формат: SchemaArtifact}, отсутствующие файлы не кешируются
+_artifacts = {}
+_artifacts_lock = threading.Lock()
+
+
+class SchemaArtifact:
+    def __init__(self, compressed, content_type):
+        self.compressed = compressed
+        self.content_type = content_type
+        digest = hashlib.sha256(compressed).hexdigest()[:32]
+        # Сжатое и несжатое тело - разные представления, ETag у них разный
+        self.etag = quote_etag(digest)
+        self.compressed_etag = quote_etag(f"{digest}-gzip")
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = gzip.decompress(self.compressed)
+        return self._body
+
+
+def get_code_hash():
+    """Хеш исходников проекта, версий библиотек и настроек drf-spectacular"""
+    global _code_hash
+    if _code_hash is None:
+        digest = hashlib.sha256()
+        for version in (
+            django.__version__,
+            rest_framework.__version__,
+            drf_spectacular.__version__,
+        ):
+            digest.update(version.encode())
+        digest.update(repr(sorted(settings.SPECTACULAR_SETTINGS.items())).encode())
+        for path in sorted(Path(settings.BASE_DIR).rglob("*.py")):
+            # Миграции и тесты на схему не влияют
+            if "migrations" in path.parts or path.name == "tests.py":
+                continue
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+        _code_hash = digest.hexdigest()[:16]
+    return _code_hash
+
+
+def artifact_name(schema_format):
+    return f"openapi-{get_code_hash()}.{schema_format}.gz"
+
+
+def artifact_path(schema_format):
+    return Path(settings.OPENAPI_SCHEMA_DIR) / artifact_name(schema_format)
+
+
+def write_artifacts(schema, directory):
+    """
+    Рендерит схему во все форматы и атомарно пишет сжатые файлы.
+
+    Returns:
+        Список записанных путей.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for schema_format, renderer_class in FORMATS.items():
+        content = renderer_class().render(schema, renderer_context={})
+        path = Path(directory) / artifact_name(schema_format)
+        fd, temp_path = tempfile.mkstemp(prefix=".openapi-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                # mtime=0: одинаковая схема дает побайтно одинаковый файл
+                file.write(gzip.compress(content, compresslevel=9, mtime=0))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        paths.append(path)
+    return paths
+
+
+def load_artifact(schema_format):
+    artifact = _artifacts.get(schema_format)
+    if artifact is not None:
+        return artifact
+    with _artifacts_lock:
+        if schema_format not in _artifacts:
+            try:
+                compressed = artifact_path(schema_format).read_bytes()
+            except FileNotFoundError:
+                return None
+            renderer = FORMATS[schema_format]
+            content_type = renderer.media_type
+            if renderer.charset:
+                content_type += f"; charset={renderer.charset}"
+            _artifacts[schema_format] = SchemaArtifact(compressed, content_type)
+        return _artifacts[schema_format]
+
+
+def clear_artifacts():
+    global _code_hash
+    with _artifacts_lock:
+        _artifacts.clear()
+        _code_hash = None
+
+
+def get_schema_format(request):
+    """Формат как у SpectacularAPIView: ?format= или Accept, по умолчанию yaml"""
+    schema_format = request.GET.get("format")
+    if schema_format:
+        return schema_format
+    return "json" if "json" in request.headers.get("Accept", "") else "yaml"
+
+
+def openapi_schema(request):
+    """
+    Схема OpenAPI из готового файла со строгим ETag и ответом 304. Если файла
+    для текущего кода нет или запрошено то, чего в файле нет (язык, версия
+    API), схема генерируется как раньше.
+    """
+    schema_format = get_schema_format(request)
+    only_format = set(request.GET.keys()) <= {"format"}
+    artifact = (
+        load_artifact(schema_format)
+        if request.method in ("GET", "HEAD")
+        and only_format
+        and schema_format in FORMATS
+        else None
+    )
+    if artifact is None:
+        return live_schema_view(request)
+
+    accepts_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = artifact.compressed_etag if accepts_gzip else artifact.etag
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        # Для If-None-Match сравнение слабое: W/"x" совпадает с "x"
+        if "*" in etags or etag in [tag.removeprefix("W/") for tag in etags]:
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+            return response
+
+    response = HttpResponse(
+        artifact.compressed if accepts_gzip else artifact.body,
+        content_type=artifact.content_type,
+    )
+    if accepts_gzip:
+        response["Content-Encoding"] = "gzip"
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+    return response
+
+
+def render_schema():
+    """Полная генерация схемы, как в manage.py spectacular"""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=True)
@@ -34,6 +34,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "drf_spectacular",
     "rest_framework_simplejwt",
     "corsheaders",
@@ -161,6 +162,11 @@ STATIC_URL = "static/"
 MEDIA_ROOT = BASE_DIR.parent / os.getenv("MEDIA_PATH", "public/mediafiles/")
 MEDIA_URL = "/media/"
 
+# Готовая схема OpenAPI (manage.py build_openapi_schema), /openapi/ отдает ее из памяти
+OPENAPI_SCHEMA_DIR = BASE_DIR.parent / os.getenv(
+    "OPENAPI_SCHEMA_PATH", "public/openapi/"
+)
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 TOKEN_SETTINGS = {
@@ -174,6 +180,37 @@ TOKEN_SETTINGS = {
     "ACCESS_COOKIE_HTTP_ONLY": True,  # Changed to True for security
     "ACCESS_COOKIE_SECURE": not DEBUG,  # Secure in production
     "ACCESS_COOKIE_SAMESITE": "Lax",  # Added SameSite policy
+    # Токены старого формата (Argon2) принимаются до истечения их полного срока жизни,
+    # после TOTAL_ACCESS_TOKEN_LIFETIME с момента обновления можно выключить
+    "ACCEPT_LEGACY_TOKENS": bool(int(os.getenv("ACCEPT_LEGACY_TOKENS", "1"))),
+    # Кеш токен -> пользователь в памяти процесса перед Redis
+    "CACHE_LOCAL_SIZE": int(os.getenv("TOKEN_CACHE_LOCAL_SIZE", "1024")),
+    "CACHE_LOCAL_TTL": timedelta(
+        seconds=int(os.getenv("TOKEN_CACHE_LOCAL_TTL_SECONDS", "5"))
+    ),
+}
+
+# Сколько секунд хранятся в Redis имена групп пользователя для проверок groups=
+GROUP_CACHE_TIMEOUT = int(os.getenv("GROUP_CACHE_TIMEOUT", "300"))
+
+# Префиксы путей, для которых CustomAuthenticationMiddleware не обрабатывает токен
+AUTH_SKIP_PATHS = [
+    "/healthcheck/",
+    f"/{STATIC_URL}",
+    MEDIA_URL,
+    "/openapi/",
+    "/swagger/",
+]
+
+# Режим токенов: "opaque" - случайный токен, пользователь ищется по token_hash,
+# "signed" - подписанный JWT с id пользователя, проверяется без запросов к базе
+AUTH_TOKEN_MODE = os.getenv("AUTH_TOKEN_MODE", "opaque")
+
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": TOKEN_SETTINGS["TOTAL_ACCESS_TOKEN_LIFETIME"],
+    "ALGORITHM": "HS256",
+    "SIGNING_KEY": SECRET_KEY,
+    "UPDATE_LAST_LOGIN": False,
 }
 
 REST_FRAMEWORK = {
@@ -189,6 +226,14 @@ REST_FRAMEWORK = {
         "anon": "60/min",
         "user": "60/min",
     },
+    # Перед приложением один nginx, он подставляет адрес клиента в
+    # X-Forwarded-For. Без этого DRF берет адрес из заголовка клиента как есть
+    "NUM_PROXIES": 1,
+}
+
+SPECTACULAR_SETTINGS = {
+    # Схемы ручек с aboba_swagger строятся при первой генерации, а не при импорте
+    "PREPROCESSING_HOOKS": ["settings.aboba_swagger.build_pending_schemas"],
 }
 
 # Prioritize Argon2 as it's more secure
@@ -260,6 +305,50 @@ BEARER_AUTH = bool(int(os.getenv("BEARER_AUTH", "1")))
 COOKIE_AUTH = bool(int(os.getenv("COOKIE_AUTH", "0")))
 BACKUPS = bool(int(os.getenv("BACKUPS", "0")))
 
+# Поиск объявлений: "fts" - полнотекстовый поиск PostgreSQL,
+# "trigram" - нечеткий поиск по триграммам (pg_trgm), "icontains" - поиск по подстроке
+AD_SEARCH_BACKEND = os.getenv("AD_SEARCH_BACKEND", "fts")
+# Порог word_similarity для триграммного поиска, можно переопределить параметром similarity
+AD_SEARCH_TRIGRAM_THRESHOLD = float(os.getenv("AD_SEARCH_TRIGRAM_THRESHOLD", "0.3"))
+# Время жизни закешированной ленты объявлений для анонимов в секундах, 0 - кеш выключен
+AD_LIST_CACHE_TIMEOUT = int(os.getenv("AD_LIST_CACHE_TIMEOUT", "300"))
+# Максимальная длина цикла обмена (число объявлений) при поиске многосторонних обменов
+EXCHANGE_CYCLE_MAX_LENGTH = int(os.getenv("EXCHANGE_CYCLE_MAX_LENGTH", "5"))
+# Искать цикл для нового предложения фоновым воркером match_new_proposals,
+# иначе только периодическим пересчетом
+EXCHANGE_CYCLE_INCREMENTAL = bool(int(os.getenv("EXCHANGE_CYCLE_INCREMENTAL", "1")))
+# Максимальное число предложений в одном запросе массового создания
+PROPOSAL_BULK_MAX_ITEMS = int(os.getenv("PROPOSAL_BULK_MAX_ITEMS", "50"))
+# Варианты изображений объявлений: имя - наибольшая сторона в пикселях,
+# качество WebP/JPEG и пауза воркера перед поиском необработанных объявлений
+AD_IMAGE_VARIANTS = {"card": 480, "detail": 1280, "original": 2560}
+AD_IMAGE_QUALITY = int(os.getenv("AD_IMAGE_QUALITY", "82"))
+AD_IMAGE_WORKER_IDLE_SECONDS = int(os.getenv("AD_IMAGE_WORKER_IDLE_SECONDS", "60"))
+# Сколько часов неиспользуемый файл изображения хранится до удаления sweep_ad_images
+AD_IMAGE_SWEEP_GRACE_HOURS = int(os.getenv("AD_IMAGE_SWEEP_GRACE_HOURS", "24"))
+# Загрузка изображения объявления через API: наибольший размер файла в байтах
+# и число пикселей, проверяются по мере чтения тела запроса
+AD_IMAGE_MAX_UPLOAD_SIZE = int(os.getenv("AD_IMAGE_MAX_UPLOAD_SIZE", "10485760"))
+AD_IMAGE_MAX_PIXELS = int(os.getenv("AD_IMAGE_MAX_PIXELS", "40000000"))
+# Загрузки больше этого размера в байтах пишутся во временный файл, а не в память
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv("FILE_UPLOAD_MAX_MEMORY_SIZE", "1048576"))
+# SSE-события предложений: Redis для pub/sub и истории, число и время хранения
+# событий истории для переподключения, интервал heartbeat и пауза переподключения
+PROPOSAL_EVENTS_REDIS_URL = CACHES["default"]["LOCATION"]
+PROPOSAL_EVENTS_HISTORY = int(os.getenv("PROPOSAL_EVENTS_HISTORY", "100"))
+PROPOSAL_EVENTS_HISTORY_TTL = int(os.getenv("PROPOSAL_EVENTS_HISTORY_TTL", "86400"))
+PROPOSAL_EVENTS_HEARTBEAT_SECONDS = float(
+    os.getenv("PROPOSAL_EVENTS_HEARTBEAT_SECONDS", "15")
+)
+PROPOSAL_EVENTS_RETRY_MS = int(os.getenv("PROPOSAL_EVENTS_RETRY_MS", "3000"))
+# Прием ошибок фронта в /log_error/: лимиты на IP и на всех за окно в секундах,
+# наибольшее число разных ошибок в буфере Redis и интервал записи буфера в базу
+ERROR_LOG_RATE_PER_IP = int(os.getenv("ERROR_LOG_RATE_PER_IP", "20"))
+ERROR_LOG_RATE_GLOBAL = int(os.getenv("ERROR_LOG_RATE_GLOBAL", "2000"))
+ERROR_LOG_RATE_WINDOW_SECONDS = int(os.getenv("ERROR_LOG_RATE_WINDOW_SECONDS", "60"))
+ERROR_LOG_MAX_PENDING = int(os.getenv("ERROR_LOG_MAX_PENDING", "10000"))
+ERROR_LOG_FLUSH_SECONDS = float(os.getenv("ERROR_LOG_FLUSH_SECONDS", "10"))
+
 # SESSION settings for improved security
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = not DEBUG
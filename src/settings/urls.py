@@ -2,8 +2,9 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from drf_spectacular.views import SpectacularSwaggerView
 
+from .openapi_schema import openapi_schema
 from .views import healthcheck, log_error
 
 # Configure error handlers
@@ -13,7 +14,7 @@ handler500 = "settings.views.handle_500"
 urlpatterns = [
     path("admin/defender/", include("defender.urls")),
     path("admin/", admin.site.urls),
-    path("openapi/", SpectacularAPIView.as_view(), name="schema"),
+    path("openapi/", openapi_schema, name="schema"),
     path(
         "swagger/",
         SpectacularSwaggerView.as_view(url_name="schema"),
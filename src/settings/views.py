@@ -1,10 +1,16 @@
-import json
+import logging
 
 from django.http import HttpResponse, JsonResponse
+from redis import RedisError
+from rest_framework import status
+from rest_framework.response import Response
 
 from settings.aboba_swagger import aboba_swagger
+from user.error_log import ACCEPTED, ingest_error
 from user.models import ErrorLog
 
+logger = logging.getLogger(__name__)
+
 
 def healthcheck(request):
     return HttpResponse(status=200)
@@ -13,15 +19,38 @@ def healthcheck(request):
 @aboba_swagger(
     http_methods=["POST"],
     summary="Ручка для логов ошибок с фронта и не только, можешь хоть с бэкендерами общаться через нее",
-    description="Ограничение в 2048 симоволов",
+    description=(
+        "Ограничение в 2048 символов. Одинаковые ошибки складываются в одну "
+        "запись со счетчиком и пишутся в базу раз в несколько секунд. Сверх "
+        "лимитов на IP и общего ответ 429 с Retry-After"
+    ),
     tags=["logs"],
     body_params={"description": str},
-    responses={200: "Успех"},
+    responses={202: "Принято", 429: "Слишком много ошибок, повторите позже"},
+    validate=True,
 )
-def log_error(request):
-    body = json.loads(request.body.decode("utf-8"))
-    ErrorLog.objects.create(description=body["description"])
-    return HttpResponse(status=200)
+def log_error(request, description):
+    # Длина проверяется здесь: CharField сериализатора принял бы и число
+    if len(description) > ErrorLog.MAX_LENGTH:
+        return Response(
+            {
+                "errors": {
+                    "description": [
+                        f"Убедитесь, что это значение содержит не более {ErrorLog.MAX_LENGTH} символов."
+                    ]
+                }
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        result, retry_after = ingest_error(request, description)
+    except RedisError:
+        logger.warning("Error log buffer is unavailable", exc_info=True)
+        return HttpResponse(status=503, headers={"Retry-After": "60"})
+    if result != ACCEPTED:
+        # Клиент не должен повторять ошибку до конца окна лимита
+        return HttpResponse(status=429, headers={"Retry-After": str(retry_after)})
+    return HttpResponse(status=202)
 
 
 def handle_404(request, exception=None):
@@ -67,8 +67,8 @@ class AccessGroupAdmin(admin.ModelAdmin):
 
 
 class ErrorLogAdmin(admin.ModelAdmin):
-    list_display = ["description", "created_at"]
-    readonly_fields = ["description", "created_at"]
+    list_display = ["description", "count", "created_at", "last_seen_at"]
+    readonly_fields = ["description", "count", "created_at", "last_seen_at"]
 
 
 admin.site.register(ErrorLog, ErrorLogAdmin)
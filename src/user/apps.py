@@ -1,7 +1,14 @@
 from django.apps import AppConfig
+from django.core.checks import Tags, register
 
 
 class UserConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "user"
     verbose_name = "Наши кастомные пользователи"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .checks import check_aboba_groups
+
+        register(check_aboba_groups, Tags.database)
@@ -1,7 +1,19 @@
+import hmac
+import secrets
 import sys
+from functools import lru_cache
 
 import _frozen_importlib as _bootstrap
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+
+# Формат токена: "<версия>.<случайная часть>.<HMAC-SHA256 подпись случайной части>".
+# Подпись проверяется до обращения к кешу и базе, поэтому подделанные и
+# случайные токены отбрасываются без запросов.
+TOKEN_VERSION = "t1"
+TOKEN_SALT = "user.auth_utils.token"
 
 
 def get_client_ip(request):
@@ -14,9 +26,41 @@ def get_client_ip(request):
 
 
 def create_token(ip, brow):
-    _str = ip + brow
-    token = make_hash(_str)
-    return token
+    """
+    Новый токен из secrets и HMAC-SHA256 на SECRET_KEY.
+    ip и brow не участвуют: случайная часть не должна быть предсказуемой,
+    аргументы оставлены для совместимости вызовов.
+    """
+    payload = secrets.token_urlsafe(32)
+    return f"{TOKEN_VERSION}.{payload}.{sign_token_payload(payload)}"
+
+
+def create_legacy_token(ip, brow):
+    """Старый формат токена - хеш первого из PASSWORD_HASHERS (Argon2)"""
+    return make_hash(ip + brow)
+
+
+def sign_token_payload(payload):
+    return salted_hmac(TOKEN_SALT, payload, algorithm="sha256").hexdigest()
+
+
+def is_legacy_token(token):
+    # Токены старого формата - строки хешеров Django вида "argon2$..."
+    return "$" in token
+
+
+def verify_token(token):
+    """
+    Проверка токена без обращения к базе и хешерам паролей.
+    Токены старого формата принимаются, пока включен TOKEN_SETTINGS["ACCEPT_LEGACY_TOKENS"].
+    """
+    if is_legacy_token(token):
+        return settings.TOKEN_SETTINGS.get("ACCEPT_LEGACY_TOKENS")
+    version, _, rest = token.partition(".")
+    payload, _, signature = rest.partition(".")
+    if version != TOKEN_VERSION or not payload or not signature:
+        return False
+    return hmac.compare_digest(signature, sign_token_payload(payload))
 
 
 def make_hash(password, salt=None, hasher="default"):
@@ -42,6 +86,7 @@ def get_hasher(algorithm="default"):
             )
 
 
+@lru_cache
 def get_hashers():
     hashers = []
     for hasher_path in settings.PASSWORD_HASHERS:
@@ -92,10 +137,18 @@ def import_module(name, package=None):
     return _bootstrap._gcd_import(name[level:], package, level)
 
 
+@lru_cache
 def get_hashers_by_algorithm():
     return {hasher.algorithm: hasher for hasher in get_hashers()}
 
 
+@receiver(setting_changed)
+def reset_hashers(*, setting, **kwargs):
+    if setting == "PASSWORD_HASHERS":
+        get_hashers.cache_clear()
+        get_hashers_by_algorithm.cache_clear()
+
+
 def identify_hasher(encoded):
     if (len(encoded) == 32 and "$" not in encoded) or (
         len(encoded) == 37 and encoded.startswith("md5$$")
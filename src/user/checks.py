@@ -0,0 +1,37 @@
+from django.core.checks import Warning
+from django.db import DatabaseError
+from django.urls import get_resolver
+
+from .models import AccessGroup
+
+
+def check_aboba_groups(app_configs=None, databases=None, **kwargs):
+    """
+    Группы из groups= в aboba_swagger должны существовать, иначе ручка
+    недоступна никому. Раньше это проверялось при импорте ручек запросом на
+    каждую группу, теперь - одним запросом в check --database и migrate.
+    """
+    if not databases:
+        return []
+    from settings.aboba_swagger import declared_groups
+
+    # Декораторы регистрируют группы при импорте ручек
+    get_resolver().url_patterns
+    if not declared_groups:
+        return []
+    try:
+        existing = set(AccessGroup.objects.values_list("name", flat=True))
+    except DatabaseError:
+        # Таблицы еще не созданы: первый migrate
+        return []
+
+    return [
+        Warning(
+            f"Нет группы {group}",
+            hint="Создайте группу в админке или миграцией данных",
+            obj=view_name,
+            id="user.W001",
+        )
+        for view_name, groups in declared_groups
+        for group in sorted(groups - existing)
+    ]
@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django_redis import get_redis_connection
+from rest_framework.throttling import BaseThrottle
+
+from .models import ErrorLog
+
+logger = logging.getLogger(__name__)
+
+# Ошибки фронта не пишутся в базу на каждый запрос. Запрос одним Lua-скриптом
+# проверяет лимиты и увеличивает счетчик ошибки в буфере Redis: хеши
+# {отпечаток: число}, {отпечаток: описание}, {отпечаток: время последнего}.
+# Ошибка, повторяющаяся в цикле у тысяч клиентов, занимает одно поле буфера.
+# Команда flush_error_logs раз в ERROR_LOG_FLUSH_SECONDS переносит буфер в
+# ErrorLog: новые отпечатки - bulk_create, известные - один UPDATE счетчиков.
+KEY_PREFIX = "user:error_log"
+PENDING_KEYS = [f"{KEY_PREFIX}:{name}" for name in ("counts", "texts", "seen")]
+FLUSHING_KEYS = [
+    f"{KEY_PREFIX}:flushing:{name}" for name in ("counts", "texts", "seen")
+]
+
+ACCEPTED, IP_LIMITED, GLOBAL_LIMITED, BUFFER_FULL = range(4)
+
+INGEST_SCRIPT = """
+local ip_count = redis.call('INCR', KEYS[1])
+if ip_count == 1 then redis.call('EXPIRE', KEYS[1], ARGV[3]) end
+if ip_count > tonumber(ARGV[1]) then return 1 end
+local global_count = redis.call('INCR', KEYS[2])
+if global_count == 1 then redis.call('EXPIRE', KEYS[2], ARGV[3]) end
+if global_count > tonumber(ARGV[2]) then return 2 end
+if redis.call('HEXISTS', KEYS[3], ARGV[5]) == 0 then
+    if redis.call('HLEN', KEYS[3]) >= tonumber(ARGV[4]) then return 3 end
+    redis.call('HSET', KEYS[4], ARGV[5], ARGV[6])
+end
+redis.call('HINCRBY', KEYS[3], ARGV[5], 1)
+redis.call('HSET', KEYS[5], ARGV[5], ARGV[7])
+return 0
+"""
+
+# Буфер переименовывается целиком: новые ошибки копятся в новых ключах, пока
+# старые пишутся в базу. Оставшийся после сбоя буфер дописывается первым
+TAKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[4]) == 1 then return 1 end
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+for i = 1, 3 do redis.call('RENAME', KEYS[i], KEYS[i + 3]) end
+return 1
+"""
+
+
+def get_fingerprint(description):
+    """sha256 описания без учета различий в пробелах"""
+    return hashlib.sha256(" ".join(description.split()).encode()).hexdigest()
+
+
+def get_window_retry_after(now):
+    window = settings.ERROR_LOG_RATE_WINDOW_SECONDS
+    return max(1, int(window - now % window))
+
+
+def ingest_error(request, description):
+    """
+    Кладет ошибку в буфер, если не превышены лимиты.
+
+    Returns:
+        Пара (ACCEPTED или причина отказа, секунд до конца окна лимита).
+    """
+    now = time.time()
+    window = settings.ERROR_LOG_RATE_WINDOW_SECONDS
+    window_id = int(now // window)
+    ip = BaseThrottle().get_ident(request)
+    redis = get_redis_connection("default")
+    result = redis.register_script(INGEST_SCRIPT)(
+        keys=[
+            f"{KEY_PREFIX}:rate:ip:{ip}:{window_id}",
+            f"{KEY_PREFIX}:rate:global:{window_id}",
+            *PENDING_KEYS,
+        ],
+        args=[
+            settings.ERROR_LOG_RATE_PER_IP,
+            settings.ERROR_LOG_RATE_GLOBAL,
+            window,
+            settings.ERROR_LOG_MAX_PENDING,
+            get_fingerprint(description),
+            description,
+            now,
+        ],
+    )
+    return int(result), get_window_retry_after(now)
+
+
+def save_error_logs(counts, texts, seen):
+    """
+    Переносит накопленные ошибки в ErrorLog.
+
+    Args:
+        counts: {отпечаток: число повторов}.
+        texts: {отпечаток: описание}.
+        seen: {отпечаток: unix-время последнего появления}.
+    """
+    if not counts:
+        return
+    seen = {
+        fingerprint: datetime.fromtimestamp(float(value), tz=timezone.utc)
+        for fingerprint, value in seen.items()
+    }
+    with transaction.atomic():
+        existing = set(
+            ErrorLog.objects.filter(fingerprint__in=counts)
+            .select_for_update()
+            .values_list("fingerprint", flat=True)
+        )
+        if existing:
+            ErrorLog.objects.filter(fingerprint__in=existing).update(
+                count=F("count")
+                + Case(
+                    *[
+                        When(fingerprint=fingerprint, then=Value(counts[fingerprint]))
+                        for fingerprint in existing
+                    ],
+                    output_field=PositiveIntegerField(),
+                ),
+                last_seen_at=Case(
+                    *[
+                        When(fingerprint=fingerprint, then=Value(seen[fingerprint]))
+                        for fingerprint in existing
+                    ]
+                ),
+            )
+        ErrorLog.objects.bulk_create(
+            [
+                ErrorLog(
+                    fingerprint=fingerprint,
+                    description=texts[fingerprint],
+                    count=count,
+                    last_seen_at=seen[fingerprint],
+                )
+                for fingerprint, count in counts.items()
+                if fingerprint not in existing
+            ],
+            batch_size=500,
+        )
+
+
+def flush_error_logs():
+    """
+    Записывает буфер ошибок в базу. Буфер удаляется после коммита: при сбое
+    между ними счетчики будут записаны повторно.
+
+    Returns:
+        Количество записанных разных ошибок.
+    """
+    redis = get_redis_connection("default")
+    if not redis.register_script(TAKE_SCRIPT)(keys=[*PENDING_KEYS, *FLUSHING_KEYS]):
+        return 0
+
+    pipe = redis.pipeline(transaction=False)
+    for key in FLUSHING_KEYS:
+        pipe.hgetall(key)
+    counts, texts, seen = (
+        {key.decode(): value.decode() for key, value in values.items()}
+        for values in pipe.execute()
+    )
+    save_error_logs(
+        {fingerprint: int(count) for fingerprint, count in counts.items()},
+        texts,
+        seen,
+    )
+    redis.delete(*FLUSHING_KEYS)
+    return len(counts)
+
+
+def run_flusher(interval=None, once=False):
+    """
+    Записывает буфер в базу каждые interval секунд.
+
+    Returns:
+        Количество записанных разных ошибок при once=True.
+    """
+    interval = interval or settings.ERROR_LOG_FLUSH_SECONDS
+    while True:
+        started = time.monotonic()
+        try:
+            flushed = flush_error_logs()
+        except Exception:
+            if once:
+                raise
+            logger.exception("Error log flush failed")
+            flushed = 0
+        if once:
+            return flushed
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
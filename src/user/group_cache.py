@@ -0,0 +1,99 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CustomUser
+
+# Кеш имен групп пользователя для проверки groups= в aboba_swagger. Запись
+# хранит штамп версии групп и поколение пользователя: изменение самих групп
+# (переименование, удаление) меняет штамп и разом устаревает все записи, а
+# изменение состава групп пользователя (m2m_changed) увеличивает его поколение.
+# Штампы читаются до запроса к базе, поэтому запись со старым составом,
+# записанная параллельным запросом уже после изменения, остается промахом.
+# Внутри запроса имена берутся из атрибута запроса без обращения к Redis.
+KEY_PREFIX = "user:groups"
+VERSION_KEY = f"{KEY_PREFIX}:version"
+REQUEST_ATTRIBUTE = "_aboba_group_names"
+
+
+def _user_key(user_id):
+    return f"{KEY_PREFIX}:{user_id}"
+
+
+def _generation_key(user_id):
+    return f"{KEY_PREFIX}:generation:{user_id}"
+
+
+def _get_stamp(key):
+    stamp = cache.get(key)
+    if stamp is None:
+        # Штамп вытеснен из Redis: новый штамп устаревает все записи
+        cache.add(key, time.time_ns(), None)
+        stamp = cache.get(key)
+    return stamp
+
+
+def _load_group_names(user_id):
+    return frozenset(
+        CustomUser.groups.through.objects.filter(customuser_id=user_id).values_list(
+            "group__name", flat=True
+        )
+    )
+
+
+def get_group_names(user_id):
+    """Имена групп пользователя: штампы и запись читаются из Redis одним запросом"""
+    keys = [VERSION_KEY, _generation_key(user_id), _user_key(user_id)]
+    values = cache.get_many(keys)
+    version, generation, entry = (values.get(key) for key in keys)
+    if (
+        version is not None
+        and generation is not None
+        and entry is not None
+        and entry[:2] == (version, generation)
+    ):
+        return entry[2]
+
+    version = version if version is not None else _get_stamp(VERSION_KEY)
+    if generation is None:
+        generation = _get_stamp(_generation_key(user_id))
+    names = _load_group_names(user_id)
+    cache.set(
+        _user_key(user_id), (version, generation, names), settings.GROUP_CACHE_TIMEOUT
+    )
+    return names
+
+
+def get_request_group_names(request):
+    """Имена групп пользователя запроса, загружаются один раз за запрос"""
+    request = getattr(request, "_request", request)
+    names = getattr(request, REQUEST_ATTRIBUTE, None)
+    if names is None:
+        user = request.user
+        names = get_group_names(user.pk) if user.is_authenticated else frozenset()
+        setattr(request, REQUEST_ATTRIBUTE, names)
+    return names
+
+
+def _bump_generations(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Поколения нет в Redis: новый штамп устаревает все записи пользователя
+            cache.add(key, time.time_ns(), None)
+
+
+def invalidate_users(user_ids):
+    # После коммита, иначе параллельный запрос закеширует старый состав групп
+    # с уже новым поколением
+    keys = [_generation_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(partial(_bump_generations, keys))
+
+
+def bump_version():
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), None))
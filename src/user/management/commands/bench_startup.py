@@ -0,0 +1,104 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Выполняется в отдельном процессе: импорт должен быть холодным, как у
+# только что запущенного воркера gunicorn
+STARTUP_SCRIPT = """
+import json
+import sys
+import time
+from importlib import import_module
+
+started = time.perf_counter()
+import django
+
+django.setup()
+setup_done = time.perf_counter()
+
+from django.conf import settings
+from django.db import connections
+
+queries = []
+
+
+def count_query(execute, sql, params, many, context):
+    queries.append(sql)
+    return execute(sql, params, many, context)
+
+
+connections["default"].execute_wrappers.append(count_query)
+import_module(settings.ROOT_URLCONF)
+urls_done = time.perf_counter()
+
+from settings.aboba_swagger import build_pending_schemas, pending_schemas
+
+views = len(pending_schemas)
+build_pending_schemas(endpoints=[])
+schema_done = time.perf_counter()
+
+json.dump(
+    {
+        "setup": setup_done - started,
+        "urls": urls_done - setup_done,
+        "schema": schema_done - urls_done,
+        "queries": len(queries),
+        "views": views,
+    },
+    sys.stdout,
+)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет запуск процесса: django.setup() и импорт URLconf, а также "
+        "отложенное построение схем ручек aboba_swagger"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=5,
+            help="Количество запусков процесса",
+        )
+
+    def handle(self, *args, **options):
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", "settings.settings"
+            ),
+        }
+        runs = []
+        for _ in range(options["iterations"]):
+            result = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            runs.append(json.loads(result.stdout))
+
+        for stage, name in (
+            ("setup", "django.setup()"),
+            ("urls", "импорт URLconf"),
+            ("schema", "схемы aboba_swagger"),
+        ):
+            timings = [run[stage] * 1000 for run in runs]
+            self.stdout.write(
+                f"{name:<24} медиана {statistics.median(timings):>8.1f} мс, "
+                f"мин {min(timings):>8.1f} мс"
+            )
+        self.stdout.write(
+            f"ручек с отложенной схемой: {runs[0]['views']}, "
+            f"запросов к базе при импорте URLconf: {runs[0]['queries']}"
+        )
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user.auth_utils import create_legacy_token, create_token, get_hashers, verify_token
+
+
+class Command(BaseCommand):
+    help = "Сравнивает стоимость выпуска и проверки токенов старого (Argon2) и нового (HMAC) формата"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=50,
+            help="Количество повторов каждой операции",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        ip, brow = "127.0.0.1", "timestamp2024-01-01user_id1"
+        legacy_token = create_legacy_token(ip, brow)
+        token = create_token(ip, brow)
+
+        results = [
+            ("mint legacy (argon2)", lambda: create_legacy_token(ip, brow)),
+            ("mint hmac", lambda: create_token(ip, brow)),
+            # Старый токен подписи не содержит, проверить его можно только поиском в базе
+            ("verify legacy (format only)", lambda: verify_token(legacy_token)),
+            ("verify hmac", lambda: verify_token(token)),
+            ("get_hashers uncached", get_hashers.__wrapped__),
+            ("get_hashers cached", get_hashers),
+        ]
+        for name, func in results:
+            elapsed = self.measure(func, iterations)
+            self.stdout.write(
+                f"{name:<32} {elapsed / iterations * 1_000_000:>12.1f} мкс/операция"
+            )
+
+    @staticmethod
+    def measure(func, iterations):
+        func()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return time.perf_counter() - start
@@ -0,0 +1,61 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from settings.openapi_schema import (
+    FORMATS,
+    artifact_name,
+    get_code_hash,
+    render_schema,
+    write_artifacts,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Рендерит схему OpenAPI в сжатые файлы с хешем кода в имени, "
+        "/openapi/ отдает их без генерации схемы"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            type=Path,
+            default=settings.OPENAPI_SCHEMA_DIR,
+            help="Каталог для файлов схемы",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только проверить, что схема для текущего кода собрана",
+        )
+        parser.add_argument(
+            "--keep-stale",
+            action="store_true",
+            help="Не удалять файлы схемы для прошлых версий кода",
+        )
+
+    def handle(self, *args, **options):
+        directory = options["output"]
+        names = {artifact_name(schema_format) for schema_format in FORMATS}
+        if options["check"]:
+            missing = sorted(name for name in names if not (directory / name).exists())
+            if missing:
+                raise CommandError(f"Нет файлов схемы: {', '.join(missing)}")
+            self.stdout.write(f"Схема для кода {get_code_hash()} собрана")
+            return
+
+        started = time.perf_counter()
+        schema = render_schema()
+        paths = write_artifacts(schema, directory)
+        elapsed = time.perf_counter() - started
+        for path in paths:
+            self.stdout.write(f"{path} ({path.stat().st_size / 1024:.1f} КБ)")
+        self.stdout.write(f"Схема собрана за {elapsed:.2f} с")
+
+        if not options["keep_stale"]:
+            for path in directory.glob("openapi-*.gz"):
+                if path.name not in names:
+                    path.unlink(missing_ok=True)
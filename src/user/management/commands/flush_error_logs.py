@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from user.error_log import run_flusher
+
+
+class Command(BaseCommand):
+    help = "Переносит буфер ошибок фронта из Redis в ErrorLog"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Записать буфер один раз и завершиться",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Секунд между записями буфера",
+        )
+
+    def handle(self, *args, **options):
+        flushed = run_flusher(interval=options["interval"], once=options["once"])
+        if options["once"]:
+            self.stdout.write(self.style.SUCCESS(f"Записано ошибок: {flushed}"))
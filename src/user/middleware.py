@@ -4,13 +4,23 @@ from datetime import datetime
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
 from user.models import CustomUser
 
-from .auth_utils import create_token, get_client_ip
+from .auth_utils import create_token, get_client_ip, verify_token
+from .signed_tokens import (
+    AUTH_TOKEN_MODE_SIGNED,
+    get_user_by_signed_token,
+    issue_signed_token,
+)
+from .token_cache import get_cached_user, set_token_entry
 
 
 def create_token_obj(request, user):
+    if settings.AUTH_TOKEN_MODE == AUTH_TOKEN_MODE_SIGNED:
+        return issue_signed_token(user.pk, user.token_generation)
+
     request_ip = get_client_ip(request)
     timestamp = str(timezone.now())
 
@@ -31,7 +41,8 @@ def set_token_in_response(response, token):
             + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME"),
             httponly=settings.TOKEN_SETTINGS.get("ACCESS_COOKIE_HTTP_ONLY"),
         )
-    if settings.BEARER_AUTH:
+    # В потоковый ответ токен в теле не добавить, клиент обновит его следующим запросом
+    if settings.BEARER_AUTH and not response.streaming:
         body = json.loads(response.content.decode("utf-8"))
         body[settings.TOKEN_SETTINGS.get("NAME")] = token
         response.content = json.dumps(body)
@@ -51,15 +62,96 @@ def get_request_token(request):
     return None
 
 
+def get_user_by_token(token):
+    """
+    Пользователь по токену: при попадании в кеш токенов - CachedTokenUser без
+    запроса к базе, при промахе - поиск по индексу token_hash.
+    """
+    user = get_cached_user(token)
+    if user is not None:
+        return user
+
+    user = CustomUser.objects.filter(token_hash=token, is_active=True).first()
+    if user and user.token_created_at:
+        set_token_entry(token, user.pk, user.token_created_at)
+    return user
+
+
+def authenticate_opaque_token(request, token):
+    current_user = get_user_by_token(token) if verify_token(token) else None
+    if current_user is None:
+        return None, None
+
+    if (
+        current_user.token_created_at
+        + settings.TOKEN_SETTINGS.get("TOTAL_ACCESS_TOKEN_LIFETIME")
+        < timezone.now()
+    ):
+        current_user.token_hash = ""
+        current_user.save()
+        return None, None
+
+    if (
+        current_user.token_created_at
+        + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME")
+        < timezone.now()
+    ):
+        return current_user, create_token_obj(request, current_user)
+    return current_user, None
+
+
+def authenticate_signed_token(token):
+    """Проверка подписанного токена без запросов к базе, обновление - тоже без базы"""
+    current_user = get_user_by_signed_token(token)
+    if current_user is None:
+        return None, None
+
+    if (
+        current_user.token_issued_at
+        + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME")
+        < timezone.now()
+    ):
+        return current_user, issue_signed_token(
+            current_user.pk, current_user.token_generation_claim
+        )
+    return current_user, None
+
+
+def authenticate_token(request, token):
+    """Возвращает (пользователь или None, новый токен или None)"""
+    if settings.AUTH_TOKEN_MODE == AUTH_TOKEN_MODE_SIGNED:
+        return authenticate_signed_token(token)
+    return authenticate_opaque_token(request, token)
+
+
+def get_lazy_user(request, token):
+    """
+    Аутентификация по токену при первом обращении к request.user.
+    Новый токен, если он выпущен, сохраняется в request для ответа.
+    """
+    if not hasattr(request, "_cached_token_user"):
+        current_user, request._new_token = authenticate_token(request, token)
+        if current_user is None:
+            # Не «or»: bool() ленивого пользователя загрузил бы его из базы
+            current_user = AnonymousUser()
+        request._cached_token_user = current_user
+    return request._cached_token_user
+
+
+def is_auth_skipped(path):
+    return path.split("/")[1] == "admin" or path.startswith(
+        tuple(settings.AUTH_SKIP_PATHS)
+    )
+
+
 class CustomAuthenticationMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.path.split("/")[1] == "admin":
+        if is_auth_skipped(request.path):
             return self.get_response(request)
 
-        new_token = None
         current_user = AnonymousUser()
         bearer_token = None
         cookie_token = None
@@ -78,27 +170,12 @@ class CustomAuthenticationMiddleware:
 
         if cookie_token or bearer_token:
             token = cookie_token if bearer_token is None else bearer_token
-            if current_user := CustomUser.objects.filter(token_hash=token).first():
-                if (
-                    current_user.token_created_at
-                    + settings.TOKEN_SETTINGS.get("TOTAL_ACCESS_TOKEN_LIFETIME")
-                    < timezone.now()
-                ):
-                    current_user.token_hash = ""
-                    current_user.save()
-                    current_user = AnonymousUser()
-
-                elif (
-                    current_user.token_created_at
-                    + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME")
-                    < timezone.now()
-                ):
-                    new_token = create_token_obj(request, current_user)
-            else:
-                current_user = AnonymousUser()
+            # Поиск пользователя и обновление токена - только если представление прочитает user
+            current_user = SimpleLazyObject(lambda: get_lazy_user(request, token))
+        # _user читает DRF Request, поэтому JWTAuthentication не вызывается
         request.user = current_user
         request._user = current_user
         response = self.get_response(request)
-        if token := new_token:
+        if token := getattr(request, "_new_token", None):
             response = set_token_in_response(response, token)
         return response
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-17 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0002_alter_customuser_email"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="customuser",
+            name="token_hash",
+            field=models.CharField(
+                db_index=True,
+                default=None,
+                max_length=300,
+                null=True,
+                verbose_name="Token",
+            ),
+        ),
+    ]
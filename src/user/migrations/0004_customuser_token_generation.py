@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-17 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0003_customuser_token_hash_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="token_generation",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Token generation"
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-17 18:05
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Left, Length
+
+MAX_LENGTH = 2048
+
+
+def prepare_existing_logs(apps, schema_editor):
+    ErrorLog = apps.get_model("user", "ErrorLog")
+    ErrorLog.objects.update(last_seen_at=F("created_at"))
+    # Длинные описания не поместятся в varchar(2048)
+    ErrorLog.objects.annotate(length=Length("description")).filter(
+        length__gt=MAX_LENGTH
+    ).update(description=Left("description", MAX_LENGTH))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0004_customuser_token_generation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="errorlog",
+            name="fingerprint",
+            field=models.CharField(
+                editable=False,
+                max_length=64,
+                null=True,
+                unique=True,
+                verbose_name="Отпечаток",
+            ),
+        ),
+        migrations.AddField(
+            model_name="errorlog",
+            name="count",
+            field=models.PositiveIntegerField(default=1, verbose_name="Количество"),
+        ),
+        migrations.AddField(
+            model_name="errorlog",
+            name="last_seen_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="Последнее появление"
+            ),
+        ),
+        migrations.RunPython(prepare_existing_logs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="errorlog",
+            name="description",
+            field=models.CharField(max_length=2048, verbose_name="Описание ошибки"),
+        ),
+    ]
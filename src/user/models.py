@@ -1,6 +1,7 @@
 # from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AbstractUser, Group
 from django.db import models
+from django.utils import timezone
 
 
 class CustomUser(AbstractUser):
@@ -20,11 +21,14 @@ class CustomUser(AbstractUser):
         default=None,
     )
     token_hash = models.CharField(
-        max_length=300, verbose_name="Token", null=True, default=None
+        max_length=300, verbose_name="Token", null=True, default=None, db_index=True
     )
     token_created_at = models.DateTimeField(
         verbose_name="Token created at", null=True, default=None
     )
+    token_generation = models.PositiveIntegerField(
+        verbose_name="Token generation", default=0, editable=False
+    )
 
     def __str__(self):
         return self.email
@@ -43,8 +47,22 @@ class AccessGroup(Group):
 
 
 class ErrorLog(models.Model):
-    description = models.TextField(max_length=2048, verbose_name="Описание ошибки")
+    MAX_LENGTH = 2048
+
+    # varchar: ограничение длины соблюдается и на уровне базы
+    description = models.CharField(
+        max_length=MAX_LENGTH, verbose_name="Описание ошибки"
+    )
+    # Одинаковые ошибки копятся в одной записи: sha256 описания и их число.
+    # У записей, созданных до появления счетчика, отпечатка нет
+    fingerprint = models.CharField(
+        max_length=64, unique=True, null=True, editable=False, verbose_name="Отпечаток"
+    )
+    count = models.PositiveIntegerField(default=1, verbose_name="Количество")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Время создания")
+    last_seen_at = models.DateTimeField(
+        default=timezone.now, verbose_name="Последнее появление"
+    )
 
     class Meta:
         verbose_name = "Лог ошибки"
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .group_cache import bump_version, invalidate_users
+from .models import AccessGroup, CustomUser
+from .signed_tokens import revoke_signed_tokens
+from .token_cache import invalidate_token
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_token(sender, instance, **kwargs):
+    # __dict__ вместо атрибута: поле может быть отложено через only()
+    instance._cached_token_hash = instance.__dict__.get("token_hash")
+    instance._cached_is_active = instance.__dict__.get("is_active")
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_changed_token(sender, instance, **kwargs):
+    """Сбрасывает кеш старого токена при выходе, ротации токена и деактивации"""
+    old_token = instance._cached_token_hash
+    if old_token and (old_token != instance.token_hash or not instance.is_active):
+        invalidate_token(old_token)
+    instance._cached_token_hash = instance.token_hash
+
+    if instance._cached_is_active and not instance.is_active:
+        revoke_signed_tokens(instance)
+    instance._cached_is_active = instance.is_active
+
+
+@receiver(post_delete, sender=CustomUser)
+def invalidate_deleted_user_token(sender, instance, **kwargs):
+    invalidate_token(instance._cached_token_hash)
+    revoke_signed_tokens(instance)
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+def invalidate_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        invalidate_users([instance.pk])
+    elif pk_set is not None:
+        # group.user_set.add(...): в pk_set id пользователей
+        invalidate_users(pk_set)
+    else:
+        # group.user_set.clear(): состав неизвестен после очистки
+        bump_version()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=AccessGroup)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=AccessGroup)
+def invalidate_changed_group(sender, instance, **kwargs):
+    # Имя группы могло измениться у всех ее участников
+    bump_version()
@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import SimpleLazyObject
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import CustomUser
+
+# Режим AUTH_TOKEN_MODE = "signed": токен - JWT (simplejwt AccessToken) с id пользователя,
+# временем выпуска и поколением токенов пользователя. Проверка - только подпись,
+# срок действия и ключ отзыва в Redis, без запросов к базе.
+AUTH_TOKEN_MODE_OPAQUE = "opaque"
+AUTH_TOKEN_MODE_SIGNED = "signed"
+GENERATION_CLAIM = "gen"
+DENY_KEY_PREFIX = "auth:deny"
+
+
+class LazyTokenUser(SimpleLazyObject):
+    """
+    Пользователь из подписанного токена: id и признак аутентификации доступны сразу,
+    строка CustomUser загружается только при обращении к остальным атрибутам.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, generation, issued_at):
+        # Атрибуты пишутся в __dict__ напрямую: LazyObject перенаправляет setattr в объект
+        self.__dict__["_user_id"] = user_id
+        self.__dict__["token_generation_claim"] = generation
+        self.__dict__["token_issued_at"] = issued_at
+        super().__init__(
+            lambda: CustomUser.objects.filter(pk=user_id).first() or AnonymousUser()
+        )
+
+    @property
+    def pk(self):
+        return self.__dict__["_user_id"]
+
+    id = pk
+
+
+def _deny_key(user_id, generation):
+    return f"{DENY_KEY_PREFIX}:{user_id}:{generation}"
+
+
+def issue_signed_token(user_id, generation):
+    token = AccessToken()
+    token[api_settings.USER_ID_CLAIM] = user_id
+    token[GENERATION_CLAIM] = generation
+    return str(token)
+
+
+def is_token_denied(user_id, generation):
+    return cache.get(_deny_key(user_id, generation)) is not None
+
+
+def get_user_by_signed_token(token):
+    """LazyTokenUser для валидного неотозванного токена, иначе None"""
+    try:
+        access_token = AccessToken(token)
+    except TokenError:
+        return None
+    user_id = access_token.get(api_settings.USER_ID_CLAIM)
+    generation = access_token.get(GENERATION_CLAIM, 0)
+    if user_id is None or is_token_denied(user_id, generation):
+        return None
+    issued_at = datetime.fromtimestamp(access_token["iat"], tz=timezone.utc)
+    return LazyTokenUser(user_id, generation, issued_at)
+
+
+def revoke_signed_tokens(user):
+    """
+    Отзывает все выданные пользователю подписанные токены: текущее поколение
+    попадает в deny-список до истечения последнего токена, новые токены
+    выпускаются со следующим поколением.
+    """
+    timeout = settings.TOKEN_SETTINGS.get("TOTAL_ACCESS_TOKEN_LIFETIME").total_seconds()
+    cache.set(_deny_key(user.pk, user.token_generation), 1, timeout)
+    CustomUser.objects.filter(pk=user.pk).update(
+        token_generation=F("token_generation") + 1
+    )
+    user.token_generation += 1
@@ -0,0 +1,644 @@
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.test import force_authenticate
+
+from settings.aboba_swagger import (
+    aboba_swagger,
+    build_pending_schemas,
+    declared_groups,
+    pending_schemas,
+)
+from settings.openapi_schema import clear_artifacts
+
+from . import group_cache
+from .auth_utils import create_legacy_token, create_token, get_hashers, verify_token
+from .checks import check_aboba_groups
+from .error_log import KEY_PREFIX, flush_error_logs, get_fingerprint
+from .group_cache import get_group_names, get_request_group_names
+from .middleware import CustomAuthenticationMiddleware, get_user_by_token
+from .models import AccessGroup, CustomUser, ErrorLog
+from .signed_tokens import _deny_key, issue_signed_token
+from .token_cache import LocalTTLCache, get_token_entry, invalidate_token, local_cache
+
+settings.BEARER_AUTH = True
+settings.COOKIE_AUTH = True
+
+
+class LocalTTLCacheTest(TestCase):
+    """Tests for the in-process LRU cache"""
+
+    def test_evicts_least_recently_used(self):
+        lru = LocalTTLCache(maxsize=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), 3)
+
+    def test_entries_expire(self):
+        lru = LocalTTLCache(maxsize=2, ttl=0)
+        lru.set("a", 1)
+        self.assertIsNone(lru.get("a"))
+
+
+class TokenCacheTest(TestCase):
+    """Tests for the token -> user cache used by the authentication middleware"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="tokenuser", password="tokenpass123", email="token@example.com"
+        )
+        self.token = self.issue_token()
+
+    def issue_token(self):
+        token = create_token("127.0.0.1", f"timestamp{timezone.now()}")
+        self.user.token_hash = token
+        self.user.token_created_at = timezone.now()
+        self.user.save()
+        return token
+
+    def test_lookup_fills_cache(self):
+        self.assertIsNone(get_token_entry(self.token))
+        self.assertEqual(get_user_by_token(self.token), self.user)
+        self.assertEqual(get_token_entry(self.token)[0], self.user.pk)
+
+    def test_cached_lookup_skips_user_query(self):
+        get_user_by_token(self.token)
+        with self.assertNumQueries(0):
+            user = get_user_by_token(self.token)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertTrue(user.is_authenticated)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "token@example.com")
+
+    def test_token_due_for_refresh_is_loaded_from_database(self):
+        get_user_by_token(self.token)
+        later = timezone.now() + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME")
+        with patch("user.token_cache.timezone.now", return_value=later):
+            with self.assertNumQueries(1):
+                self.assertIs(type(get_user_by_token(self.token)), CustomUser)
+
+    def test_rotation_invalidates_old_token(self):
+        get_user_by_token(self.token)
+        new_token = self.issue_token()
+        self.assertIsNone(get_token_entry(self.token))
+        self.assertIsNone(get_user_by_token(self.token))
+        self.assertEqual(get_user_by_token(new_token), self.user)
+
+    def test_deactivation_invalidates_token(self):
+        get_user_by_token(self.token)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(get_token_entry(self.token))
+        self.assertIsNone(get_user_by_token(self.token))
+
+    def test_stale_local_entry_is_verified(self):
+        """Another process may still hold the entry in its local cache"""
+        get_user_by_token(self.token)
+        CustomUser.objects.filter(pk=self.user.pk).update(token_hash=None)
+        # Строка пользователя читается со сверкой токена
+        self.assertFalse(get_user_by_token(self.token).is_active)
+        invalidate_token(self.token)
+        self.assertIsNone(get_user_by_token(self.token))
+
+    def test_logout_invalidates_token(self):
+        self.client.cookies[settings.TOKEN_SETTINGS.get("NAME")] = self.token
+        self.client.get(reverse("barter:ad_list"))
+        self.assertIsNotNone(get_token_entry(self.token))
+        self.client.get(reverse("user:logout"))
+        self.assertIsNone(get_token_entry(self.token))
+        local_cache.clear()
+        self.assertIsNone(get_user_by_token(self.token))
+
+
+class TokenFormatTest(TestCase):
+    """Tests for the HMAC token format and legacy Argon2 tokens"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="formatuser", password="formatpass123", email="format@example.com"
+        )
+
+    def authenticate_with(self, token):
+        self.user.token_hash = token
+        self.user.token_created_at = timezone.now()
+        self.user.save()
+        self.client.cookies[settings.TOKEN_SETTINGS.get("NAME")] = token
+        return self.client.get(reverse("user:current"))
+
+    def test_token_verifies(self):
+        self.assertTrue(verify_token(create_token("127.0.0.1", "brow")))
+
+    def test_tokens_are_unique(self):
+        self.assertNotEqual(create_token("ip", "brow"), create_token("ip", "brow"))
+
+    def test_tampered_token_rejected(self):
+        token = create_token("127.0.0.1", "brow")
+        version, payload, signature = token.split(".")
+        self.assertFalse(verify_token(f"{version}.{payload}x.{signature}"))
+        self.assertFalse(verify_token(f"{version}.{payload}.{signature[:-1]}0"))
+        self.assertFalse(verify_token("garbage"))
+
+    def test_tampered_token_skips_database(self):
+        token = create_token("127.0.0.1", "brow")
+        self.client.cookies[settings.TOKEN_SETTINGS.get("NAME")] = token + "x"
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("user:current"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_token_authenticates(self):
+        response = self.authenticate_with(create_token("127.0.0.1", "brow"))
+        self.assertEqual(response.json()["user"]["email"], "format@example.com")
+
+    def test_legacy_token_accepted_during_migration_window(self):
+        response = self.authenticate_with(create_legacy_token("127.0.0.1", "brow"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_legacy_token_rejected_after_migration_window(self):
+        token_settings = {**settings.TOKEN_SETTINGS, "ACCEPT_LEGACY_TOKENS": False}
+        with override_settings(TOKEN_SETTINGS=token_settings):
+            response = self.authenticate_with(create_legacy_token("127.0.0.1", "brow"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_hashers_cached(self):
+        self.assertIs(get_hashers(), get_hashers())
+
+    def test_bench_tokens_command(self):
+        out = io.StringIO()
+        call_command("bench_tokens", iterations=1, stdout=out)
+        self.assertIn("mint hmac", out.getvalue())
+
+
+@override_settings(AUTH_TOKEN_MODE="signed")
+class SignedTokenTest(TestCase):
+    """Tests for stateless signed tokens (AUTH_TOKEN_MODE=signed)"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="signeduser", password="signedpass123", email="signed@example.com"
+        )
+        # Redis outlives the test database, so ids and generations repeat between runs
+        cache.delete_many(
+            [_deny_key(self.user.pk, generation) for generation in range(3)]
+        )
+        self.token = issue_signed_token(self.user.pk, self.user.token_generation)
+
+    def get_current(self, token):
+        self.client.cookies[settings.TOKEN_SETTINGS.get("NAME")] = token
+        return self.client.get(reverse("user:current"))
+
+    def test_token_authenticates(self):
+        response = self.get_current(self.token)
+        self.assertEqual(response.json()["user"]["email"], "signed@example.com")
+
+    def test_user_id_available_without_queries(self):
+        """Only the id is read, so the user row is never loaded"""
+        seen = {}
+
+        def view(request):
+            seen["user"] = request.user
+            seen["pk"] = request.user.pk
+            seen["is_authenticated"] = request.user.is_authenticated
+            return HttpResponse()
+
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        with self.assertNumQueries(0):
+            CustomAuthenticationMiddleware(view)(request)
+        self.assertEqual(seen["user"].token_generation_claim, 0)
+        self.assertEqual(seen["pk"], self.user.pk)
+        self.assertTrue(seen["is_authenticated"])
+        with self.assertNumQueries(1):
+            self.assertEqual(seen["user"].email, "signed@example.com")
+
+    def test_tampered_token_rejected(self):
+        response = self.get_current(self.token[:-2] + "xx")
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout_revokes_tokens(self):
+        other_token = issue_signed_token(self.user.pk, self.user.token_generation)
+        self.get_current(self.token)
+        self.client.get(reverse("user:logout"))
+        self.assertEqual(self.get_current(self.token).status_code, 302)
+        self.assertEqual(self.get_current(other_token).status_code, 302)
+
+        self.user.refresh_from_db()
+        new_token = issue_signed_token(self.user.pk, self.user.token_generation)
+        self.assertEqual(self.get_current(new_token).status_code, 200)
+
+    def test_deactivation_revokes_tokens(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_current(self.token).status_code, 302)
+
+
+class LazyUserTest(TestCase):
+    """Tests for the lazy request.user set by CustomAuthenticationMiddleware"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username="lazyuser", password="lazypass123", email="lazy@example.com"
+        )
+        self.token = create_token("127.0.0.1", "brow")
+        self.user.token_hash = self.token
+        self.user.token_created_at = timezone.now()
+        self.user.save()
+        local_cache.clear()
+
+    def run_middleware(self, view, path="/"):
+        request = RequestFactory().get(path, HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        return request, CustomAuthenticationMiddleware(view)(request)
+
+    def test_unread_user_skips_lookup(self):
+        with self.assertNumQueries(0):
+            self.run_middleware(lambda request: HttpResponse())
+        self.assertIsNone(get_token_entry(self.token))
+
+    def test_read_user_is_resolved_once(self):
+        def view(request):
+            self.assertEqual(request.user.email, "lazy@example.com")
+            self.assertTrue(request.user.is_authenticated)
+            return HttpResponse()
+
+        with self.assertNumQueries(1):
+            self.run_middleware(view)
+
+    def test_refresh_only_when_user_read(self):
+        self.user.token_created_at = timezone.now() - settings.TOKEN_SETTINGS.get(
+            "ACCESS_TOKEN_LIFETIME"
+        )
+        self.user.save()
+        self.run_middleware(lambda request: HttpResponse("{}"))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_hash, self.token)
+
+        def view(request):
+            request.user.pk
+            return HttpResponse("{}")
+
+        request, response = self.run_middleware(view)
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.token_hash, self.token)
+        self.assertEqual(json.loads(response.content)["token"], self.user.token_hash)
+
+    def test_skipped_paths(self):
+        def view(request):
+            self.assertFalse(hasattr(request, "_cached_token_user"))
+            return HttpResponse()
+
+        for path in ("/healthcheck/", "/static/app.css", "/openapi/"):
+            with self.assertNumQueries(0):
+                self.run_middleware(view, path)
+
+    def test_healthcheck_without_queries(self):
+        self.client.cookies[settings.TOKEN_SETTINGS.get("NAME")] = self.token
+        with self.assertNumQueries(0):
+            response = self.client.get("/healthcheck/")
+        self.assertEqual(response.status_code, 200)
+
+
+class GroupCacheTest(TestCase):
+    """Tests for the cached group names used by aboba_swagger group checks"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username="groupuser", password="grouppass123", email="group@example.com"
+        )
+        self.group = Group.objects.create(name="moderators")
+
+    def test_second_lookup_without_queries(self):
+        self.user.groups.add(self.group)
+        self.assertEqual(get_group_names(self.user.pk), {"moderators"})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_group_names(self.user.pk), {"moderators"})
+
+    def test_request_reuses_names(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        names = get_request_group_names(request)
+        with self.assertNumQueries(0):
+            self.assertIs(get_request_group_names(request), names)
+
+    def test_membership_change_invalidates_user(self):
+        self.assertEqual(get_group_names(self.user.pk), frozenset())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertEqual(get_group_names(self.user.pk), {"moderators"})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.remove(self.user)
+        self.assertEqual(get_group_names(self.user.pk), frozenset())
+
+    def test_stale_names_written_after_removal_are_not_served(self):
+        """A lookup that read the old membership must not outlive the removal"""
+        self.user.groups.add(self.group)
+        load = group_cache._load_group_names
+
+        def load_then_remove(user_id):
+            names = load(user_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.group.user_set.remove(self.user)
+            return names
+
+        with patch.object(group_cache, "_load_group_names", load_then_remove):
+            self.assertEqual(get_group_names(self.user.pk), {"moderators"})
+        self.assertEqual(get_group_names(self.user.pk), frozenset())
+
+    def test_group_rename_bumps_version(self):
+        self.user.groups.add(self.group)
+        get_group_names(self.user.pk)
+        self.group.name = "admins"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.save()
+        self.assertEqual(get_group_names(self.user.pk), {"admins"})
+
+
+class AbobaSwaggerTest(TestCase):
+    """Tests for the deferred schema building and group check of aboba_swagger"""
+
+    def decorate(self, **kwargs):
+        def secured_view(request):
+            return HttpResponse()
+
+        pending_count, groups_count = len(pending_schemas), len(declared_groups)
+        view = aboba_swagger(http_methods=["GET"], **kwargs)(secured_view)
+        self.addCleanup(self.forget, view, pending_count, groups_count)
+        return view
+
+    @staticmethod
+    def forget(view, pending_count, groups_count):
+        pending_schemas[pending_count:] = [
+            item for item in pending_schemas[pending_count:] if item[0] is not view
+        ]
+        del declared_groups[groups_count:]
+
+    def test_decoration_without_queries(self):
+        with self.assertNumQueries(0):
+            view = self.decorate(groups=["missing"], body_params={"title": str})
+        self.assertIn(view, [item[0] for item in pending_schemas])
+        self.assertFalse(hasattr(view.cls, "kwargs"))
+
+    def test_schema_built_by_hook(self):
+        view = self.decorate(groups=["missing"], responses={"200": "ok"})
+        self.assertEqual(build_pending_schemas(endpoints=["endpoint"]), ["endpoint"])
+        self.assertNotIn(view, [item[0] for item in pending_schemas])
+        self.assertIn("schema", view.cls.get.kwargs)
+
+    def test_openapi_builds_pending_schemas(self):
+        # Без готового файла схемы запрос доходит до живого генератора
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        clear_artifacts()
+        self.addCleanup(clear_artifacts)
+        with override_settings(OPENAPI_SCHEMA_DIR=Path(directory)):
+            response = self.client.get("/openapi/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(pending_schemas, [])
+
+    def test_missing_group_warning(self):
+        AccessGroup.objects.create(name="Managers")
+        self.decorate(groups=["Managers", "missing"])
+        warnings = [
+            warning
+            for warning in check_aboba_groups(databases=["default"])
+            if warning.obj.endswith("secured_view")
+        ]
+        self.assertEqual([warning.msg for warning in warnings], ["Нет группы missing"])
+        self.assertEqual(check_aboba_groups(databases=None), [])
+
+    def test_group_check_at_request_time(self):
+        view = self.decorate(groups=["Managers"])
+        user = CustomUser.objects.create_user(
+            username="manager", password="managerpass123", email="m@example.com"
+        )
+        request = RequestFactory().get("/")
+        force_authenticate(request, user)
+        self.assertEqual(view(request).status_code, 403)
+
+        user.groups.add(AccessGroup.objects.create(name="Managers"))
+        cache.clear()
+        request = RequestFactory().get("/")
+        force_authenticate(request, user)
+        self.assertEqual(view(request).status_code, 200)
+
+    def test_validated_arguments(self):
+        received = {}
+        pending_count, groups_count = len(pending_schemas), len(declared_groups)
+
+        @aboba_swagger(
+            http_methods=["POST"],
+            query_params={"page": int, "strict": bool},
+            body_params={"title": str, "items": [{"id": int}]},
+            validate=True,
+        )
+        def validated_view(request, **params):
+            received.update(params)
+            return HttpResponse()
+
+        self.addCleanup(self.forget, validated_view, pending_count, groups_count)
+        factory = RequestFactory()
+        request = factory.post(
+            "/?page=2&strict=",
+            {"title": "Книга", "items": [{"id": 1}, {"id": "2"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(validated_view(request).status_code, 200)
+        self.assertEqual(
+            received,
+            {
+                "page": 2,
+                "strict": None,
+                "title": "Книга",
+                "items": [{"id": 1}, {"id": 2}],
+            },
+        )
+
+        request = factory.post(
+            "/?page=first",
+            {"items": [{"id": 1}, {"id": "x"}]},
+            content_type="application/json",
+        )
+        response = validated_view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data["errors"]), {"page", "title", "items.1.id"})
+
+    def test_log_error_validation(self):
+        for body in ({}, {"description": 42}, {"description": "x" * 2049}):
+            response = self.client.post(
+                "/log_error/", body, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("description", response.json()["errors"])
+
+    def test_bench_validation_command(self):
+        out = io.StringIO()
+        call_command("bench_validation", iterations=10, stdout=out)
+        self.assertIn("AdCreateUpdateSerializer", out.getvalue())
+
+    def test_bench_startup_command(self):
+        out = io.StringIO()
+        call_command("bench_startup", iterations=1, stdout=out)
+        self.assertIn("django.setup()", out.getvalue())
+        self.assertIn("запросов к базе при импорте URLconf: 0", out.getvalue())
+
+
+class OpenApiSchemaTest(TestCase):
+    """Tests for the prebuilt OpenAPI schema served by /openapi/"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        override = override_settings(OPENAPI_SCHEMA_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        clear_artifacts()
+        self.addCleanup(clear_artifacts)
+
+    def build(self, **options):
+        call_command("build_openapi_schema", stdout=io.StringIO(), **options)
+
+    def test_live_fallback_without_artifact(self):
+        response = self.client.get("/openapi/", {"format": "json"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("paths", json.loads(response.content))
+        self.assertNotIn("ETag", response)
+
+    def test_artifact_with_etag(self):
+        self.build()
+        response = self.client.get("/openapi/", {"format": "json"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("paths", json.loads(response.content))
+
+        etag = response["ETag"]
+        response = self.client.get(
+            "/openapi/", {"format": "json"}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        response = self.client.get(
+            "/openapi/", {"format": "json"}, HTTP_IF_NONE_MATCH=f"W/{etag}"
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_representation(self):
+        self.build()
+        plain = self.client.get("/openapi/")
+        compressed = self.client.get("/openapi/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertTrue(plain.content.startswith(b"openapi:"))
+        self.assertNotEqual(compressed["ETag"], plain["ETag"])
+
+    def test_check_and_stale_cleanup(self):
+        stale = self.directory / "openapi-0000000000000000.json.gz"
+        stale.write_bytes(b"")
+        with self.assertRaises(CommandError):
+            self.build(check=True)
+        self.build()
+        self.assertFalse(stale.exists())
+        self.build(check=True)
+
+
+class ErrorLogIngestionTest(TestCase):
+    """Tests for the buffered, rate-limited /log_error/ ingestion"""
+
+    def setUp(self):
+        cache.clear()
+        redis = get_redis_connection("default")
+        keys = list(redis.scan_iter(f"{KEY_PREFIX}:*"))
+        if keys:
+            redis.delete(*keys)
+
+    def log(self, description, ip="10.0.0.1"):
+        return self.client.post(
+            "/log_error/",
+            {"description": description},
+            content_type="application/json",
+            REMOTE_ADDR=ip,
+        )
+
+    def test_duplicates_are_counted(self):
+        for _ in range(3):
+            self.assertEqual(self.log("TypeError: x is undefined").status_code, 202)
+        self.log("TypeError:   x is undefined\n", ip="10.0.0.2")
+        self.log("ReferenceError: y")
+        self.assertFalse(ErrorLog.objects.exists())
+
+        with self.assertNumQueries(4):
+            self.assertEqual(flush_error_logs(), 2)
+        counts = dict(ErrorLog.objects.values_list("description", "count"))
+        self.assertEqual(
+            counts, {"TypeError: x is undefined": 4, "ReferenceError: y": 1}
+        )
+
+        self.log("TypeError: x is undefined")
+        flush_error_logs()
+        log = ErrorLog.objects.get(
+            fingerprint=get_fingerprint("TypeError: x is undefined")
+        )
+        self.assertEqual(log.count, 5)
+        self.assertGreaterEqual(log.last_seen_at, log.created_at)
+        self.assertEqual(flush_error_logs(), 0)
+
+    @override_settings(ERROR_LOG_RATE_PER_IP=2)
+    def test_per_ip_limit(self):
+        self.assertEqual(self.log("a").status_code, 202)
+        self.assertEqual(self.log("b").status_code, 202)
+        response = self.log("c")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+        self.assertEqual(self.log("c", ip="10.0.0.2").status_code, 202)
+
+    @override_settings(ERROR_LOG_RATE_PER_IP=2)
+    def test_spoofed_forwarded_for_does_not_reset_ip_limit(self):
+        """The client part of X-Forwarded-For is ignored, the proxy's entry is used"""
+        statuses = [
+            self.client.post(
+                "/log_error/",
+                {"description": f"error {i}"},
+                content_type="application/json",
+                REMOTE_ADDR="127.0.0.1",
+                HTTP_X_FORWARDED_FOR=f"192.0.2.{i}, 10.0.0.1",
+            ).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [202, 202, 429])
+        redis = get_redis_connection("default")
+        self.assertEqual(len(list(redis.scan_iter(f"{KEY_PREFIX}:rate:ip:*"))), 1)
+
+    @override_settings(ERROR_LOG_RATE_GLOBAL=1)
+    def test_global_limit(self):
+        self.assertEqual(self.log("a").status_code, 202)
+        self.assertEqual(self.log("b", ip="10.0.0.2").status_code, 429)
+
+    @override_settings(ERROR_LOG_MAX_PENDING=1)
+    def test_buffer_limit_keeps_counting_known_errors(self):
+        self.assertEqual(self.log("a").status_code, 202)
+        self.assertEqual(self.log("b").status_code, 429)
+        self.assertEqual(self.log("a").status_code, 202)
+        flush_error_logs()
+        self.assertEqual(
+            list(ErrorLog.objects.values_list("description", "count")), [("a", 2)]
+        )
+
+    def test_flush_command(self):
+        self.log("a")
+        out = io.StringIO()
+        call_command("flush_error_logs", once=True, stdout=out)
+        self.assertIn("1", out.getvalue())
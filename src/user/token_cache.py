@@ -0,0 +1,148 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from .models import CustomUser
+
+# Двухуровневый кеш токен -> (id пользователя, время создания токена):
+# LRU в памяти процесса с коротким временем жизни перед общим кешем в Redis.
+# Запись живет, пока токен не требует обновления: попадание в кеш не читает
+# строку пользователя. Локальный уровень других процессов нельзя сбросить,
+# поэтому его TTL короткий, а строка пользователя, если ее все же загрузят,
+# читается со сверкой token_hash.
+KEY_PREFIX = "user:token"
+
+
+class LocalTTLCache:
+    """Потокобезопасный LRU кеш процесса с ограниченным временем жизни записей"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedTokenUser(SimpleLazyObject):
+    """
+    Пользователь из записи кеша токенов: id и время создания токена доступны сразу,
+    строка CustomUser загружается только при обращении к остальным атрибутам.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token, user_id, token_created_at):
+        # Атрибуты пишутся в __dict__ напрямую: LazyObject перенаправляет setattr в объект
+        self.__dict__["_user_id"] = user_id
+        self.__dict__["token_created_at"] = token_created_at
+        super().__init__(
+            lambda: CustomUser.objects.filter(
+                pk=user_id, token_hash=token, is_active=True
+            ).first()
+            or AnonymousUser()
+        )
+
+    @property
+    def pk(self):
+        return self.__dict__["_user_id"]
+
+    id = pk
+
+
+local_cache = LocalTTLCache(
+    maxsize=settings.TOKEN_SETTINGS.get("CACHE_LOCAL_SIZE"),
+    ttl=settings.TOKEN_SETTINGS.get("CACHE_LOCAL_TTL").total_seconds(),
+)
+
+
+def _token_key(token):
+    # В Redis хранится не сам токен, а его отпечаток фиксированной длины
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_token_entry(token):
+    """(id пользователя, timestamp создания токена) или None, если токена нет в кеше"""
+    key = _token_key(token)
+    entry = local_cache.get(key)
+    if entry is None:
+        entry = cache.get(f"{KEY_PREFIX}:{key}")
+        if entry is not None:
+            local_cache.set(key, entry)
+    return entry
+
+
+def get_cached_user(token):
+    """
+    CachedTokenUser по записи кеша или None. Токен, которому пора обновиться
+    или который истек, из кеша не отдается: обновлению нужна строка пользователя.
+    """
+    entry = get_token_entry(token)
+    if entry is None:
+        return None
+    user_id, created_timestamp = entry
+    token_created_at = datetime.fromtimestamp(
+        created_timestamp, tz=timezone.get_current_timezone()
+    )
+    if (
+        token_created_at + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME")
+        < timezone.now()
+    ):
+        return None
+    return CachedTokenUser(token, user_id, token_created_at)
+
+
+def set_token_entry(token, user_id, token_created_at):
+    """Кеширует токен, пока он не требует обновления"""
+    expires_at = token_created_at + settings.TOKEN_SETTINGS.get("ACCESS_TOKEN_LIFETIME")
+    timeout = (expires_at - timezone.now()).total_seconds()
+    if timeout <= 0:
+        return
+    key = _token_key(token)
+    entry = (user_id, token_created_at.timestamp())
+    cache.set(f"{KEY_PREFIX}:{key}", entry, timeout)
+    local_cache.set(key, entry, timeout)
+
+
+def invalidate_token(token):
+    if not token:
+        return
+    key = _token_key(token)
+    local_cache.delete(key)
+    cache.delete(f"{KEY_PREFIX}:{key}")
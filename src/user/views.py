@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
@@ -9,6 +10,7 @@ from django.utils import timezone
 from .forms import CustomAuthenticationForm, CustomUserCreationForm
 from .middleware import create_token_obj, set_token_in_response
 from .models import CustomUser
+from .signed_tokens import AUTH_TOKEN_MODE_SIGNED, revoke_signed_tokens
 
 
 def register(request):
@@ -80,6 +82,8 @@ def logout_view(request):
     request.user.token_hash = None
     request.user.token_created_at = None
     request.user.save()
+    if settings.AUTH_TOKEN_MODE == AUTH_TOKEN_MODE_SIGNED:
+        revoke_signed_tokens(request.user)
 
     return redirect("barter:ad_list")
 